@@ -0,0 +1,65 @@
+"""
+Время до последней доставки одной рассылки на 10k, 50k и 100k подписчиков
+против заглушки Bot API (сценарий broadcast из scenarios.py, каждый размер
+в своём процессе). Заглушка отвечает с задержкой, часть чатов заблокирована,
+повторное сообщение в чат раньше --chat-interval получает 429.
+
+При обычном лимите Telegram (~30 сообщений/с на бота) время рассылки равно
+получатели / BROADCAST_RATE и от движка не зависит, поэтому по умолчанию
+лимит — 1000 сообщений/с (платные рассылки); так видно, сколько добавляет
+сам движок сверх идеальных получатели / rate секунд.
+
+    python benchmarks/broadcast.py --json benchmarks/results/broadcast.json
+    python benchmarks/broadcast.py --sizes 10000 --workers 0 2 --rate 500
+"""
+
+import argparse
+
+from fake_api import dump_results
+from run import run_scenario, start_fake_api
+from scenarios import add_scenario_arguments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_scenario_arguments(parser)
+    parser.set_defaults(rate=1000)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 100000], help='подписчиков в рассылке')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0], help='значения BROADCAST_WORKERS')
+    parser.add_argument('--latency', type=float, default=0.02, help='задержка ответа заглушки, секунд')
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help='сообщений в секунду до ответов 429; по умолчанию — с запасом 10%% над --rate')
+    parser.add_argument('--flood-probability', type=float, default=0.0)
+    parser.add_argument('--blocked-fraction', type=float, default=0.02)
+    parser.add_argument('--chat-interval', type=float, default=1.0)
+    parser.add_argument('--json', help='куда сохранить результаты')
+    parser.add_argument('--verbose', action='store_true', help='показывать вывод бота')
+    args = parser.parse_args()
+    args.rate_limit = args.rate_limit or args.rate * 1.1
+
+    results = []
+    api, api_url = start_fake_api(args)
+    try:
+        for workers in args.workers:
+            for size in args.sizes:
+                args.broadcast_users = size
+                result = run_scenario('broadcast', workers, api_url, args)
+                results.append(result)
+                print(f"{size} подписчиков, воркеров {workers}: последняя доставка {result['last_delivery_s']:.1f} с "
+                      f"(идеал {result['ideal_s']:.1f} с), {result['messages_per_s']:.0f} сообщ./с, "
+                      f"p50 {result['delivery_p50_s']:.1f} с, p95 {result['delivery_p95_s']:.1f} с, "
+                      f"429: {result['rate_limited_responses']}, CPU {result['cpu_ms_per_message']:.2f} мс/сообщ.")
+    finally:
+        api.terminate()
+        api.wait()
+
+    if args.json:
+        dump_results(args.json, {'benchmark': 'broadcast', 'rate': args.rate, 'latency': args.latency,
+                                 'jitter': args.jitter, 'rate_limit': args.rate_limit,
+                                 'chat_interval': args.chat_interval, 'blocked_fraction': args.blocked_fraction,
+                                 'results': results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Расчёт расписания по координатам (prayer_calc): точность против
+prayer_times_cherkessk.csv и пропускная способность в городо-годах в секунду.
+
+Точность — максимальное и среднее отклонение от CSV в минутах по каждому
+намазу для выбранного метода и поправок; так подбираются CALC_ADJUSTMENTS.
+Пропускная способность — расчёт года для сетки из --cities мест с разной
+долготой (худший случай: общего положения Солнца нет), без кэша модуля;
+берётся минимум из --repeat.
+
+    python benchmarks/calculation.py --method MWL --adjustments "Maghrib=-3" --json benchmarks/results/calculation.json
+"""
+
+import argparse
+import csv
+import os
+import sys
+import timeit
+
+from fake_api import dump_results
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHERKESSK = (44.22333, 42.05778, 3)
+
+
+def import_prayer_calc():
+    sys.path.insert(0, REPO_DIR)
+    import prayer_calc
+    return prayer_calc
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--method', default='MWL')
+    parser.add_argument('--adjustments', default='', help='поправки в минутах, например "Duhr=15,Asr=8,Maghrib=-3"')
+    parser.add_argument('--year', type=int, default=2024, help='год сравнения с CSV')
+    parser.add_argument('--cities', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5, help='повторов замера скорости, берётся минимум')
+    parser.add_argument('--json', help='куда сохранить результаты')
+    args = parser.parse_args()
+
+    calc = import_prayer_calc()
+    adjustments = calc.parse_adjustments(args.adjustments)
+    cherkessk = calc.Location(*CHERKESSK)
+    with open(os.path.join(REPO_DIR, 'prayer_times_cherkessk.csv'), encoding='utf-8') as file:
+        reference = {row['Date'].strip(): {k: v.strip() for k, v in row.items() if k != 'Date'}
+                     for row in csv.DictReader(file)}
+    calculated = calc.calculate_year([cherkessk], args.year, args.method, adjustments=adjustments, cache=False)
+    deviation = {prayer: {'max_min': worst, 'mean_min': mean}
+                 for prayer, (worst, mean) in calc.compare(calculated[cherkessk], reference).items()}
+
+    grid = [calc.Location(40 + i * 0.1, 38 + i * 0.1, 3) for i in range(args.cities)]
+    seconds = min(timeit.repeat(lambda: calc.calculate_year(grid, args.year + 1, args.method, cache=False),
+                                number=1, repeat=args.repeat))
+
+    print(f"Метод {args.method}, поправки {adjustments or 'нет'}, отклонение от CSV (макс / среднее, мин):")
+    for prayer, result in deviation.items():
+        print(f"  {prayer:<10} {result['max_min']:>4} / {result['mean_min']:.1f}")
+    print(f"Пакет из {len(grid)} городов: {seconds:.2f} с, {len(grid) / seconds:.0f} городо-лет/с")
+    if args.json:
+        dump_results(args.json, {'benchmark': 'calculation', 'method': args.method, 'adjustments': adjustments,
+                                 'year': args.year, 'deviation': deviation, 'cities': len(grid),
+                                 'seconds': seconds, 'city_years_per_s': len(grid) / seconds})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Много городов в одном процессе: 100 рассчитываемых городов (CALC_CITIES,
+сетка по югу России в поясе Москвы) по --users-per-city подписчиков.
+
+Отчёт:
+  jobs       — заданий на день после слияния одинаковых минут против
+               города × намазы × 2 (уведомление и напоминание) без слияния
+  memory     — память расписаний всех городов и подписок с индексом
+               (tracemalloc), время загрузки расписаний
+  fan-out    — для --jobs самых больших заданий дня: задержка от старта
+               задания до первой отправки в каждый его город и до последней
+               отправки; Bot API заменён мгновенной заглушкой, лимит скорости
+               снят, поэтому меряется только работа бота
+
+    python benchmarks/cities.py --json benchmarks/results/cities.json
+"""
+
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, time as dt_time
+
+from fake_api import dump_results
+from generators import ALL_PRAYERS_MASK, FIRST_USER_ID, write_subscriptions_db
+from scenarios import percentile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def city_grid(count):
+    """{город: (широта, долгота)}: сетка 42–51° с. ш., 36–49,5° в. д."""
+    side = int(count ** 0.5 + 0.999)
+    return {f"city{i:03d}": (round(42 + (i // side) * 9 / side, 3), round(36 + (i % side) * 13.5 / side, 3))
+            for i in range(count)}
+
+
+def import_main(workdir, cities):
+    os.environ.update({
+        'API_TOKEN': '1:bench',
+        'CITIES_DIR': REPO_DIR,
+        'CALC_CITIES': ';'.join(f"{city}={lat},{lon}" for city, (lat, lon) in cities.items()),
+        'CSV_WATCH_INTERVAL': '0',
+        'TIMETABLE_CACHE_DIR': '',
+        'METRICS_ENABLED': '0',
+    })
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    logging.disable(logging.INFO)
+    import main
+    return main
+
+
+def traced(func):
+    """(результат, прирост занятой памяти в байтах) под уже запущенным tracemalloc"""
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    result = func()
+    gc.collect()
+    return result, tracemalloc.get_traced_memory()[0] - before
+
+
+async def fan_out(bot, jobs):
+    """Для каждого задания: (получателей, [задержка первой отправки в город], задержка последней)"""
+    first_send = {}
+    sent = []
+
+    async def send_message(chat_id, text, **kwargs):
+        city = bot.get_user_city(chat_id)
+        now = time.perf_counter()
+        first_send.setdefault(city, now)
+        sent.append(now)
+        return True
+
+    bot.bot.send_message = send_message
+    bot.broadcast_limiter = bot.TokenBucket(10 ** 9, 10 ** 9)
+    bot.delivery_task = asyncio.create_task(bot.process_delivery_events())
+    results = []
+    for job_id, (fire_dt, is_reminder, targets) in jobs:
+        # В жизни задания разнесены на минуты; здесь они подряд и упёрлись бы в CHAT_MIN_INTERVAL
+        bot.chat_not_before.clear()
+        first_send.clear()
+        sent.clear()
+        started = time.perf_counter()
+        await bot.run_notification_job(job_id, fire_dt, is_reminder, targets, now=fire_dt)
+        results.append((len(sent), [t - started for t in first_send.values()], max(sent, default=started) - started))
+        while not bot.delivery_events.empty():
+            await asyncio.sleep(0)
+    bot.delivery_task.cancel()
+    return results
+
+
+async def run(args, workdir):
+    cities = city_grid(args.cities)
+    bot = import_main(workdir, cities)
+    rng = random.Random(1)
+    users = [(FIRST_USER_ID + i, ALL_PRAYERS_MASK if rng.random() < 0.7 else rng.randint(1, ALL_PRAYERS_MASK), city)
+             for i, city in enumerate(city for city in cities for _ in range(args.users_per_city))]
+    write_subscriptions_db(os.path.join(workdir, bot.SUBSCRIPTIONS_DB), users)
+    del users
+    bot.init_db()
+    bot.load_prayer_data()
+
+    def load_timetables():
+        bot.registry.swap({city: bot.registry.read(city) for city in cities})
+
+    started = time.perf_counter()
+    load_timetables()
+    load_s = time.perf_counter() - started
+    # Память — на повторной загрузке: под tracemalloc расчёт идёт в разы медленнее
+    for city in cities:
+        del bot.registry.loaded[city]
+    tracemalloc.start()
+    _, timetable_bytes = traced(load_timetables)
+
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    bot.load_user_cities()
+    await bot.load_subscriptions()
+    gc.collect()
+    user_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    day = datetime.strptime(args.date, '%Y-%m-%d').date()
+    midnight = bot.TIMEZONE.localize(datetime.combine(day, dt_time()))
+    plan = [job for job in bot.notification_plan(midnight, days=1).items() if job[1][0].date() == day]
+    targets = sum(len(job[1][2]) for job in plan)
+    busiest = sorted(plan, key=lambda job: -len(job[1][2]))[:args.jobs]
+    fan = await fan_out(bot, busiest)
+    first = [delay for _, delays, _ in fan for delay in delays]
+    return {
+        'cities': len(cities),
+        'users': len(bot.subscriptions),
+        'jobs': len(plan),
+        'jobs_unmerged': targets,
+        'max_targets_per_job': max(len(job[1][2]) for job in plan),
+        'timetable_load_s': load_s,
+        'timetable_bytes_per_city': timetable_bytes / len(cities),
+        'user_bytes_per_user': user_bytes / len(bot.subscriptions),
+        'fan_out_jobs': [{'targets': len(job[1][2]), 'messages': messages, 'first_send_max_s': max(delays, default=0.0),
+                          'last_send_s': last} for job, (messages, delays, last) in zip(busiest, fan)],
+        'first_send_p50_s': percentile(first, 50),
+        'first_send_max_s': max(first, default=0.0),
+        'messages_per_s': sum(m for m, _, _ in fan) / sum(last for _, _, last in fan),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cities', type=int, default=100)
+    parser.add_argument('--users-per-city', type=int, default=10000)
+    parser.add_argument('--jobs', type=int, default=5, help='самых больших заданий для замера рассылки')
+    parser.add_argument('--date', default='2026-10-17', help='день плана, YYYY-MM-DD')
+    parser.add_argument('--json', help='куда сохранить результаты')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='prayer-bot-cities-') as workdir:
+        cwd = os.getcwd()
+        try:
+            result = asyncio.run(run(args, workdir))
+        finally:
+            os.chdir(cwd)
+    print(f"городов {result['cities']}, подписчиков {result['users']}; заданий на день {result['jobs']} "
+          f"вместо {result['jobs_unmerged']} (до {result['max_targets_per_job']} городов в задании)")
+    print(f"расписания: {result['timetable_load_s']:.1f} с, {result['timetable_bytes_per_city'] / 1024:.1f} КиБ на город; "
+          f"подписки {result['user_bytes_per_user']:.0f} байт/пользователь")
+    for job in result['fan_out_jobs']:
+        print(f"  задание на {job['targets']} городов, {job['messages']} сообщений: первая отправка в каждый город "
+              f"не позже {job['first_send_max_s'] * 1000:.0f} мс, последняя через {job['last_send_s']:.2f} с")
+    print(f"первая отправка в город: p50 {result['first_send_p50_s'] * 1000:.0f} мс, "
+          f"максимум {result['first_send_max_s'] * 1000:.0f} мс; {result['messages_per_s']:.0f} сообщ./с")
+    if args.json:
+        dump_results(args.json, {'benchmark': 'cities', 'users_per_city': args.users_per_city, 'date': args.date,
+                                 **result})
+
+
+if __name__ == "__main__":
+    main()
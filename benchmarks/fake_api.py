@@ -0,0 +1,235 @@
+"""
+Локальная замена Telegram Bot API для бенчмарков.
+
+Сервер aiohttp отвечает на запросы вида /bot<token>/<method>, записывает
+каждый вызов и раздаёт через getUpdates обновления, положенные в очередь
+методом push_update(). Бот направляется на него переменной окружения
+TELEGRAM_API_URL, поэтому всё работает без сети.
+
+Можно внести помехи: задержку ответа, ответы 429 с retry_after (при
+превышении rate_limit сообщений в секунду, при повторном сообщении в чат
+раньше чем через chat_interval секунд или случайно с вероятностью
+flood_probability) и заблокированные чаты (доля blocked_fraction,
+детерминированно по chat_id — см. is_blocked()).
+
+Отдельным процессом, чтобы нагрузка заглушки не делила цикл событий с ботом:
+
+    python benchmarks/fake_api.py --port 8081 --latency 0.02 --rate-limit 30
+
+Первая строка вывода — адрес сервера. GET /_stats отдаёт счётчики вызовов,
+POST /_reset их обнуляет, POST /_updates кладёт обновление из тела запроса
+в очередь getUpdates и отвечает его update_id.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+BLOCKED_DESCRIPTION = "Forbidden: bot was blocked by the user"
+SEND_METHODS = {'sendMessage', 'editMessageText', 'editMessageReplyMarkup'}
+
+
+def is_blocked(chat_id, fraction):
+    """Заблокировал ли чат бота; одинаково для заглушки и генераторов пользователей"""
+    return (chat_id * 2654435761) % 10000 < fraction * 10000
+
+
+class FakeBotAPI:
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit=0.0, flood_probability=0.0, blocked_fraction=0.0, seed=1,
+                 chat_interval=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit  # сообщений в секунду на весь бот, 0 — без ограничения
+        self.flood_probability = flood_probability
+        self.blocked_fraction = blocked_fraction
+        self.chat_interval = chat_interval  # секунд между сообщениями в один чат, 0 — без ограничения
+        self.chat_sent = {}  # chat_id -> time.monotonic() последнего принятого сообщения
+        self.rng = random.Random(seed)
+        self.tokens = rate_limit
+        self.tokens_updated = time.monotonic()
+        self.updates = []  # обновления для getUpdates
+        self.calls = []  # (time.monotonic(), метод, параметры)
+        self.counts = Counter()  # "метод:статус" -> число ответов
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.new_update = asyncio.Event()
+        self.runner = None
+        self.url = None
+
+    # ---------- обновления ----------
+    def push_update(self, update):
+        """Кладёт обновление в очередь getUpdates; update_id назначается здесь"""
+        update = {**update, 'update_id': next(self.update_ids)}
+        self.updates.append(update)
+        self.new_update.set()
+        return update['update_id']
+
+    def calls_of(self, method):
+        return [call for call in self.calls if call[1] == method]
+
+    async def wait_for_calls(self, method, count=1, timeout=60):
+        """Ждёт, пока метод будет вызван count раз; возвращает время последнего из них"""
+        deadline = time.monotonic() + timeout
+        while True:
+            calls = self.calls_of(method)
+            if len(calls) >= count:
+                return calls[count - 1][0]
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{method}: {len(calls)} из {count} вызовов за {timeout} с")
+            await asyncio.sleep(0.005)
+
+    # ---------- помехи ----------
+    def retry_after(self, chat_id):
+        """Секунд до повтора, если отправку нужно отклонить с 429, иначе None"""
+        if self.flood_probability and self.rng.random() < self.flood_probability:
+            return 1
+        now = time.monotonic()
+        if self.chat_interval:
+            since = now - self.chat_sent.get(chat_id, -math.inf)
+            if since < self.chat_interval:
+                return max(1, math.ceil(self.chat_interval - since))
+        if self.rate_limit:
+            self.tokens = min(self.rate_limit, self.tokens + (now - self.tokens_updated) * self.rate_limit)
+            self.tokens_updated = now
+            if self.tokens < 1:
+                return max(1, math.ceil((1 - self.tokens) / self.rate_limit))
+            self.tokens -= 1
+        if self.chat_interval:
+            self.chat_sent[chat_id] = now
+        return None
+
+    # ---------- методы Bot API ----------
+    async def api_getMe(self, params):
+        return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+    async def api_getUpdates(self, params):
+        offset = int(params.get('offset') or 0)
+        self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        if not self.updates:
+            self.new_update.clear()
+            try:
+                # Длинный опрос укорочен, чтобы бот быстрее замечал остановку
+                await asyncio.wait_for(self.new_update.wait(), min(float(params.get('timeout') or 0), 1.0))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:int(params.get('limit') or 100)]
+
+    async def api_sendMessage(self, params):
+        return {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(params['chat_id']), 'type': 'private'},
+            'text': params.get('text', ''),
+        }
+
+    async def api_editMessageText(self, params):
+        return await self.api_sendMessage(params)
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        params = dict(await request.post())
+        self.calls.append((time.monotonic(), method, params))
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.rng.random() * self.jitter)
+        if method in SEND_METHODS:
+            if self.blocked_fraction and is_blocked(int(params.get('chat_id') or 0), self.blocked_fraction):
+                self.counts[f"{method}:403"] += 1
+                return web.json_response({'ok': False, 'error_code': 403, 'description': BLOCKED_DESCRIPTION}, status=403)
+            retry_after = self.retry_after(int(params.get('chat_id') or 0))
+            if retry_after is not None:
+                self.counts[f"{method}:429"] += 1
+                return web.json_response({'ok': False, 'error_code': 429,
+                                          'description': f"Too Many Requests: retry after {retry_after}",
+                                          'parameters': {'retry_after': retry_after}}, status=429)
+        self.counts[f"{method}:200"] += 1
+        handler = getattr(self, f"api_{method}", None)
+        result = await handler(params) if handler else True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def handle_stats(self, request):
+        return web.json_response(dict(self.counts))
+
+    async def handle_push_update(self, request):
+        return web.json_response({'update_id': self.push_update(await request.json())})
+
+    async def handle_reset(self, request):
+        self.counts.clear()
+        self.calls.clear()
+        return web.json_response({'ok': True})
+
+    # ---------- сервер ----------
+    async def start(self, host='127.0.0.1', port=0):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/_stats', self.handle_stats)
+        app.router.add_post('/_reset', self.handle_reset)
+        app.router.add_post('/_updates', self.handle_push_update)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+def text_message(user_id, text):
+    """Обновление с текстовым сообщением пользователя (без update_id)"""
+    return {'message': {
+        'message_id': 1,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+        'text': text,
+    }}
+
+
+def callback_query(user_id, data):
+    """Обновление с нажатием инлайн-кнопки под сообщением бота (без update_id)"""
+    return {'callback_query': {
+        'id': str(user_id),
+        'chat_instance': str(user_id),
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+        'message': {'message_id': 1, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'}, 'text': '…'},
+        'data': data,
+    }}
+
+
+def dump_results(path, results):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
+
+
+async def serve(args):
+    api = FakeBotAPI(args.latency, args.jitter, args.rate_limit, args.flood_probability, args.blocked_fraction, args.seed,
+                     args.chat_interval)
+    print(await api.start(args.host, args.port), flush=True)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0, help='секунд задержки каждого ответа')
+    parser.add_argument('--jitter', type=float, default=0.0, help='случайная добавка к задержке, секунд')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='сообщений в секунду до ответов 429')
+    parser.add_argument('--flood-probability', type=float, default=0.0, help='вероятность случайного 429')
+    parser.add_argument('--blocked-fraction', type=float, default=0.0, help='доля чатов, заблокировавших бота')
+    parser.add_argument('--chat-interval', type=float, default=0.0, help='секунд между сообщениями в один чат до ответов 429')
+    parser.add_argument('--seed', type=int, default=1)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,91 @@
+"""
+Генераторы синтетических пользователей и обновлений для бенчмарков.
+
+Все генераторы детерминированы параметром seed, поэтому прогоны на разных
+версиях кода получают одинаковую нагрузку.
+"""
+
+import random
+import sqlite3
+
+from fake_api import callback_query, text_message
+
+FIRST_USER_ID = 1000
+ALL_PRAYERS_MASK = 31  # как main.ALL_PRAYERS_MASK: пять намазов с уведомлениями
+TIME_PRAYERS = ['Fajr', 'Duhr', 'Asr', 'Maghrib', 'Isha']
+
+# Доли видов обновлений в интерактивной нагрузке
+INTERACTIVE_MIX = [
+    (0.40, lambda rng: ('text', "🕐 Сегодня")),
+    (0.20, lambda rng: ('text', "⏩ Завтра")),
+    (0.10, lambda rng: ('text', "🗓️ Месяц")),
+    (0.15, lambda rng: ('callback', f"month_{rng.randint(1, 12)}")),
+    (0.05, lambda rng: ('text', "ℹ️ Информация")),
+    (0.05, lambda rng: ('text', "🏙️ Город")),
+    (0.05, lambda rng: ('text', "/help")),
+]
+
+
+def synthetic_users(count, cities=('cherkessk',), seed=1):
+    """[(user_id, mask, city или None)]: почти все подписаны на всё, часть выбрала отдельные намазы"""
+    rng = random.Random(seed)
+    users = []
+    for i in range(count):
+        mask = ALL_PRAYERS_MASK if rng.random() < 0.7 else rng.randint(1, ALL_PRAYERS_MASK)
+        city = rng.choice(cities[1:]) if len(cities) > 1 and rng.random() < 0.3 else None
+        users.append((FIRST_USER_ID + i, mask, city))
+    return users
+
+
+def write_subscriptions_db(path, users):
+    """База подписок в схеме main.init_db(); недостающее main создаст сам"""
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE IF NOT EXISTS subscriptions '
+                 '(user_id INTEGER PRIMARY KEY, mask INTEGER NOT NULL DEFAULT 0, city TEXT)')
+    conn.executemany('INSERT OR REPLACE INTO subscriptions VALUES (?, ?, ?)', users)
+    conn.commit()
+    conn.close()
+
+
+def pick(rng, mix):
+    x = rng.random()
+    for weight, make in mix:
+        if x < weight:
+            return make(rng)
+        x -= weight
+    return mix[-1][1](rng)
+
+
+def interactive_updates(count, user_ids, seed=2):
+    """Обновления обычного пользования: просмотр расписания, месяцев, справки"""
+    rng = random.Random(seed)
+    updates = []
+    for _ in range(count):
+        user_id = rng.choice(user_ids)
+        kind, value = pick(rng, INTERACTIVE_MIX)
+        updates.append(text_message(user_id, value) if kind == 'text' else callback_query(user_id, value))
+    return updates
+
+
+def churn_updates(count, user_ids, cities=('cherkessk',), seed=3):
+    """Обновления, меняющие подписки: выбор намазов, смена города, отписка и повторная подписка.
+
+    Выбор намазов идёт сеансами, как в интерфейсе: несколько нажатий toggle_
+    и затем save_prayers, поэтому после прогона база должна совпасть с памятью.
+    """
+    rng = random.Random(seed)
+    updates = []
+    while len(updates) < count:
+        user_id = rng.choice(user_ids)
+        x = rng.random()
+        if x < 0.60:
+            for _ in range(rng.randint(1, 3)):
+                updates.append(callback_query(user_id, f"toggle_{rng.choice(TIME_PRAYERS)}"))
+            updates.append(callback_query(user_id, "save_prayers"))
+        elif x < 0.80:
+            updates.append(callback_query(user_id, f"city_{rng.choice(cities)}"))
+        elif x < 0.90:
+            updates.append(text_message(user_id, "🔕 Выкл уведомления"))
+        else:
+            updates.append(text_message(user_id, "/start"))
+    return updates
@@ -0,0 +1,107 @@
+"""
+Пропускная способность обработчиков: сообщений в секунду на каждый вид
+обновления, с прогретым кэшем ответов и без него (медиана по --rounds раундам).
+
+Обновления по одному проходят через dp.feed_update, как при polling.
+Запросы к Bot API не уходят в сеть, но сериализуются так же, как перед
+отправкой (AiohttpSession.build_form_data), поэтому цена клавиатур в ответе
+учитывается. В режиме cold перед каждым обновлением сбрасываются кэш текстов
+города и кэши клавиатур: тексты и клавиатуры собираются на каждый запрос,
+как до кэша ответов (но уже из Timetable, без перебора строк prayer_data).
+
+    python benchmarks/handlers.py --json benchmarks/results/handlers.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import statistics
+import sys
+import time
+
+from fake_api import callback_query, dump_results, text_message
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USER_ID = 1000
+UPDATES = {
+    'today': text_message(USER_ID, "🕐 Сегодня"),
+    'tomorrow': text_message(USER_ID, "⏩ Завтра"),
+    'month_menu': text_message(USER_ID, "🗓️ Месяц"),
+    'month_table': callback_query(USER_ID, "month_10"),
+    'info': text_message(USER_ID, "ℹ️ Информация"),
+    'help': text_message(USER_ID, "/help"),
+}
+KEYBOARDS = ('get_main_menu_keyboard', 'get_months_keyboard', 'get_cities_keyboard')
+
+
+def import_main():
+    os.environ.update({'API_TOKEN': '1:bench', 'CITIES_DIR': REPO_DIR, 'CALC_CITIES': '', 'CSV_WATCH_INTERVAL': '0',
+                       'TIMETABLE_CACHE_DIR': '', 'METRICS_ENABLED': '0'})
+    sys.path.insert(0, REPO_DIR)
+    logging.disable(logging.INFO)
+    import main
+    return main
+
+
+def drop_caches(bot):
+    bot.registry.get(bot.DEFAULT_CITY).render_cache = {}
+    for name in KEYBOARDS:
+        getattr(bot, name).cache_clear()
+
+
+async def run(bot, args):
+    from aiogram.types import Update
+
+    session = bot.bot.session
+
+    async def make_request(client, method, timeout=None):
+        session.build_form_data(client, method)
+        return True
+
+    session.make_request = make_request
+    bot.subscriptions_loaded.set()
+    update_ids = itertools.count(1)
+    bot.load_prayer_data()
+    rates = {}
+    for round_num in range(args.rounds):
+        for name, raw in UPDATES.items():
+            # Чередуем порядок режимов, чтобы прогрев и сборка мусора не доставались одному
+            for mode in ('cold', 'warm') if round_num % 2 == 0 else ('warm', 'cold'):
+                updates = [Update.model_validate({**raw, 'update_id': next(update_ids)}, context={"bot": bot.bot})
+                           for _ in range(args.updates)]
+                elapsed = 0.0
+                for update in updates:
+                    if mode == 'cold':
+                        drop_caches(bot)
+                    started = time.perf_counter()
+                    await bot.dp.feed_update(bot.bot, update)
+                    elapsed += time.perf_counter() - started
+                rates.setdefault(name, {}).setdefault(mode, []).append(args.updates / elapsed)
+    results = {}
+    for name, modes in rates.items():
+        cold, warm = statistics.median(modes['cold']), statistics.median(modes['warm'])
+        results[name] = {'cold_per_s': cold, 'warm_per_s': warm, 'speedup': warm / cold}
+    await session.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=1000, help='обновлений каждого вида за раунд')
+    parser.add_argument('--rounds', type=int, default=5, help='раундов; в итог идёт медиана')
+    parser.add_argument('--json', help='куда сохранить результаты')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(import_main(), args))
+    for name, result in results.items():
+        print(f"{name:<12} без кэша {result['cold_per_s']:6.0f} сообщ./с, с кэшем {result['warm_per_s']:6.0f} сообщ./с "
+              f"(x{result['speedup']:.2f})")
+    if args.json:
+        dump_results(args.json, {'benchmark': 'handlers', 'updates': args.updates, 'rounds': args.rounds,
+                                 'results': results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Приём обновлений: polling против webhook при растущей частоте подачи.
+
+Для каждого --rps оба сценария из scenarios.py (polling и webhook) гоняются
+в своих процессах против одной заглушки Bot API: генератор шлёт --updates
+обычных обновлений по HTTP и меряет задержку от отправки до конца обработки.
+Устойчивая пропускная способность режима — наибольшая частота, на которой
+ни одно обновление не отклонено и не потеряно, обработано не меньше
+--sustained доли поданного, а p99 не выше --p99-limit мс.
+
+Генератор, бот и заглушка делят машину, поэтому абсолютные числа занижены;
+сравнивать стоит режимы между собой.
+
+    python benchmarks/ingress.py --json benchmarks/results/ingress.json
+"""
+
+import argparse
+
+from fake_api import dump_results
+from run import run_scenario, start_fake_api
+
+MODES = ('polling', 'webhook')
+
+
+def sustained(results, share, p99_limit):
+    """Наибольшая частота, которую режим выдерживает; 0, если ни одну"""
+    return max((r['rps'] for r in results
+                if not r['rejected'] and not r['lost'] and r['throughput_rps'] >= r['rps'] * share
+                and r['p99_ms'] <= p99_limit), default=0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rps', type=float, nargs='+', default=[100, 200, 300, 400, 800], help='частоты подачи')
+    parser.add_argument('--updates', type=int, default=2000, help='обновлений на каждую частоту')
+    parser.add_argument('--users', type=int, default=2000, help='подписчиков в базе')
+    parser.add_argument('--sustained', type=float, default=0.95, help='доля поданной частоты, которую нужно обработать')
+    parser.add_argument('--p99-limit', type=float, default=1000, help='предельный p99, мс')
+    parser.add_argument('--verbose', action='store_true', help='показывать вывод бота')
+    parser.add_argument('--json', help='куда сохранить результаты')
+    args = parser.parse_args()
+    # Остальные параметры сценариев run_scenario() берёт по умолчанию
+    args.rate, args.broadcast_users, args.date, args.no_metrics = 1000, 0, None, False
+    args.latency = args.jitter = args.rate_limit = args.flood_probability = args.blocked_fraction = 0.0
+    args.chat_interval = 0.0
+
+    results = {mode: [] for mode in MODES}
+    rates = args.rps
+    api, api_url = start_fake_api(args)
+    try:
+        for rps in rates:
+            args.rps = rps
+            for mode in MODES:
+                result = run_scenario(mode, 0, api_url, args)
+                results[mode].append(result)
+                print(f"{mode:<8} {rps:5.0f}/с: p50 {result['p50_ms']:7.1f} мс, p99 {result['p99_ms']:7.1f} мс, "
+                      f"обработано {result['throughput_rps']:5.0f}/с, отклонено {result['rejected']}, "
+                      f"потеряно {result['lost']}")
+    finally:
+        api.terminate()
+        api.wait()
+
+    summary = {mode: sustained(results[mode], args.sustained, args.p99_limit) for mode in MODES}
+    for mode, rps in summary.items():
+        print(f"{mode}: устойчиво {rps:.0f} обновлений/с")
+    if args.json:
+        dump_results(args.json, {'benchmark': 'ingress', 'updates': args.updates, 'users': args.users,
+                                 'sustained_share': args.sustained, 'p99_limit_ms': args.p99_limit,
+                                 'sustained_rps': summary, 'results': results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Память подписок и время загрузки при 1M пользователей, вместе с обратным
+индексом prayer_subscribers.
+
+База из --users синтетических пользователей (три города) загружается как
+при старте бота: load_user_cities(), затем load_subscriptions(). Сначала
+загрузка замеряется по времени, затем повторяется под tracemalloc, и
+структуры очищаются по одной: насколько упала занятая память, столько
+структура и занимала (общие объекты int учитываются у последней очищенной).
+
+    python benchmarks/memory.py --users 1000000 --json benchmarks/results/memory.json
+"""
+
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from fake_api import dump_results
+from generators import synthetic_users, write_subscriptions_db
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CALC_CITIES = 'kazan=55.79,49.12;moscow=55.75,37.62'
+CITIES = ('cherkessk', 'kazan', 'moscow')
+STRUCTURES = ('prayer_subscribers', 'user_cities', 'subscriptions')
+
+
+def import_main(workdir):
+    os.environ.update({'API_TOKEN': '1:bench', 'CITIES_DIR': REPO_DIR, 'CALC_CITIES': CALC_CITIES,
+                       'CSV_WATCH_INTERVAL': '0'})
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    logging.disable(logging.INFO)
+    import main
+    return main
+
+
+def rss_mb():
+    with open('/proc/self/status') as file:
+        for line in file:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def reset(bot):
+    for name in STRUCTURES:
+        getattr(bot, name).clear()
+    bot.subscriptions_loaded.clear()
+    gc.collect()
+
+
+def load(bot):
+    started = time.perf_counter()
+    bot.load_user_cities()
+    cities = time.perf_counter()
+    asyncio.run(bot.load_subscriptions())
+    return cities - started, time.perf_counter() - cities
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--json', help='куда сохранить результаты')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='prayer-bot-memory-') as workdir:
+        bot = import_main(workdir)
+        users = synthetic_users(args.users, CITIES)
+        write_subscriptions_db(os.path.join(workdir, bot.SUBSCRIPTIONS_DB), users)
+        del users
+        bot.init_db()
+        bot.load_prayer_data()
+        db_mb = os.path.getsize(os.path.join(workdir, bot.SUBSCRIPTIONS_DB)) / 2 ** 20
+
+        gc.collect()
+        rss_before = rss_mb()
+        cities_s, subscriptions_s = load(bot)
+        rss_loaded = rss_mb()
+        reset(bot)
+
+        tracemalloc.start()
+        load(bot)
+        gc.collect()
+        structures = {}
+        for name in STRUCTURES:
+            before = tracemalloc.get_traced_memory()[0]
+            getattr(bot, name).clear()
+            gc.collect()
+            structures[name] = before - tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        bot.close_db()
+
+    total = sum(structures.values())
+    per_user = {name: size / args.users for name, size in structures.items()}
+    for name, size in structures.items():
+        print(f"{name:<19} {size / 2 ** 20:7.1f} МиБ, {per_user[name]:6.1f} байт/пользователь")
+    print(f"всего {total / 2 ** 20:.1f} МиБ, {total / args.users:.1f} байт/пользователь; "
+          f"RSS +{rss_loaded - rss_before:.0f} МиБ; база {db_mb:.0f} МиБ")
+    print(f"загрузка: города {cities_s:.2f} с, подписки {subscriptions_s:.2f} с")
+    if args.json:
+        dump_results(args.json, {'benchmark': 'memory', 'users': args.users, 'bytes': structures,
+                                 'bytes_per_user': per_user, 'total_bytes_per_user': total / args.users,
+                                 'rss_growth_mb': rss_loaded - rss_before, 'db_mb': db_mb,
+                                 'load_cities_s': cities_s, 'load_subscriptions_s': subscriptions_s})
+
+
+if __name__ == "__main__":
+    main()
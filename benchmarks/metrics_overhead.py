@@ -0,0 +1,93 @@
+"""
+Накладные расходы замера обработчиков (middleware measure_handler): сценарий
+interactive поочерёдно с METRICS_ENABLED=1 и 0, по --runs прогонов каждого.
+Сравниваются медианы процессорного времени бота на одно обновление и задержек.
+Разница между режимами тонет в разбросе прогонов, поэтому отдельно мерится
+цена самого middleware: вызов через measure_handler против прямого вызова.
+
+    python benchmarks/metrics_overhead.py --runs 5 --updates 3000 --rps 200 --json benchmarks/results/metrics_overhead.json
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+from fake_api import dump_results
+from run import run_scenario, start_fake_api
+from scenarios import add_scenario_arguments
+
+METRICS = ('cpu_ms_per_update', 'p50_ms', 'p99_ms', 'throughput_rps')
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def middleware_cost_us(calls=200000):
+    """Микросекунд, которые measure_handler добавляет к одному обновлению"""
+    os.environ.setdefault('API_TOKEN', '1:bench')
+    sys.path.insert(0, REPO_DIR)
+    import main
+
+    async def handler(event, data):
+        return None
+
+    data = {'handler': type('HandlerObject', (), {'callback': handler})()}
+
+    async def measure():
+        started = time.perf_counter()
+        for _ in range(calls):
+            await handler(None, data)
+        direct = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(calls):
+            await main.measure_handler(handler, None, data)
+        return (time.perf_counter() - started - direct) / calls * 1e6
+
+    return min(asyncio.run(measure()) for _ in range(3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_scenario_arguments(parser)
+    parser.add_argument('--runs', type=int, default=5, help='прогонов на каждый режим')
+    parser.add_argument('--json', help='куда сохранить результаты')
+    parser.add_argument('--verbose', action='store_true', help='показывать вывод бота')
+    args = parser.parse_args()
+    # Заглушка без помех: мерится только работа самого бота
+    args.latency = args.jitter = args.rate_limit = args.flood_probability = args.blocked_fraction = args.chat_interval = 0.0
+
+    api, api_url = start_fake_api(args)
+    runs = {'on': [], 'off': []}
+    try:
+        for i in range(args.runs):
+            # Чередуем порядок, чтобы прогрев и фоновые помехи не доставались одному режиму
+            for mode in ('on', 'off') if i % 2 == 0 else ('off', 'on'):
+                args.no_metrics = mode == 'off'
+                result = run_scenario('interactive', 0, api_url, args)
+                runs[mode].append(result)
+                print(f"метрики {mode}: {result['cpu_ms_per_update']:.3f} мс CPU/обновление, "
+                      f"p50 {result['p50_ms']:.2f} мс, p99 {result['p99_ms']:.2f} мс")
+    finally:
+        api.terminate()
+        api.wait()
+
+    summary = {mode: {metric: statistics.median(r[metric] for r in results) for metric in METRICS}
+               for mode, results in runs.items()}
+    overhead = summary['on']['cpu_ms_per_update'] / summary['off']['cpu_ms_per_update'] - 1
+    spread = {mode: (max(r['cpu_ms_per_update'] for r in results) / min(r['cpu_ms_per_update'] for r in results) - 1)
+              for mode, results in runs.items()}
+    cost_us = middleware_cost_us()
+    share = cost_us / 1000 / summary['off']['cpu_ms_per_update']
+    print(f"медианы: CPU/обновление {summary['on']['cpu_ms_per_update']:.3f} мс с метриками, "
+          f"{summary['off']['cpu_ms_per_update']:.3f} мс без; разница {overhead:+.1%} "
+          f"при разбросе прогонов {max(spread.values()):.1%}")
+    print(f"measure_handler: {cost_us:.2f} мкс на обновление, {share:.2%} процессорного времени обновления")
+    if args.json:
+        dump_results(args.json, {'benchmark': 'metrics_overhead', 'updates': args.updates, 'rps': args.rps,
+                                 'runs': runs, 'median': summary, 'cpu_overhead': overhead, 'run_spread': spread,
+                                 'middleware_us': cost_us, 'middleware_share': share})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Запись подписок при 100k строк в базе: усиление записи и блокировка цикла
+событий, исходный save_subscriptions() против нынешнего save_user().
+
+  legacy  — копия исходного save_subscriptions(): новое соединение и
+            INSERT OR REPLACE всех строк с JSON на каждое изменение, прямо в
+            цикле событий (так его вызывали обработчики и рассылка)
+  batched — set_user_prayers() + save_user(): изменённые user_id копятся
+            DB_FLUSH_DELAY секунд и пишутся одной транзакцией в потоке БД
+
+Изменения подаются с частотой --rps. Для каждого варианта — строк и байт
+(wchar из /proc/self/io) на одно изменение, число транзакций и блокировка
+цикла: сумма и максимум опозданий sleep(1 мс) сверх 1 мс, как в
+watch_event_loop(). Исходный вариант медленный, поэтому его изменений
+меньше (--legacy-changes); сравниваются значения на одно изменение.
+
+    python benchmarks/persistence.py --rows 100000 --json benchmarks/results/persistence.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from fake_api import dump_results
+from generators import synthetic_users, write_subscriptions_db
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAG_INTERVAL = 0.001
+PRAYERS = ['Fajr', 'Duhr', 'Asr', 'Maghrib', 'Isha']
+
+
+def import_main():
+    os.environ.setdefault('API_TOKEN', '1:bench')
+    sys.path.insert(0, REPO_DIR)
+    logging.disable(logging.INFO)
+    import main
+    return main
+
+
+def written_bytes():
+    with open('/proc/self/io') as file:
+        for line in file:
+            if line.startswith('wchar:'):
+                return int(line.split()[1])
+    return 0
+
+
+async def watch_loop(lags):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(max(0.0, loop.time() - started - LAG_INTERVAL))
+
+
+async def measure(changes, rps, apply, settle):
+    """Подаёт changes изменений через apply(i) с частотой rps; итоги на одно изменение"""
+    lags = []
+    watcher = asyncio.create_task(watch_loop(lags))
+    await asyncio.sleep(0.05)
+    bytes_before = written_bytes()
+    started = time.perf_counter()
+    for i in range(changes):
+        # Отдаём управление и при отставании, иначе наблюдатель не увидит блокировок
+        await asyncio.sleep(max(0.0, started + i / rps - time.perf_counter()))
+        apply(i)
+    await settle()
+    elapsed = time.perf_counter() - started
+    watcher.cancel()
+    blocked = [lag for lag in lags if lag > LAG_INTERVAL]
+    return {
+        'changes': changes,
+        'elapsed_s': elapsed,
+        'bytes_per_change': (written_bytes() - bytes_before) / changes,
+        'loop_blocked_ms': sum(blocked) * 1000,
+        'loop_blocked_ms_per_change': sum(blocked) * 1000 / changes,
+        'loop_max_lag_ms': max(lags, default=0.0) * 1000,
+    }
+
+
+# ==================== ИСХОДНАЯ ЗАПИСЬ ====================
+def legacy_save(path, subscriptions):
+    """save_subscriptions() из исходной версии бота; возвращает число записанных строк"""
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    for user_id, prayers in subscriptions.items():
+        prayers_json = json.dumps(list(prayers))
+        cursor.execute('INSERT OR REPLACE INTO subscriptions (user_id, prayers) VALUES (?, ?)', (user_id, prayers_json))
+    conn.commit()
+    rows = conn.total_changes
+    conn.close()
+    return rows
+
+
+async def run_legacy(args, users, workdir):
+    path = os.path.join(workdir, 'legacy.db')
+    subscriptions = {user_id: {p for i, p in enumerate(PRAYERS) if mask & 1 << i} for user_id, mask, _ in users}
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE subscriptions (user_id INTEGER PRIMARY KEY, prayers TEXT)')
+    conn.commit()
+    conn.close()
+    legacy_save(path, subscriptions)
+    rng = random.Random(4)
+    rows = []
+
+    def apply(i):
+        user_id = users[rng.randrange(len(users))][0]
+        subscriptions[user_id] ^= {rng.choice(PRAYERS)}
+        rows.append(legacy_save(path, subscriptions))
+
+    async def settle():
+        pass
+
+    result = await measure(args.legacy_changes, args.rps, apply, settle)
+    return {**result, 'rows_per_change': sum(rows) / len(rows), 'transactions': len(rows)}
+
+
+# ==================== ПАКЕТНАЯ ЗАПИСЬ ====================
+async def run_batched(args, users, workdir):
+    os.chdir(workdir)
+    bot = import_main()
+    write_subscriptions_db(os.path.join(workdir, bot.SUBSCRIPTIONS_DB), users)
+    bot.init_db()
+    await bot.load_subscriptions()
+    transactions = []
+    write = bot.write_subscription_changes
+
+    def counting_write(upserts, deletes):
+        transactions.append(len(upserts) + len(deletes))
+        write(upserts, deletes)
+
+    bot.write_subscription_changes = counting_write
+    rows_before = bot.db_conn.total_changes
+    rng = random.Random(4)
+
+    def apply(i):
+        user_id = users[rng.randrange(len(users))][0]
+        bot.toggle_user_prayer(user_id, rng.choice(PRAYERS))
+        bot.save_user(user_id)
+
+    async def settle():
+        while bot.flush_task is not None and not bot.flush_task.done():
+            await asyncio.sleep(0.01)
+        await bot.flush_subscriptions()
+
+    result = await measure(args.changes, args.rps, apply, settle)
+    rows = bot.db_conn.total_changes - rows_before
+    await bot.shutdown_db()
+    return {**result, 'rows_per_change': rows / args.changes, 'transactions': len(transactions),
+            'flush_delay_s': bot.DB_FLUSH_DELAY}
+
+
+async def run(args):
+    users = synthetic_users(args.rows)
+    with tempfile.TemporaryDirectory(prefix='prayer-bot-persistence-') as workdir:
+        cwd = os.getcwd()
+        try:
+            return {'legacy': await run_legacy(args, users, workdir), 'batched': await run_batched(args, users, workdir)}
+        finally:
+            os.chdir(cwd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='подписчиков в базе')
+    parser.add_argument('--changes', type=int, default=2000, help='изменений для пакетной записи')
+    parser.add_argument('--legacy-changes', type=int, default=20, help='изменений для исходной записи')
+    parser.add_argument('--rps', type=float, default=200, help='изменений в секунду')
+    parser.add_argument('--json', help='куда сохранить результаты')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    for name, result in results.items():
+        print(f"{name:<8} строк/изменение {result['rows_per_change']:.1f}, "
+              f"байт/изменение {result['bytes_per_change']:.0f}, транзакций {result['transactions']} "
+              f"на {result['changes']} изменений; цикл заблокирован {result['loop_blocked_ms_per_change']:.2f} мс "
+              f"на изменение, максимум {result['loop_max_lag_ms']:.1f} мс")
+    amplification = results['legacy']['bytes_per_change'] / max(results['batched']['bytes_per_change'], 1)
+    print(f"байт на изменение меньше в {amplification:.0f} раз")
+    if args.json:
+        dump_results(args.json, {'benchmark': 'persistence', 'rows': args.rows, 'rps': args.rps, **results})
+
+
+if __name__ == "__main__":
+    main()
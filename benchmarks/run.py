@@ -0,0 +1,158 @@
+"""
+Набор бенчмарков: поднимает заглушку Bot API, прогоняет сценарии из
+scenarios.py (каждый в своём процессе и своей временной папке), сохраняет
+результаты в JSON и сравнивает их с предыдущим прогоном.
+
+    python benchmarks/run.py --json after.json --baseline before.json
+    python benchmarks/run.py interactive_broadcast --workers 0 1 2 4 --broadcast-users 100000
+    python benchmarks/run.py broadcast_day --latency 0.02 --rate-limit 30 --rate 25 --blocked-fraction 0.02
+
+Код возврата 1, если какая-то метрика хуже базовой больше чем на --tolerance.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import urllib.request
+from datetime import datetime
+
+from fake_api import dump_results
+from scenarios import SCENARIOS, add_scenario_arguments
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SCENARIOS = ['interactive', 'interactive_broadcast', 'broadcast_day', 'churn', 'polling', 'webhook']
+WORKER_SCENARIOS = ('interactive_broadcast', 'broadcast')  # прогоняются для каждого значения --workers
+
+# Метрики, по которым ищутся регрессии: lower — меньше лучше, higher — больше лучше
+REGRESSION_METRICS = {
+    'interactive': {'p50_ms': 'lower', 'p99_ms': 'lower', 'cpu_ms_per_update': 'lower'},
+    'interactive_broadcast': {'p99_ms': 'lower', 'broadcast_s': 'lower'},
+    'broadcast': {'last_delivery_s': 'lower', 'messages_per_s': 'higher'},
+    'broadcast_day': {'messages_per_s': 'higher', 'job_p95_s': 'lower'},
+    'churn': {'p99_ms': 'lower', 'flush_ms': 'lower'},
+    'polling': {'p50_ms': 'lower', 'p99_ms': 'lower', 'throughput_rps': 'higher'},
+    'webhook': {'p50_ms': 'lower', 'p99_ms': 'lower', 'throughput_rps': 'higher'},
+}
+
+
+def start_fake_api(args):
+    command = [sys.executable, os.path.join(BENCH_DIR, 'fake_api.py'),
+               '--latency', str(args.latency), '--jitter', str(args.jitter), '--rate-limit', str(args.rate_limit),
+               '--flood-probability', str(args.flood_probability), '--blocked-fraction', str(args.blocked_fraction),
+               '--chat-interval', str(args.chat_interval)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    return process, process.stdout.readline().strip()
+
+
+def run_scenario(name, workers, api_url, args):
+    urllib.request.urlopen(urllib.request.Request(f"{api_url}/_reset", method='POST')).close()
+    workdir = tempfile.mkdtemp(prefix=f'prayer-bot-{name}-')
+    command = [sys.executable, os.path.join(BENCH_DIR, 'scenarios.py'), name, '--api-url', api_url,
+               '--workdir', workdir, '--workers', str(workers), '--users', str(args.users),
+               '--updates', str(args.updates), '--rps', str(args.rps), '--rate', str(args.rate),
+               '--broadcast-users', str(args.broadcast_users)]
+    if args.date:
+        command += ['--date', args.date]
+    if args.no_metrics:
+        command.append('--no-metrics')
+    try:
+        completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.DEVNULL,
+                                   text=True, check=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for key, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(key)
+        if previous is None:
+            continue
+        if current.get('consistent') is False:
+            regressions.append(f"{key}: база и память разошлись ({current.get('mismatches')})")
+        for metric, better in REGRESSION_METRICS.get(key.split('[')[0], {}).items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (better == 'lower' and change > tolerance) or (better == 'higher' and change < -tolerance):
+                regressions.append(f"{key}.{metric}: {old:.2f} -> {new:.2f} ({change:+.0%})")
+    return regressions
+
+
+def print_result(key, result):
+    fields = ', '.join(f"{k} {v:.2f}" if isinstance(v, float) else f"{k} {v}" for k, v in result.items())
+    print(f"{key}: {fields}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', help=f"по умолчанию все: {', '.join(DEFAULT_SCENARIOS)}")
+    parser.add_argument('--workers', type=int, nargs='+', default=[0],
+                        help='значения BROADCAST_WORKERS для interactive_broadcast и broadcast')
+    add_scenario_arguments(parser)
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа заглушки, секунд')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='сообщений в секунду до ответов 429')
+    parser.add_argument('--flood-probability', type=float, default=0.0)
+    parser.add_argument('--blocked-fraction', type=float, default=0.02)
+    parser.add_argument('--chat-interval', type=float, default=0.0, help='секунд между сообщениями в один чат до ответов 429')
+    parser.add_argument('--json', help='куда сохранить результаты')
+    parser.add_argument('--baseline', help='результаты предыдущего прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='допустимое ухудшение метрики, доля')
+    parser.add_argument('--verbose', action='store_true', help='показывать вывод бота')
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'started': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': {k: v for k, v in vars(args).items() if k not in ('json', 'baseline', 'verbose')},
+        },
+        'scenarios': {},
+    }
+    api, api_url = start_fake_api(args)
+    try:
+        for name in args.scenarios or DEFAULT_SCENARIOS:
+            for workers in (args.workers if name in WORKER_SCENARIOS else [0]):
+                key = f"{name}[workers={workers}]" if name in WORKER_SCENARIOS else name
+                results['scenarios'][key] = run_scenario(name, workers, api_url, args)
+                print_result(key, results['scenarios'][key])
+    finally:
+        api.terminate()
+        api.wait()
+
+    if args.json:
+        dump_results(args.json, results)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = find_regressions(results, json.load(file), args.tolerance)
+        for line in regressions:
+            print(f"РЕГРЕССИЯ {line}")
+        if regressions:
+            sys.exit(1)
+        print("Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
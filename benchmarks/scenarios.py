@@ -0,0 +1,402 @@
+"""
+Сценарии нагрузки. Каждый запускается в отдельном процессе (так его
+запускает run.py), импортирует main против заглушки Bot API и печатает
+результат одной строкой JSON:
+
+    python benchmarks/scenarios.py interactive --api-url http://127.0.0.1:8081 --workdir /tmp/x
+
+Сценарии:
+  interactive            — поток обычных обновлений с заданной частотой, задержка обработки
+  interactive_broadcast  — то же во время рассылки на --broadcast-users подписчиков
+                           (с BROADCAST_WORKERS=--workers, 0 — в основном процессе)
+  broadcast              — одна рассылка на --broadcast-users подписчиков без другой
+                           нагрузки: время до последней доставки и перцентили задержки
+  broadcast_day          — все уведомления одного дня по prayer_times_cherkessk.csv
+                           подряд, время подменяется на плановое время задания
+  churn                  — смена подписок: выбор намазов, город, отписка; затем
+                           сверка базы с памятью
+  polling, webhook       — поток обычных обновлений по HTTP с частотой --rps: через
+                           getUpdates заглушки (POST /_updates) или POST в
+                           WebhookServer.handle; задержка от отправки обновления до
+                           конца его обработки и устойчивая пропускная способность
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+import urllib.request
+from collections import Counter
+from datetime import datetime, time as dt_time
+
+from generators import (ALL_PRAYERS_MASK, FIRST_USER_ID, churn_updates, interactive_updates, synthetic_users,
+                        write_subscriptions_db)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Два рассчитываемых города в дополнение к CSV, чтобы задания сливали несколько городов
+CALC_CITIES = 'kazan=55.79,49.12;moscow=55.75,37.62'
+CITIES = ('cherkessk', 'kazan', 'moscow')
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def latency_summary(latencies, elapsed):
+    return {
+        'count': len(latencies),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies, default=0.0) * 1000,
+        'throughput_rps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def api_stats(api_url):
+    with urllib.request.urlopen(f"{api_url}/_stats") as response:
+        return json.load(response)
+
+
+def import_bot(args):
+    """Импортирует main с окружением бенчмарка; рабочая папка — временная"""
+    os.environ.update({
+        'API_TOKEN': '1:bench',
+        'TELEGRAM_API_URL': args.api_url,
+        'CITIES_DIR': REPO_DIR,
+        'CALC_CITIES': CALC_CITIES,
+        'CSV_WATCH_INTERVAL': '0',
+        'METRICS_PORT': '0',
+        'BROADCAST_RATE': str(args.rate),
+        'BROADCAST_BURST': str(max(1, int(args.rate))),
+        'BROADCAST_WORKERS': str(args.workers),
+        'DELIVERY_RETRY_BASE': '0.05',
+        'METRICS_ENABLED': '0' if args.no_metrics else '1',
+    })
+    os.chdir(args.workdir)
+    sys.path.insert(0, REPO_DIR)
+    logging.disable(logging.INFO)
+    import main
+    return main
+
+
+async def prepare(main, args, users=None):
+    users = users or synthetic_users(args.users, CITIES)
+    write_subscriptions_db(os.path.join(args.workdir, main.SUBSCRIPTIONS_DB), users)
+    main.init_db()
+    if not main.load_prayer_data():
+        raise RuntimeError("Не удалось загрузить расписание")
+    main.load_user_cities()
+    await main.load_subscriptions()
+    main.delivery_task = asyncio.create_task(main.process_delivery_events())
+    return [user_id for user_id, _, _ in users]
+
+
+async def shutdown(main):
+    if main.worker_tasks:
+        await main.stop_broadcast_workers()
+    main.stop_delivery_processing()
+    await main.shutdown_db()
+    main.close_broadcast_queue()
+    await main.bot.session.close()
+
+
+async def feed(main, update_ids, update):
+    from aiogram.types import Update
+    update = Update.model_validate({**update, 'update_id': next(update_ids)}, context={"bot": main.bot})
+    started = time.perf_counter()
+    await main.dp.feed_update(main.bot, update)
+    return time.perf_counter() - started
+
+
+async def open_loop(main, updates, rps):
+    """Подаёт обновления с частотой rps, не дожидаясь ответов; (задержки, ошибки, секунды)"""
+    update_ids = itertools.count(1)
+    started = time.perf_counter()
+    tasks = []
+    for i, update in enumerate(updates):
+        delay = started + i / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(feed(main, update_ids, update)))
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    latencies = [r for r in results if isinstance(r, float)]
+    return latencies, len(results) - len(latencies), time.perf_counter() - started
+
+
+# ==================== СЦЕНАРИИ ====================
+async def scenario_interactive(main, args):
+    user_ids = await prepare(main, args)
+    cpu_started = time.process_time()
+    latencies, errors, elapsed = await open_loop(main, interactive_updates(args.updates, user_ids), args.rps)
+    cpu_ms = (time.process_time() - cpu_started) * 1000
+    return {**latency_summary(latencies, elapsed), 'errors': errors, 'cpu_ms_per_update': cpu_ms / args.updates}
+
+
+def started_workers(main):
+    return main.queue_conn.execute("SELECT COUNT(DISTINCT worker) FROM broadcast_shards WHERE status != 'pending'").fetchone()[0]
+
+
+async def scenario_interactive_broadcast(main, args):
+    # Все подписчики получают рассылку; интерактивные пользователи в ней не участвуют
+    await prepare(main, args, [(FIRST_USER_ID + i, ALL_PRAYERS_MASK, None) for i in range(args.broadcast_users)])
+    interactive_ids = list(range(1, FIRST_USER_ID))
+    if args.workers:
+        main.start_broadcast_workers()
+    sent_before = api_stats(args.api_url).get('sendMessage:200', 0)
+    started = time.perf_counter()
+    sending = asyncio.create_task(main.send_prayer_notification(main.DEFAULT_CITY, 'Fajr', '05:00'))
+    # Интерактивная нагрузка начинается, когда рассылка реально пошла: все воркеры
+    # запустились и взяли свой шард (импорт main в каждом занимает секунды)
+    while api_stats(args.api_url).get('sendMessage:200', 0) == sent_before or \
+            (args.workers and await main.run_db(started_workers, main) < args.workers):
+        await asyncio.sleep(0.05)
+    latencies, errors, elapsed = await open_loop(main, interactive_updates(args.updates, interactive_ids), args.rps)
+    await sending
+    return {**latency_summary(latencies, elapsed), 'errors': errors, 'workers': args.workers,
+            'broadcast_users': args.broadcast_users, 'broadcast_s': time.perf_counter() - started}
+
+
+async def scenario_broadcast(main, args):
+    await prepare(main, args, [(FIRST_USER_ID + i, ALL_PRAYERS_MASK, None) for i in range(args.broadcast_users)])
+    if args.workers:
+        main.start_broadcast_workers()
+        # Импорт main в воркере занимает секунды; ждём, пока все начнут опрашивать очередь
+        await asyncio.sleep(10)
+    recipients = list(main.city_subscribers(main.DEFAULT_CITY)['Fajr'])
+    send = main.broadcast_sharded if args.workers else main.broadcast
+    cpu_started = time.process_time()
+    stats = await send(recipients, "🕌 Время намаза: *Фаджр*", parse_mode="Markdown")
+    cpu_s = time.process_time() - cpu_started
+    api = api_stats(args.api_url)
+    elapsed = stats.finished - stats.started
+    return {
+        'workers': args.workers,
+        'subscribers': len(recipients),
+        'rate': args.rate,
+        'sent': stats.sent,
+        'blocked': stats.blocked,
+        'failed': stats.failed,
+        'retried': stats.retried,
+        'rate_limited_responses': api.get('sendMessage:429', 0),
+        'elapsed_s': elapsed,
+        'ideal_s': len(recipients) / args.rate,
+        'last_delivery_s': max(stats.delays, default=0.0),
+        'delivery_p50_s': stats.percentile(50),
+        'delivery_p95_s': stats.percentile(95),
+        'delivery_p99_s': stats.percentile(99),
+        'messages_per_s': stats.sent / elapsed if elapsed > 0 else 0.0,
+        'cpu_ms_per_message': cpu_s * 1000 / max(len(recipients), 1),
+    }
+
+
+async def scenario_broadcast_day(main, args):
+    await prepare(main, args)
+    subscribed = len(main.subscriptions)
+    day = datetime.strptime(args.date, '%Y-%m-%d').date() if args.date else datetime.now(main.TIMEZONE).date()
+    midnight = main.TIMEZONE.localize(datetime.combine(day, dt_time()))
+    plan = main.notification_plan(midnight, days=1)
+    jobs = sorted((job for job in plan.items() if job[1][0].date() == day), key=lambda job: job[1][0])
+    durations = []
+    started = time.perf_counter()
+    for job_id, (fire_dt, is_reminder, targets) in jobs:
+        job_started = time.perf_counter()
+        await main.run_notification_job(job_id, fire_dt, is_reminder, targets, now=fire_dt)
+        durations.append(time.perf_counter() - job_started)
+    elapsed = time.perf_counter() - started
+    # Даём фоновым повторам и отпискам отработать
+    deadline = time.monotonic() + 10
+    while (main.delivery_retry_tasks or not main.delivery_events.empty()) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    stats = api_stats(args.api_url)
+    pruned = subscribed - len(main.subscriptions)
+    sent = stats.get('sendMessage:200', 0)
+    return {
+        'date': day.isoformat(),
+        'jobs': len(jobs),
+        'messages_sent': sent,
+        'blocked_responses': stats.get('sendMessage:403', 0),
+        'rate_limited_responses': stats.get('sendMessage:429', 0),
+        'pruned_users': pruned,
+        'elapsed_s': elapsed,
+        'messages_per_s': sent / elapsed if elapsed > 0 else 0.0,
+        'job_p50_s': percentile(durations, 50),
+        'job_p95_s': percentile(durations, 95),
+        'job_max_s': max(durations, default=0.0),
+    }
+
+
+def check_consistency(main):
+    """Расхождения базы, памяти и обратного индекса после сброса"""
+    rows = {user_id: (mask, city) for user_id, mask, city in
+            main.db_conn.execute('SELECT user_id, mask, city FROM subscriptions')}
+    mismatches = 0
+    for user_id in set(rows) | set(main.subscriptions) | set(main.user_cities):
+        expected = (main.subscriptions.get(user_id, 0), main.user_cities.get(user_id))
+        mask, city = rows.get(user_id, (0, None))
+        if (mask, None if city == main.DEFAULT_CITY else city) != expected:
+            mismatches += 1
+    for city, bucket in main.prayer_subscribers.items():
+        for prayer, users in bucket.items():
+            for user_id in users:
+                if main.get_user_city(user_id) != city or not main.subscriptions.get(user_id, 0) & main.PRAYER_BITS[prayer]:
+                    mismatches += 1
+    return mismatches
+
+
+async def scenario_churn(main, args):
+    user_ids = await prepare(main, args)
+    updates = churn_updates(args.updates, user_ids, CITIES)
+    latencies, errors, elapsed = await open_loop(main, updates, args.rps)
+    flush_started = time.perf_counter()
+    if main.flush_task is not None:
+        main.flush_task.cancel()
+    await main.flush_subscriptions()
+    flush_ms = (time.perf_counter() - flush_started) * 1000
+    mismatches = await main.run_db(check_consistency, main)
+    result = {**latency_summary(latencies, elapsed), 'errors': errors, 'flush_ms': flush_ms,
+              'mismatches': mismatches, 'consistent': mismatches == 0}
+    result['ops_per_s'] = result.pop('throughput_rps')
+    return result
+
+
+def track_handled(main):
+    """Подменяет dp.feed_update; {update_id: time.perf_counter() конца обработки}"""
+    handled = {}
+    feed_update = main.dp.feed_update
+
+    async def timed_feed_update(bot, update, **kwargs):
+        try:
+            return await feed_update(bot, update, **kwargs)
+        finally:
+            handled[update.update_id] = time.perf_counter()
+
+    main.dp.feed_update = timed_feed_update
+    return handled
+
+
+async def post_loop(url, updates, rps, handled, headers=None, timeout=60):
+    """POST обновлений на url с частотой rps, не дожидаясь ответов; ждёт обработки принятых.
+
+    update_id — из самого обновления или из ответа (POST /_updates заглушки).
+    Возвращает (задержки до конца обработки, задержки ответа HTTP, коды ответов, секунды).
+    """
+    from aiohttp import ClientSession, TCPConnector
+
+    sent, acks, statuses = {}, [], Counter()
+
+    async def post(session, update):
+        started = time.perf_counter()
+        async with session.post(url, json=update, headers=headers) as response:
+            acks.append(time.perf_counter() - started)
+            statuses[response.status] += 1
+            if response.status == 200:
+                update_id = update.get('update_id') or (await response.json())['update_id']
+                sent[update_id] = started
+
+    started = time.perf_counter()
+    async with ClientSession(connector=TCPConnector(limit=0)) as session:
+        tasks = []
+        for i, update in enumerate(updates):
+            delay = started + i / rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(post(session, update)))
+        await asyncio.gather(*tasks)
+    deadline = time.perf_counter() + timeout
+    while not sent.keys() <= handled.keys() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    done = [update_id for update_id in sent if update_id in handled]
+    finished = max((handled[update_id] for update_id in done), default=started)
+    return [handled[update_id] - sent[update_id] for update_id in done], acks, statuses, finished - started
+
+
+def http_summary(args, latencies, acks, statuses, elapsed):
+    return {**latency_summary(latencies, elapsed), 'rps': args.rps, 'sent': args.updates,
+            'rejected': args.updates - statuses[200], 'lost': statuses[200] - len(latencies),
+            'ack_p50_ms': percentile(acks, 50) * 1000, 'ack_p99_ms': percentile(acks, 99) * 1000}
+
+
+async def scenario_polling(main, args):
+    user_ids = await prepare(main, args)
+    handled = track_handled(main)
+    polling = asyncio.create_task(main.dp.start_polling(main.bot, handle_signals=False, close_bot_session=False))
+    updates = interactive_updates(args.updates, user_ids)
+    try:
+        latencies, acks, statuses, elapsed = await post_loop(f"{args.api_url}/_updates", updates, args.rps, handled)
+    finally:
+        await main.dp.stop_polling()
+        await polling
+    return http_summary(args, latencies, acks, statuses, elapsed)
+
+
+async def scenario_webhook(main, args):
+    from aiohttp import web
+
+    user_ids = await prepare(main, args)
+    handled = track_handled(main)
+    main.WEBHOOK_SECRET = 'bench-secret'
+    server = main.WebhookServer()
+    app = web.Application()
+    app.router.add_post(main.WEBHOOK_PATH, server.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}{main.WEBHOOK_PATH}"
+    server.start()
+    updates = [{**update, 'update_id': i} for i, update in enumerate(interactive_updates(args.updates, user_ids), 1)]
+    try:
+        latencies, acks, statuses, elapsed = await post_loop(
+            url, updates, args.rps, handled, headers={'X-Telegram-Bot-Api-Secret-Token': main.WEBHOOK_SECRET})
+    finally:
+        await server.drain()
+        await runner.cleanup()
+    return {**http_summary(args, latencies, acks, statuses, elapsed), 'queue_size': server.queue.maxsize,
+            'webhook_workers': server.worker_count}
+
+
+SCENARIOS = {
+    'interactive': scenario_interactive,
+    'interactive_broadcast': scenario_interactive_broadcast,
+    'broadcast': scenario_broadcast,
+    'broadcast_day': scenario_broadcast_day,
+    'churn': scenario_churn,
+    'polling': scenario_polling,
+    'webhook': scenario_webhook,
+}
+
+
+def add_scenario_arguments(parser):
+    parser.add_argument('--users', type=int, default=2000, help='подписчиков в базе')
+    parser.add_argument('--updates', type=int, default=2000, help='обновлений в интерактивных сценариях')
+    parser.add_argument('--rps', type=float, default=200, help='частота подачи обновлений')
+    parser.add_argument('--rate', type=float, default=1000, help='BROADCAST_RATE бота')
+    parser.add_argument('--broadcast-users', type=int, default=100000, help='получателей рассылки в interactive_broadcast')
+    parser.add_argument('--date', help='день для broadcast_day, YYYY-MM-DD; по умолчанию сегодня')
+    parser.add_argument('--no-metrics', action='store_true', help='METRICS_ENABLED=0')
+
+
+async def run_scenario(args):
+    main = import_bot(args)
+    try:
+        return await SCENARIOS[args.scenario](main, args)
+    finally:
+        await shutdown(main)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenario', choices=sorted(SCENARIOS))
+    parser.add_argument('--api-url', required=True)
+    parser.add_argument('--workdir', required=True)
+    parser.add_argument('--workers', type=int, default=0, help='BROADCAST_WORKERS')
+    add_scenario_arguments(parser)
+    print(json.dumps(asyncio.run(run_scenario(parser.parse_args()))))
@@ -0,0 +1,107 @@
+"""
+Бенчмарк холодного старта: время от запуска процесса до первого обработанного
+обновления и пиковый RSS.
+
+Бот запускается отдельным процессом в режиме polling против FakeBotAPI,
+с базой подписок из --users синтетических пользователей. Первый прогон
+строит бинарный снимок расписания, последующие используют его.
+
+    python benchmarks/startup.py --users 100000 --runs 3 --json startup.json
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import signal
+import statistics
+import sys
+import tempfile
+import time
+
+from fake_api import FakeBotAPI, dump_results, text_message
+from generators import synthetic_users, write_subscriptions_db
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def peak_rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    return None
+
+
+async def run_once(workdir, main_path, settle, scheduler):
+    api = FakeBotAPI()
+    url = await api.start()
+    api.push_update(text_message(1, "🕐 Сегодня"))
+    env = {
+        **os.environ,
+        'API_TOKEN': '1:bench',
+        'TELEGRAM_API_URL': url,
+        'CITIES_DIR': REPO_DIR,
+        'CSV_WATCH_INTERVAL': '0',
+        'METRICS_PORT': '0',
+        'SCHEDULER_ENABLED': '1' if scheduler else '0',
+    }
+    started = time.monotonic()
+    process = await asyncio.create_subprocess_exec(sys.executable, main_path, cwd=workdir, env=env,
+                                                   stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+    try:
+        first_reply = await api.wait_for_calls('sendMessage')
+        result = {'first_update_s': first_reply - started, 'rss_at_first_update_mb': peak_rss_mb(process.pid)}
+        await asyncio.sleep(settle)
+        result['peak_rss_mb'] = peak_rss_mb(process.pid)
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGTERM)
+        await process.wait()
+        await api.stop()
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--main', default=os.path.join(REPO_DIR, 'main.py'), help='какой main.py запускать')
+    parser.add_argument('--users', type=int, default=100000, help='подписчиков в базе')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--settle', type=float, default=3.0, help='секунд после первого ответа до замера пикового RSS')
+    parser.add_argument('--no-scheduler', action='store_true', help='SCHEDULER_ENABLED=0, как у реплик без рассылок')
+    parser.add_argument('--json', help='куда сохранить результаты')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='prayer-bot-startup-')
+    try:
+        write_subscriptions_db(os.path.join(workdir, 'subscriptions.db'), synthetic_users(args.users))
+        runs = []
+        for i in range(args.runs):
+            result = await run_once(workdir, os.path.abspath(args.main), args.settle, not args.no_scheduler)
+            result['snapshot'] = 'cold' if i == 0 else 'warm'
+            runs.append(result)
+            print(f"прогон {i + 1} ({result['snapshot']}): первый ответ через {result['first_update_s']:.2f} с, "
+                  f"RSS {result['rss_at_first_update_mb']:.0f} МБ, пиковый RSS {result['peak_rss_mb']:.0f} МБ")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    warm = [r['first_update_s'] for r in runs[1:]] or [runs[0]['first_update_s']]
+    results = {
+        'benchmark': 'startup',
+        'users': args.users,
+        'scheduler': not args.no_scheduler,
+        'runs': runs,
+        'first_update_median_s': statistics.median(warm),
+        'peak_rss_max_mb': max(r['peak_rss_mb'] for r in runs),
+    }
+    print(f"медиана до первого ответа {results['first_update_median_s']:.2f} с, "
+          f"пиковый RSS {results['peak_rss_max_mb']:.0f} МБ")
+    if args.json:
+        dump_results(args.json, results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
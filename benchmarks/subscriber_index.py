@@ -0,0 +1,104 @@
+"""
+Выбор получателей одной рассылки при 100k пользователях: обратный индекс
+prayer_subscribers против полного перебора подписок.
+
+Сравниваются три способа:
+  scan_sets   — исходный цикл send_prayer_notification: копия subscriptions.items()
+                и проверка намаза в множестве строк у каждого пользователя
+  scan_masks  — тот же перебор по нынешним битовым маскам с проверкой города
+  index       — list(city_subscribers(city)[prayer]), как сейчас в рассылке
+
+Для каждого — время выбора (минимум из --repeat), пик выделенной памяти
+(tracemalloc) и число получателей. Отдельно — цена поддержания индекса на
+одно изменение подписки.
+
+    python benchmarks/subscriber_index.py --users 100000 --json benchmarks/results/subscriber_index.json
+"""
+
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+
+from fake_api import dump_results
+from generators import TIME_PRAYERS, synthetic_users
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CITIES = ('cherkessk', 'kazan', 'moscow')
+
+
+def import_main():
+    os.environ.setdefault('API_TOKEN', '1:bench')
+    sys.path.insert(0, REPO_DIR)
+    import main
+    return main
+
+
+def peak_allocated(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20, help='повторов каждого замера, берётся минимум')
+    parser.add_argument('--json', help='куда сохранить результаты')
+    args = parser.parse_args()
+
+    bot = import_main()
+    users = synthetic_users(args.users, CITIES)
+    # Исходное представление: множества названий намазов, один город на всех
+    legacy = {user_id: {p for p, bit in bot.PRAYER_BITS.items() if mask & bit} for user_id, mask, _ in users}
+    for user_id, mask, city in users:
+        if city:
+            bot.user_cities[user_id] = city
+        bot.set_user_prayers(user_id, mask)
+
+    city, prayer = bot.DEFAULT_CITY, 'Fajr'
+    bit = bot.PRAYER_BITS[prayer]
+    selectors = {
+        'scan_sets': lambda: [user_id for user_id, prayers in list(legacy.items()) if prayer in prayers],
+        'scan_masks': lambda: [user_id for user_id, mask in bot.subscriptions.items()
+                               if mask & bit and bot.get_user_city(user_id) == city],
+        'index': lambda: list(bot.city_subscribers(city)[prayer]),
+    }
+    assert sorted(selectors['scan_masks']()) == sorted(selectors['index']())
+
+    results = {}
+    for name, select in selectors.items():
+        seconds = min(timeit.repeat(select, number=1, repeat=args.repeat))
+        results[name] = {'ms': seconds * 1000, 'recipients': len(select()), 'peak_bytes': peak_allocated(select)}
+    # Изменение подписки: маска в словаре против маски с переносом по индексу
+    user_ids = [user_id for user_id, _, _ in users[:10000]]
+
+    def toggle_plain():
+        for user_id in user_ids:
+            bot.subscriptions[user_id] ^= bit
+
+    def toggle_indexed():
+        for user_id in user_ids:
+            bot.toggle_user_prayer(user_id, prayer)
+
+    update_us = {name: min(timeit.repeat(func, number=2, repeat=5)) / (2 * len(user_ids)) * 1e6
+                 for name, func in (('plain', toggle_plain), ('indexed', toggle_indexed))}
+
+    for name, result in results.items():
+        print(f"{name:<11} {result['ms']:8.2f} мс, получателей {result['recipients']}, "
+              f"пик памяти {result['peak_bytes'] / 1024:.0f} КиБ")
+    day_ms = {name: result['ms'] * 2 * len(TIME_PRAYERS) for name, result in results.items()}
+    print(f"за день (10 рассылок, один город): перебор {day_ms['scan_sets']:.0f} мс, индекс {day_ms['index']:.0f} мс; "
+          f"индекс быстрее перебора масок в {results['scan_masks']['ms'] / results['index']['ms']:.1f} раза")
+    print(f"изменение подписки: {update_us['plain']:.2f} мкс без индекса, {update_us['indexed']:.2f} мкс с индексом")
+    if args.json:
+        dump_results(args.json, {'benchmark': 'subscriber_index', 'users': args.users, 'city': city, 'prayer': prayer,
+                                 'selection': results, 'day_ms': day_ms, 'update_us': update_us})
+
+
+if __name__ == "__main__":
+    main()
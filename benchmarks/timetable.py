@@ -0,0 +1,167 @@
+"""
+Процессорное время на один запрос к расписанию: исходный словарь строк
+"HH:MM" против нынешнего Timetable (минуты в массиве по дню года).
+
+  status       — get_current_prayer_status: исходная версия разбирала время
+                 каждого намаза strptime на каждом запросе
+  today_view   — весь ответ на «🕐 Сегодня»: выборка дня, текст, статус
+  schedule_day — планирование уведомлений одного дня: исходная
+                 schedule_prayer_notifications (split строк и CronTrigger)
+                 против notification_plan(days=1) и add_notification_job
+
+Исходные функции скопированы из первой версии бота; текущее время передаётся
+параметром, чтобы обе версии считали одни и те же моменты — каждый час суток.
+Задания добавляются в незапущенный планировщик, как при старте бота.
+
+    python benchmarks/timetable.py --json benchmarks/results/timetable.json
+"""
+
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from fake_api import dump_results
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_main():
+    os.environ.update({'API_TOKEN': '1:bench', 'CITIES_DIR': REPO_DIR, 'CALC_CITIES': '', 'CSV_WATCH_INTERVAL': '0',
+                       'TIMETABLE_CACHE_DIR': ''})
+    sys.path.insert(0, REPO_DIR)
+    logging.disable(logging.INFO)
+    import main
+    return main
+
+
+# ==================== ИСХОДНАЯ ВЕРСИЯ ====================
+def legacy_prayer_data(path):
+    prayer_data = {}
+    with open(path, 'r', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            prayer_data[row['Date'].strip()] = {k: v.strip() for k, v in row.items() if k != 'Date'}
+    return prayer_data
+
+
+def legacy_status(bot, times, now):
+    now = now.time()
+    current_prayer = "Ночь"
+    next_prayer = bot.TIME_PRAYER_ORDER[0]
+    time_to_next = None
+    for prayer in bot.TIME_PRAYER_ORDER:
+        prayer_time_str = times.get(prayer)
+        if not prayer_time_str:
+            continue
+        prayer_time = datetime.strptime(prayer_time_str, "%H:%M").time()
+        if now < prayer_time:
+            next_prayer = prayer
+            time_to_next = datetime.combine(datetime.today(), prayer_time) - datetime.combine(datetime.today(), now)
+            break
+        current_prayer = prayer
+    if time_to_next:
+        hours, remainder = divmod(time_to_next.seconds, 3600)
+        minutes = remainder // 60
+        return f"🕌 *Текущий намаз:* {bot.PRAYER_NAMES.get(current_prayer, current_prayer)}\n⏳ *До следующего ({bot.PRAYER_NAMES[next_prayer]}):* {hours} ч. {minutes} мин."
+    return f"🕌 *Текущий намаз:* {bot.PRAYER_NAMES.get(current_prayer, current_prayer)}\n🌙 Следующий день"
+
+
+def legacy_format(bot, times, date_obj):
+    month_name_ru = bot.MONTHS_RU.get(date_obj.month, date_obj.strftime("%B"))
+    text = f"📅 {date_obj.day:02d} {month_name_ru}\n📍 Черкесск (КЧР)\n\n"
+    text += f"🌄 Фаджр:         {times.get('Fajr', '--:--')}\n"
+    text += f"Восход:          {times.get('Sunrise', '--:--')}\n"
+    text += f"☀️ Зухр:          {times.get('Duhr', '--:--')}\n"
+    text += f"🌤 Аср:           {times.get('Asr', '--:--')}\n"
+    text += f"🌅 Магриб:        {times.get('Maghrib', '--:--')}\n"
+    text += f"🌙 Иша:           {times.get('Isha', '--:--')}\n\n"
+    text += f"Треть ночи:      {times.get('FirstThird', '--:--')}\n"
+    text += f"Полночь:         {times.get('Midnight', '--:--')}\n"
+    text += f"Посл.1/3 ночи:   {times.get('LastThird', '--:--')}\n"
+    return text
+
+
+def legacy_schedule(bot, prayer_data, today):
+    from apscheduler.triggers.cron import CronTrigger
+
+    async def send_prayer_notification(*args):
+        pass
+
+    scheduler = bot.scheduler
+    scheduler.remove_all_jobs()
+    today_str = today.strftime("%d.%m")
+    times = prayer_data.get(today_str, {})
+    prayers = [(bot.PRAYER_NAMES[p], times[p]) for p in bot.TIME_PRAYER_ORDER if times.get(p)]
+    for prayer_name, prayer_time_str in prayers:
+        hour, minute = map(int, prayer_time_str.split(':'))
+        prayer_dt = today.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        scheduler.add_job(send_prayer_notification, CronTrigger(hour=hour, minute=minute, timezone=bot.TIMEZONE),
+                          args=[prayer_name, prayer_time_str, times, False], id=f"{prayer_name}_{today_str}")
+        reminder_dt = prayer_dt - timedelta(minutes=10)
+        scheduler.add_job(send_prayer_notification,
+                          CronTrigger(hour=reminder_dt.hour, minute=reminder_dt.minute, timezone=bot.TIMEZONE),
+                          args=[prayer_name, prayer_time_str, times, True], id=f"reminder_{prayer_name}_{today_str}")
+
+
+# ==================== ТЕКУЩАЯ ВЕРСИЯ ====================
+def current_schedule(bot, today):
+    bot.scheduler.remove_all_jobs()
+    for job_id, (fire_dt, is_reminder, targets) in bot.notification_plan(today, days=1).items():
+        bot.add_notification_job(job_id, fire_dt, is_reminder, targets)
+
+
+def cpu_us(func, moments, number):
+    """Среднее процессорное время одного вызова func(момент), мкс"""
+    started = time.process_time()
+    for _ in range(number):
+        for now in moments:
+            func(now)
+    return (time.process_time() - started) / (number * len(moments)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--date', default='2026-10-17', help='день замера, YYYY-MM-DD')
+    parser.add_argument('--number', type=int, default=2000, help='проходов по 24 моментам для запросов')
+    parser.add_argument('--json', help='куда сохранить результаты')
+    args = parser.parse_args()
+
+    bot = import_main()
+    bot.load_prayer_data()
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    bot.scheduler = AsyncIOScheduler(timezone=bot.TIMEZONE)
+    city = bot.DEFAULT_CITY
+    prayer_data = legacy_prayer_data(os.path.join(REPO_DIR, 'prayer_times_cherkessk.csv'))
+    day = datetime.strptime(args.date, '%Y-%m-%d')
+    moments = [bot.TIMEZONE.localize(day.replace(hour=hour, minute=17)) for hour in range(24)]
+    for now in moments:
+        assert legacy_status(bot, prayer_data[now.strftime('%d.%m')], now) == bot.get_current_prayer_status(city, now)
+
+    def legacy_today(now):
+        times = prayer_data.get(now.strftime("%d.%m"), {})
+        return legacy_format(bot, times, now), legacy_status(bot, times, now)
+
+    def current_today(now):
+        return bot.render_day(city, now), bot.get_current_prayer_status(city, now)
+
+    cases = {
+        'status': (lambda now: legacy_status(bot, prayer_data[now.strftime('%d.%m')], now),
+                   lambda now: bot.get_current_prayer_status(city, now), args.number),
+        'today_view': (legacy_today, current_today, args.number),
+        'schedule_day': (lambda now: legacy_schedule(bot, prayer_data, now),
+                         lambda now: current_schedule(bot, now), max(1, args.number // 20)),
+    }
+    results = {}
+    for name, (legacy, current, number) in cases.items():
+        before, after = cpu_us(legacy, moments, number), cpu_us(current, moments, number)
+        results[name] = {'before_us': before, 'after_us': after, 'speedup': before / after}
+        print(f"{name:<13} было {before:8.1f} мкс, стало {after:8.1f} мкс, быстрее в {before / after:.1f} раза")
+    if args.json:
+        dump_results(args.json, {'benchmark': 'timetable', 'date': args.date, 'results': results})
+
+
+if __name__ == "__main__":
+    main()
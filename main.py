@@ -13,20 +13,34 @@
 
 import asyncio
 import os
+import hmac
+import signal
+import calendar
 import csv
+import hashlib
 import json
 import logging
-from datetime import datetime, timedelta
+import re
+import struct
+import sys
+import functools
+import threading
+import time
+from array import array
+from collections import Counter, namedtuple
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, time as dt_time
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 
 # Импорты для Telegram бота
 from aiogram import Bot, Dispatcher, types
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
 from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton, Update
 
-# Импорты для планировщика уведомлений
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
+# aiohttp.web (webhook, метрики), apscheduler и prayer_calc импортируются при
+# первом использовании: процессу без планировщика и webhook они не нужны
 
 # Импорты для конфигурации
 from dotenv import load_dotenv
@@ -49,13 +63,72 @@ if not API_TOKEN:
     logger.critical("Не найден API_TOKEN!")
     exit(1)
 
-# Названия файлов с данными
-CSV_FILE = 'prayer_times_cherkessk.csv'
+# Свой адрес Bot API (локальный telegram-bot-api или заглушка из benchmarks/); по умолчанию api.telegram.org
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # публичный адрес, например https://bot.example.com/webhook
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))  # при переполнении отвечаем 503, Telegram повторит
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '20'))  # одновременно обрабатываемых обновлений
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', '10'))  # секунд на дообработку очереди при остановке
+# Процесс бота на базу подписок — один (см. acquire_instance_lock): подписки живут в его памяти
+# и из базы не перечитываются, поэтому несколько реплик за балансировщиком не поддерживаются.
+# SCHEDULER_ENABLED=0 — только отвечать на обновления, без уведомлений
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', '1') == '1'
+
+if BOT_MODE not in ('polling', 'webhook'):
+    logger.critical(f"Неизвестный BOT_MODE: {BOT_MODE}")
+    exit(1)
+if BOT_MODE == 'webhook' and not (WEBHOOK_URL and WEBHOOK_SECRET):
+    logger.critical("Для BOT_MODE=webhook нужны WEBHOOK_URL и WEBHOOK_SECRET!")
+    exit(1)
+
+# Администраторы бота (через запятую), им доступны команды /reload и /profile
+ADMIN_IDS = {int(x) for x in os.getenv('ADMIN_IDS', '').split(',') if x.strip()}
+
+# Названия файлов с данными: расписание каждого города лежит в CITIES_DIR/prayer_times_<город>.csv
+CITIES_DIR = os.getenv('CITIES_DIR', '.')
+CITY_FILE_RE = re.compile(r'prayer_times_(\w+)\.csv')
+DEFAULT_CITY = os.getenv('DEFAULT_CITY', 'cherkessk')
+# Города без CSV, расписание которых рассчитывается по координатам:
+# "город=широта,долгота;город2=широта,долгота" (поясное время — TIMEZONE)
+CALC_CITIES = {
+    city.strip(): tuple(map(float, coords.split(',')))
+    for city, coords in (item.split('=') for item in os.getenv('CALC_CITIES', '').split(';') if item.strip())
+}
+CALC_METHOD = os.getenv('CALC_METHOD', 'MWL')  # см. prayer_calc.METHODS
+# Фаджр и Иша там, где Солнце не опускается на угол метода: AngleBased, OneSeventh, NightMiddle; пусто — без правила
+CALC_HIGH_LATS = os.getenv('CALC_HIGH_LATS', 'AngleBased') or None
+# Поправки в минутах к рассчитанным временам, чтобы совпасть с местным расписанием:
+# "Duhr=15,Asr=8,Maghrib=-3" (подобрать их помогает benchmarks/calculation.py --method <метод> --adjustments <поправки>)
+CALC_ADJUSTMENTS = {
+    prayer.strip(): int(minutes)
+    for prayer, minutes in (item.split('=') for item in os.getenv('CALC_ADJUSTMENTS', '').split(',') if item.strip())
+}
+CSV_WATCH_INTERVAL = float(os.getenv('CSV_WATCH_INTERVAL', '30'))  # секунд между проверками CSV; 0 — не следить
 SUBSCRIPTIONS_DB = 'subscriptions.db'  # Теперь используем SQLite вместо JSON
+DB_FLUSH_DELAY = float(os.getenv('DB_FLUSH_DELAY', '0.5'))  # секунд на накопление изменений перед записью
+DB_LOAD_BATCH = 10000  # строк за одну выборку при загрузке подписок
+# Бинарные снимки разобранных расписаний, чтобы не разбирать CSV при каждом старте; пусто — не использовать
+TIMETABLE_CACHE_DIR = os.getenv('TIMETABLE_CACHE_DIR', '.timetable_cache')
 
 # Устанавливаем часовой пояс
 TIMEZONE = pytz.timezone('Europe/Moscow')
 
+# Названия городов для интерфейса; для остальных используется имя файла
+CITY_NAMES = {
+    'cherkessk': 'Черкесск (КЧР)',
+}
+# Координаты городов с CSV для экрана информации; у рассчитываемых они берутся из CALC_CITIES
+CITY_COORDINATES = {
+    'cherkessk': (44.22333, 42.05778),
+}
+
 # Словарь с русскими названиями месяцев
 MONTHS_RU = {
     1: "Январь", 2: "Февраль", 3: "Март", 4: "Апрель",
@@ -78,77 +151,949 @@ PRAYER_ORDER_MONTH = ['Fajr', 'Duhr', 'Asr', 'Maghrib', 'Isha']
 DETAILED_PRAYER_ORDER = ['Fajr', 'Sunrise', 'Duhr', 'Asr', 'Maghrib', 'Isha', 'FirstThird', 'Midnight', 'LastThird']
 TIME_PRAYER_ORDER = ['Fajr', 'Duhr', 'Asr', 'Maghrib', 'Isha']
 
+# Выбор намазов хранится битовой маской: один бит на намаз из TIME_PRAYER_ORDER
+PRAYER_BITS = {p: 1 << i for i, p in enumerate(TIME_PRAYER_ORDER)}
+ALL_PRAYERS_MASK = (1 << len(TIME_PRAYER_ORDER)) - 1
+
+# Настройки планировщика уведомлений
+NOTIFY_DAYS_AHEAD = int(os.getenv('NOTIFY_DAYS_AHEAD', '3'))  # на сколько дней вперёд планировать задания
+NOTIFY_MISFIRE_GRACE = int(os.getenv('NOTIFY_MISFIRE_GRACE', '600'))  # секунд, в течение которых опоздавшее задание ещё выполняется
+REMINDER_LEAD = timedelta(minutes=10)  # напоминание за 10 мин до намаза
+
+# Настройки рассылки
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))  # сообщений в секунду (глобальный лимит Telegram ~30/сек)
+BROADCAST_BURST = int(os.getenv('BROADCAST_BURST', '25'))  # допустимый всплеск сверх средней скорости
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '20'))  # одновременных отправок
+BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', '3'))  # повторов после RetryAfter
+CHAT_MIN_INTERVAL = float(os.getenv('CHAT_MIN_INTERVAL', '1'))  # секунд между сообщениями в один чат (лимит Telegram ~1/сек)
+DELIVERY_MAX_RETRIES = int(os.getenv('DELIVERY_MAX_RETRIES', '3'))  # фоновых повторов после временной ошибки
+DELIVERY_RETRY_BASE = float(os.getenv('DELIVERY_RETRY_BASE', '5'))  # секунд до первого повтора, дальше вдвое больше
+DELIVERY_PRUNE_AFTER = int(os.getenv('DELIVERY_PRUNE_AFTER', '3'))  # подряд неудач "заблокирован" до отписки
+DELIVERY_BATCH = 500  # событий доставки за один проход обработчика
+# Рассылка в отдельных процессах: 0 — отправлять из основного процесса
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', '0'))
+BROADCAST_QUEUE_DB = os.getenv('BROADCAST_QUEUE_DB', 'broadcast_queue.db')  # очередь шардов между процессами
+BROADCAST_POLL_INTERVAL = float(os.getenv('BROADCAST_POLL_INTERVAL', '0.2'))  # секунд между опросами очереди
+# Срок рассылки через воркеры: очередь самого загруженного воркера на его доле лимита, умноженная на
+# BROADCAST_SHARD_SLACK (паузы чатов после CHAT_MIN_INTERVAL и RetryAfter), плюс BROADCAST_SHARD_GRACE секунд.
+# После срока незавершённые шарды бросаются
+BROADCAST_SHARD_SLACK = float(os.getenv('BROADCAST_SHARD_SLACK', '1.2'))
+BROADCAST_SHARD_GRACE = float(os.getenv('BROADCAST_SHARD_GRACE', '300'))
+# Доля BROADCAST_RATE, которую при работающих воркерах оставляет себе основной процесс для фоновых повторов
+BROADCAST_RETRY_SHARE = float(os.getenv('BROADCAST_RETRY_SHARE', '0.1'))
+
+# Метрики и профилирование
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'  # замер времени каждого обработчика; 0 — без middleware
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # порт /metrics в формате Prometheus; 0 — не поднимать
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.5'))  # секунд между замерами задержки цикла событий
+LOOP_LAG_WARN = float(os.getenv('LOOP_LAG_WARN', '0.1'))  # задержка цикла, о которой пишем предупреждение
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))  # секунд между снимками стека профилировщика
+
 # ==================== ИНИЦИАЛИЗАЦИЯ КОМПОНЕНТОВ ====================
-bot = Bot(token=API_TOKEN)
+if TELEGRAM_API_URL:
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    bot = Bot(token=API_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=API_TOKEN)
 dp = Dispatcher()
-scheduler = AsyncIOScheduler(timezone=TIMEZONE)
+scheduler = None  # AsyncIOScheduler, создаётся в on_startup при SCHEDULER_ENABLED
 
 # Глобальные переменные
-prayer_data = {}
-subscriptions = {}  # dict: user_id -> set of prayers (e.g., {'Fajr', 'Duhr'})
+# subscriptions (user_id -> маска намазов) объявлен ниже, после своего класса UserMasks
+user_cities = {}  # dict: user_id -> city, только для выбравших город, отличный от DEFAULT_CITY
+prayer_subscribers = {}  # обратный индекс: city -> prayer -> UserIdSet
+
+# ==================== МЕТРИКИ ====================
+# Свой минимальный экспорт в текстовом формате Prometheus: гистограммы и
+# счётчики с метками плюс значения, снимаемые в момент запроса /metrics.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BROADCAST_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Histogram:
+    """Гистограмма Prometheus: корзины хранятся без накопления, суммируются при выводе"""
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # значения меток -> [счётчики корзин..., +Inf, сумма]
+
+    def observe(self, label_values, value):
+        entry = self.values.get(label_values)
+        if entry is None:
+            entry = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, entry in sorted(self.values.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), entry):
+                total += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, label_values, le)} {total}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, label_values)} {entry[-1]}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, label_values)} {total}")
+        return lines
+
+
+class CounterMetric:
+    """Счётчик Prometheus с метками"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = Counter()
+
+    def inc(self, label_values, amount=1):
+        self.values[label_values] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{format_labels(self.labels, k)} {v}" for k, v in sorted(self.values.items())]
+        return lines
+
+
+handler_seconds = Histogram('prayer_bot_handler_seconds', 'Время обработки обновления', ('handler',))
+broadcast_seconds = Histogram('prayer_bot_broadcast_seconds', 'Длительность рассылки', ('prayer', 'kind'), BROADCAST_BUCKETS)
+broadcast_last_delivery_seconds = Histogram('prayer_bot_broadcast_last_delivery_seconds',
+                                            'Время от начала рассылки до последней доставки', ('prayer', 'kind'),
+                                            BROADCAST_BUCKETS)
+deliveries_total = CounterMetric('prayer_bot_deliveries_total', 'Исходы доставки сообщений', ('outcome',))
+scheduler_lag_seconds = Histogram('prayer_bot_scheduler_lag_seconds', 'Опоздание задания относительно плана', ('kind',),
+                                  (0.01, 0.05, 0.1, 0.5, 1, 5, 30, 60, 300, 600))
+db_seconds = Histogram('prayer_bot_db_seconds', 'Время операции SQLite вместе с ожиданием потока', ('operation',))
+loop_lag_seconds = Histogram('prayer_bot_event_loop_lag_seconds', 'Задержка цикла событий сверх ожидаемого сна')
+metrics = [handler_seconds, broadcast_seconds, broadcast_last_delivery_seconds, deliveries_total,
+           scheduler_lag_seconds, db_seconds, loop_lag_seconds]
+
+# Текущие значения, снимаемые при каждом запросе
+gauges = {
+    'prayer_bot_subscribers': lambda: len(subscriptions),
+    'prayer_bot_delivery_queue': lambda: delivery_events.qsize(),
+    'prayer_bot_delivery_retries_pending': lambda: len(delivery_retry_tasks),
+    'prayer_bot_webhook_queue': lambda: webhook_server.queue.qsize() if webhook_server else 0,
+    'prayer_bot_planned_jobs': lambda: len(planned_jobs),
+    'prayer_bot_dirty_users': lambda: len(dirty_users),
+}
+
+def render_metrics():
+    lines = []
+    for metric in metrics:
+        lines += metric.render()
+    for name, read in gauges.items():
+        lines += [f"# TYPE {name} gauge", f"{name} {read()}"]
+    return '\n'.join(lines) + '\n'
+
+async def measure_handler(handler, event, data):
+    """Внутренний middleware aiogram: время работы сработавшего обработчика"""
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    finally:
+        handler_seconds.observe((data['handler'].callback.__name__,), time.perf_counter() - started)
+
+# Накладные расходы замерены benchmarks/metrics_overhead.py
+if METRICS_ENABLED:
+    dp.message.middleware(measure_handler)
+    dp.callback_query.middleware(measure_handler)
+
+async def watch_event_loop():
+    """Замечает блокировки цикла событий: насколько позже запланированного просыпается sleep"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - started - LOOP_LAG_INTERVAL)
+        loop_lag_seconds.observe((), lag)
+        if lag >= LOOP_LAG_WARN:
+            logger.warning(f"Цикл событий был заблокирован на {lag * 1000:.0f} мс")
+
+
+class SamplingProfiler:
+    """Семплирующий профилировщик: фоновый поток раз в PROFILE_INTERVAL снимает стек главного потока.
+
+    Пока выключен, ничего не стоит; включается и выключается командой /profile.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.thread = None
+        self.stopping = threading.Event()
+        self.self_samples = Counter()  # функция на вершине стека
+        self.total_samples = Counter()  # функция где угодно в стеке
+        self.samples = 0
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        self.self_samples.clear()
+        self.total_samples.clear()
+        self.samples = 0
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, args=(threading.get_ident(),), name="profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+
+    def _run(self, thread_id):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.self_samples[self._describe(frame)] += 1
+            seen = set()
+            while frame is not None:
+                seen.add(self._describe(frame))
+                frame = frame.f_back
+            self.total_samples.update(seen)
+
+    @staticmethod
+    def _describe(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def report(self, limit=15):
+        if not self.samples:
+            return "Снимков нет"
+        lines = [f"Снимков: {self.samples}, собственное время / общее время:"]
+        for name, count in self.self_samples.most_common(limit):
+            lines.append(f"{100 * count / self.samples:5.1f}% / {100 * self.total_samples[name] / self.samples:5.1f}%  {name}")
+        return '\n'.join(lines)
+
+
+profiler = SamplingProfiler()
+loop_watch_task = None
+metrics_runner = None
+
+async def start_metrics_server():
+    global metrics_runner
+    from aiohttp import web
+    async def handle(request):
+        return web.Response(text=render_metrics(), content_type='text/plain', charset='utf-8')
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    metrics_runner = web.AppRunner(app, access_log=None)
+    await metrics_runner.setup()
+    await web.TCPSite(metrics_runner, METRICS_HOST, METRICS_PORT).start()
+    logger.info(f"Метрики доступны на http://{METRICS_HOST}:{METRICS_PORT}/metrics")
 
 # ==================== РАБОТА С БАЗОЙ ДАННЫХ (SQLite) ====================
+# Одно долгоживущее соединение; все записи выполняются в отдельном потоке,
+# чтобы не блокировать event loop. Изменённые user_id копятся в dirty_users и
+# сбрасываются одной транзакцией.
+db_conn = None
+db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+dirty_users = set()
+flush_task = None
+instance_lock = None  # открытый файл блокировки базы, держится до остановки бота
+
+def acquire_instance_lock():
+    """Захватывает базу подписок для этого процесса; False, если её держит другой процесс бота.
+
+    Подписки загружаются в память один раз: вторая реплика с той же базой не
+    увидела бы изменений первой, а её запись затёрла бы их.
+    """
+    global instance_lock
+    import fcntl
+    lock = open(f"{SUBSCRIPTIONS_DB}.lock", 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return False
+    instance_lock = lock
+    return True
+
+def release_instance_lock():
+    global instance_lock
+    if instance_lock is not None:
+        instance_lock.close()
+        instance_lock = None
+
 def init_db():
-    conn = sqlite3.connect(SUBSCRIPTIONS_DB)
-    cursor = conn.cursor()
-    cursor.execute('''
+    global db_conn
+    db_conn = sqlite3.connect(SUBSCRIPTIONS_DB, check_same_thread=False)
+    db_conn.execute('PRAGMA journal_mode=WAL')
+    db_conn.execute('PRAGMA synchronous=NORMAL')
+    db_conn.execute('''
         CREATE TABLE IF NOT EXISTS subscriptions (
             user_id INTEGER PRIMARY KEY,
-            prayers TEXT  -- JSON-encoded set of prayers
+            mask INTEGER NOT NULL DEFAULT 0,  -- bitmask of prayers, see PRAYER_BITS
+            city TEXT  -- NULL means DEFAULT_CITY
         )
     ''')
-    conn.commit()
-    conn.close()
-
-def load_subscriptions():
-    global subscriptions
-    conn = sqlite3.connect(SUBSCRIPTIONS_DB)
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id, prayers FROM subscriptions')
-    rows = cursor.fetchall()
-    for user_id, prayers_json in rows:
-        subscriptions[user_id] = set(json.loads(prayers_json)) if prayers_json else set(TIME_PRAYER_ORDER)
-    conn.close()
-    logger.info(f"Загружено {len(subscriptions)} подписок")
-
-def save_subscriptions():
-    conn = sqlite3.connect(SUBSCRIPTIONS_DB)
-    cursor = conn.cursor()
-    for user_id, prayers in subscriptions.items():
-        prayers_json = json.dumps(list(prayers))
-        cursor.execute('INSERT OR REPLACE INTO subscriptions (user_id, prayers) VALUES (?, ?)', (user_id, prayers_json))
-    conn.commit()
-    conn.close()
-    logger.info("Подписки сохранены")
+    # Запланированные уведомления: переживают перезапуск, done отмечает уже сработавшие
+    db_conn.execute('''
+        CREATE TABLE IF NOT EXISTS notification_jobs (
+            job_id TEXT PRIMARY KEY,
+            fire_at TEXT NOT NULL,  -- ISO 8601 in TIMEZONE
+            is_reminder INTEGER NOT NULL,
+            targets TEXT NOT NULL,  -- JSON: [[city, prayer, "HH:MM"], ...]
+            done INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    migrate_db()
+    # Частичный индекс на каждый намаз: выборка подписчиков одного намаза без полного скана
+    for prayer, bit in PRAYER_BITS.items():
+        db_conn.execute(f'CREATE INDEX IF NOT EXISTS idx_subscriptions_{prayer.lower()} '
+                        f'ON subscriptions(user_id) WHERE mask & {bit}')
+    db_conn.execute('CREATE INDEX IF NOT EXISTS idx_subscriptions_city ON subscriptions(user_id) WHERE city IS NOT NULL')
+    db_conn.commit()
+
+def prayers_json_to_mask(prayers_json):
+    if not prayers_json:
+        return ALL_PRAYERS_MASK  # как и раньше: пустое значение означает подписку на все
+    return sum(PRAYER_BITS[p] for p in set(json.loads(prayers_json)) if p in PRAYER_BITS)
+
+def migrate_db():
+    """Доводит старые схемы до текущей: JSON в колонке prayers -> битовая маска, колонка города"""
+    columns = {row[1] for row in db_conn.execute('PRAGMA table_info(subscriptions)')}
+    if 'mask' not in columns:
+        logger.info("Миграция подписок: JSON -> битовая маска")
+        db_conn.create_function('prayers_json_to_mask', 1, prayers_json_to_mask, deterministic=True)
+        with db_conn:
+            db_conn.execute('ALTER TABLE subscriptions ADD COLUMN mask INTEGER NOT NULL DEFAULT 0')
+            db_conn.execute('UPDATE subscriptions SET mask = prayers_json_to_mask(prayers)')
+        # Колонка prayers остаётся, но больше не используется
+    if 'city' not in columns:
+        logger.info("Миграция подписок: добавлена колонка city")
+        with db_conn:
+            db_conn.execute('ALTER TABLE subscriptions ADD COLUMN city TEXT')
+
+def close_db():
+    global db_conn
+    if db_conn is not None:
+        db_conn.close()
+        db_conn = None
+
+# Подписки загружаются в два этапа: города (их немного) — до начала приёма
+# обновлений, чтобы расписание сразу показывалось для нужного города, а маски —
+# пачками в фоне. Пока subscriptions_loaded не установлен, обработчики,
+# меняющие подписки, и рассылки ждут окончания загрузки.
+subscriptions_loaded = asyncio.Event()
+subscriptions_task = None
+
+def load_user_cities():
+    for user_id, city in db_conn.execute('SELECT user_id, city FROM subscriptions WHERE city IS NOT NULL'):
+        if city == DEFAULT_CITY:
+            continue
+        if city in registry:
+            user_cities[user_id] = city
+        else:
+            logger.warning(f"Пользователь {user_id}: неизвестный город {city}, используем {DEFAULT_CITY}")
+
+def open_subscriptions_cursor():
+    # По возрастанию user_id: UserMasks и UserIdSet тогда только дописывают в конец
+    return db_conn.execute('SELECT user_id, mask FROM subscriptions ORDER BY user_id')
+
+async def load_subscriptions():
+    """Загружает маски подписок; при ошибке main() останавливает бота (см. там)"""
+    started = time.monotonic()
+    try:
+        cursor = await run_db(open_subscriptions_cursor)
+        while rows := await run_db(cursor.fetchmany, DB_LOAD_BATCH):
+            for user_id, mask in rows:
+                # Пользователь загружается впервые: снимать старые записи индекса незачем
+                subscriptions[user_id] = mask
+                index_user(user_id)
+    except Exception as e:
+        logger.critical(f"Не удалось загрузить подписки: {e}")
+        raise
+    subscriptions_loaded.set()
+    logger.info(f"Загружено {len(subscriptions)} подписок за {time.monotonic() - started:.2f} с")
+
+def write_subscription_changes(upserts, deletes):
+    with db_conn:  # одна транзакция на всю пачку
+        db_conn.executemany('INSERT OR REPLACE INTO subscriptions (user_id, mask, city) VALUES (?, ?, ?)', upserts)
+        db_conn.executemany('DELETE FROM subscriptions WHERE user_id = ?', deletes)
+
+def save_user(user_id):
+    """Помечает подписку пользователя для записи; запись произойдёт через DB_FLUSH_DELAY"""
+    global flush_task
+    dirty_users.add(user_id)
+    if flush_task is None or flush_task.done():
+        flush_task = asyncio.get_running_loop().create_task(delayed_flush())
+
+async def delayed_flush():
+    global flush_task
+    await asyncio.sleep(DB_FLUSH_DELAY)
+    # Изменения, пришедшие во время записи, запланируют новый сброс
+    flush_task = None
+    await flush_subscriptions()
+
+async def flush_subscriptions():
+    if not dirty_users:
+        return
+    # Снимок берётся в потоке event loop, поэтому он согласован с subscriptions
+    batch = list(dirty_users)
+    dirty_users.clear()
+    stored = [user_id for user_id in batch if user_id in subscriptions or user_id in user_cities]
+    upserts = [(user_id, subscriptions.get(user_id, 0), user_cities.get(user_id)) for user_id in stored]
+    deletes = [(user_id,) for user_id in set(batch).difference(stored)]
+    try:
+        await run_db(write_subscription_changes, upserts, deletes)
+        logger.info(f"Подписки сохранены: обновлено {len(upserts)}, удалено {len(deletes)}")
+    except Exception as e:
+        logger.error(f"Ошибка сохранения подписок: {e}")
+        dirty_users.update(batch)  # повторим при следующей записи
+
+def load_notification_jobs():
+    """Все сохранённые задания: {job_id: (fire_dt, is_reminder, targets, done)}"""
+    jobs = {}
+    for job_id, fire_at, is_reminder, targets, done in db_conn.execute(
+            'SELECT job_id, fire_at, is_reminder, targets, done FROM notification_jobs'):
+        fire_dt = datetime.fromisoformat(fire_at).astimezone(TIMEZONE)
+        jobs[job_id] = (fire_dt, bool(is_reminder), tuple(tuple(t) for t in json.loads(targets)), bool(done))
+    return jobs
+
+def write_notification_jobs(upserts, deletes, prune_before):
+    with db_conn:
+        # Уже сработавшие задания не перезаписываются
+        db_conn.executemany('''
+            INSERT INTO notification_jobs (job_id, fire_at, is_reminder, targets) VALUES (?, ?, ?, ?)
+            ON CONFLICT(job_id) DO UPDATE SET fire_at = excluded.fire_at, is_reminder = excluded.is_reminder,
+                                              targets = excluded.targets
+            WHERE done = 0
+        ''', upserts)
+        db_conn.executemany('DELETE FROM notification_jobs WHERE job_id = ? AND done = 0', deletes)
+        db_conn.execute('DELETE FROM notification_jobs WHERE fire_at < ?', (prune_before,))
+
+def mark_notification_jobs_done(job_ids):
+    with db_conn:
+        db_conn.executemany('UPDATE notification_jobs SET done = 1 WHERE job_id = ?', [(job_id,) for job_id in job_ids])
+
+async def run_db(func, *args):
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(db_executor, func, *args)
+    finally:
+        db_seconds.observe((func.__name__,), time.perf_counter() - started)
+
+async def shutdown_db():
+    if subscriptions_task is not None:
+        subscriptions_task.cancel()
+    if flush_task is not None and not flush_task.done():
+        flush_task.cancel()
+    await flush_subscriptions()
+    db_executor.shutdown(wait=True)
+    close_db()
+
+# ==================== ПОДПИСКИ В ПАМЯТИ ====================
+# Все изменения subscriptions и user_cities идут через эти функции, чтобы
+# prayer_subscribers оставался согласованным и рассылка выбирала получателей
+# своего города без перебора всех подписок.
+class UserIdSet:
+    """Множество user_id в отсортированном массиве int64: 8 байт на запись вместо ~30 у set.
+
+    Подписки грузятся по возрастанию user_id, поэтому при загрузке добавление —
+    это append; вставка в середину сдвигает хвост массива, что при миллионе
+    записей стоит долей миллисекунды на одно изменение подписки.
+    """
+    __slots__ = ('ids',)
+
+    def __init__(self):
+        self.ids = array('q')
+
+    def add(self, user_id):
+        ids = self.ids
+        if not ids or user_id > ids[-1]:
+            ids.append(user_id)
+            return
+        i = bisect_left(ids, user_id)
+        if ids[i] != user_id:
+            ids.insert(i, user_id)
+
+    def discard(self, user_id):
+        ids = self.ids
+        i = bisect_left(ids, user_id)
+        if i < len(ids) and ids[i] == user_id:
+            del ids[i]
+
+    def __contains__(self, user_id):
+        i = bisect_left(self.ids, user_id)
+        return i < len(self.ids) and self.ids[i] == user_id
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+class UserMasks:
+    """user_id -> маска намазов в двух массивах по возрастанию user_id: 9 байт на запись вместо ~75 у dict.
+
+    Умеет ровно то, чем бот пользуется у словаря подписок. Как и у UserIdSet,
+    загрузка по возрастанию user_id — это append, а новый пользователь в
+    середине сдвигает хвосты массивов.
+    """
+    __slots__ = ('ids', 'masks')
+
+    def __init__(self):
+        self.ids = array('q')
+        self.masks = array('B')
+
+    def _find(self, user_id):
+        i = bisect_left(self.ids, user_id)
+        return i, i < len(self.ids) and self.ids[i] == user_id
+
+    def __setitem__(self, user_id, mask):
+        ids = self.ids
+        if not ids or user_id > ids[-1]:
+            ids.append(user_id)
+            self.masks.append(mask)
+            return
+        i, found = self._find(user_id)
+        if found:
+            self.masks[i] = mask
+        else:
+            ids.insert(i, user_id)
+            self.masks.insert(i, mask)
+
+    def __getitem__(self, user_id):
+        i, found = self._find(user_id)
+        if not found:
+            raise KeyError(user_id)
+        return self.masks[i]
+
+    def get(self, user_id, default=None):
+        i, found = self._find(user_id)
+        return self.masks[i] if found else default
+
+    def pop(self, user_id, *default):
+        i, found = self._find(user_id)
+        if not found:
+            if default:
+                return default[0]
+            raise KeyError(user_id)
+        mask = self.masks[i]
+        del self.ids[i]
+        del self.masks[i]
+        return mask
+
+    def __contains__(self, user_id):
+        return self._find(user_id)[1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def items(self):
+        return zip(self.ids, self.masks)
+
+    def clear(self):
+        del self.ids[:]
+        del self.masks[:]
+
+subscriptions = UserMasks()  # user_id -> bitmask of prayers (e.g., PRAYER_BITS['Fajr'] | PRAYER_BITS['Duhr'])
+
+def get_user_city(user_id):
+    return user_cities.get(user_id, DEFAULT_CITY)
+
+def city_subscribers(city):
+    bucket = prayer_subscribers.get(city)
+    if bucket is None:
+        bucket = prayer_subscribers[city] = {p: UserIdSet() for p in TIME_PRAYER_ORDER}
+    return bucket
+
+def index_user(user_id):
+    mask = subscriptions.get(user_id, 0)
+    bucket = city_subscribers(get_user_city(user_id))
+    for prayer, bit in PRAYER_BITS.items():
+        if mask & bit:
+            bucket[prayer].add(user_id)
+
+def unindex_user(user_id):
+    mask = subscriptions.get(user_id, 0)
+    bucket = city_subscribers(get_user_city(user_id))
+    for prayer, bit in PRAYER_BITS.items():
+        if mask & bit:
+            bucket[prayer].discard(user_id)
+
+def set_user_prayers(user_id, mask):
+    unindex_user(user_id)
+    subscriptions[user_id] = mask
+    index_user(user_id)
+
+def toggle_user_prayer(user_id, prayer):
+    unindex_user(user_id)
+    subscriptions[user_id] = subscriptions.get(user_id, 0) ^ PRAYER_BITS[prayer]
+    index_user(user_id)
+
+def set_user_city(user_id, city):
+    unindex_user(user_id)
+    if city == DEFAULT_CITY:
+        user_cities.pop(user_id, None)
+    else:
+        user_cities[user_id] = city
+    index_user(user_id)
+
+def unsubscribe_user(user_id):
+    """Отписка от уведомлений; выбранный город остаётся"""
+    unindex_user(user_id)
+    subscriptions.pop(user_id, None)
+
+def remove_user(user_id):
+    """Полное удаление пользователя вместе с городом, например недоступного чата"""
+    unsubscribe_user(user_id)
+    user_cities.pop(user_id, None)
 
 # ==================== РАБОТА С ДАННЫМИ ====================
+# Смещение начала месяца в високосном году: у 29.02 всегда есть своя строка
+MONTH_OFFSETS = [sum(calendar.monthrange(2000, m)[1] for m in range(1, month)) for month in range(1, 13)]
+DAYS_IN_TABLE = 366
+MISSING_TIME = -1
+TIME_PRAYER_COLUMNS = [DETAILED_PRAYER_ORDER.index(p) for p in TIME_PRAYER_ORDER]
+
+def day_index(month, day):
+    return MONTH_OFFSETS[month - 1] + day - 1
+
+def format_minutes(minutes):
+    """'HH:MM' как на часах: время после полуночи следующего дня (24:14) показывается как 00:14"""
+    minutes %= 24 * 60
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+# Снимок: заголовок (сигнатура, дней, колонок) и массив минут int16 little-endian
+SNAPSHOT_MAGIC = b'PTT1'
+SNAPSHOT_HEADER = struct.Struct('<4sHH')
+
+class Timetable:
+    """Расписание на год, разобранное один раз при загрузке.
+
+    Времена хранятся в минутах от полуночи в плоском массиве: строка на каждый
+    день високосного года, колонка на каждый элемент DETAILED_PRAYER_ORDER.
+    Намаз после полуночи (Иша летом на высоких широтах) остаётся в своём дне
+    и записан как 24:14, то есть 1454 минуты.
+    """
+
+    def __init__(self, minutes):
+        self.minutes = minutes
+        self.days_loaded = 0
+        width = len(DETAILED_PRAYER_ORDER)
+        present = []
+        for index in range(DAYS_IN_TABLE):
+            row = minutes[index * width:(index + 1) * width]
+            if any(m != MISSING_TIME for m in row):
+                self.days_loaded += 1
+            present.append([(row[col], p) for col, p in zip(TIME_PRAYER_COLUMNS, TIME_PRAYER_ORDER) if row[col] != MISSING_TIME])
+        # Для bisect: минуты намазов с уведомлениями по возрастанию и их ключи на каждый день.
+        # Намаз прошлого дня после полуночи (24:14) идёт в начале дня как 00:14
+        self.day_prayers = []
+        for index, today in enumerate(present):
+            carried = [(m - 24 * 60, p) for m, p in present[index - 1] if m >= 24 * 60]
+            day = sorted(carried + today)
+            self.day_prayers.append(([m for m, _ in day], [p for _, p in day]))
+
+    @classmethod
+    def from_snapshot(cls, path):
+        """Из бинарного снимка write_snapshot(); None, если снимка нет или он другого формата"""
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, DAYS_IN_TABLE, len(DETAILED_PRAYER_ORDER))
+        if not data.startswith(header):
+            return None
+        minutes = array('h')
+        minutes.frombytes(data[len(header):])
+        if sys.byteorder == 'big':
+            minutes.byteswap()
+        if len(minutes) != DAYS_IN_TABLE * len(DETAILED_PRAYER_ORDER):
+            return None
+        return cls(minutes)
+
+    def write_snapshot(self, path):
+        """Сохраняет массив минут как есть; запись атомарная, через временный файл"""
+        minutes = array('h', self.minutes)
+        if sys.byteorder == 'big':
+            minutes.byteswap()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(f"{path}.tmp", 'wb') as file:
+            file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, DAYS_IN_TABLE, len(DETAILED_PRAYER_ORDER)))
+            file.write(minutes.tobytes())
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def from_csv(cls, path):
+        with open(path, 'r', encoding='utf-8', newline='') as file:
+            return cls.parse(file)
+
+    @classmethod
+    def parse(cls, lines):
+        return cls.from_rows(csv.DictReader(lines))
+
+    @classmethod
+    def from_prayer_data(cls, data):
+        """Из {'dd.mm': {'Fajr': 'HH:MM', ...}} — формы, которую выдаёт prayer_calc"""
+        return cls.from_rows({'Date': date_str, **times} for date_str, times in data.items())
+
+    @classmethod
+    def from_rows(cls, rows):
+        width = len(DETAILED_PRAYER_ORDER)
+        minutes = array('h', [MISSING_TIME]) * (DAYS_IN_TABLE * width)
+        for row in rows:
+            day, month = map(int, row['Date'].split('.'))
+            base = day_index(month, day) * width
+            for col, prayer in enumerate(DETAILED_PRAYER_ORDER):
+                value = (row.get(prayer) or '').strip()
+                if value:
+                    hour, minute = map(int, value.split(':'))
+                    if not (0 <= hour < 48 and 0 <= minute < 60):
+                        raise ValueError(f"{row['Date']} {prayer}: некорректное время {value}")
+                    minutes[base + col] = hour * 60 + minute
+            # Намаз раньше предыдущего по порядку — уже после полуночи (Иша 00:14 в CSV): переносим в 24:14
+            previous = MISSING_TIME
+            for col in TIME_PRAYER_COLUMNS:
+                if minutes[base + col] == MISSING_TIME:
+                    continue
+                if minutes[base + col] < previous:
+                    minutes[base + col] += 24 * 60
+                previous = minutes[base + col]
+        return cls(minutes)
+
+    def minute_of(self, date_obj, prayer):
+        """Время намаза в минутах от полуночи или None, если данных нет"""
+        width = len(DETAILED_PRAYER_ORDER)
+        value = self.minutes[day_index(date_obj.month, date_obj.day) * width + DETAILED_PRAYER_ORDER.index(prayer)]
+        return None if value == MISSING_TIME else value
+
+    def times(self, date_obj):
+        """Времена на дату в виде {'Fajr': 'HH:MM', ...}; пустой dict, если дня нет"""
+        width = len(DETAILED_PRAYER_ORDER)
+        base = day_index(date_obj.month, date_obj.day) * width
+        return {p: format_minutes(self.minutes[base + col])
+                for col, p in enumerate(DETAILED_PRAYER_ORDER) if self.minutes[base + col] != MISSING_TIME}
+
+    def month_times(self, month_num):
+        """{'dd.mm': times} для всех дней месяца, которые есть в расписании"""
+        result = {}
+        for day in range(1, calendar.monthrange(2000, month_num)[1] + 1):
+            times = self.times(datetime(2000, month_num, day))
+            if times:
+                result[f"{day:02d}.{month_num:02d}"] = times
+        return result
+
+    def prayer_status(self, date_obj, minute_of_day):
+        """(текущий намаз или None, следующий намаз или None, минута следующего)"""
+        minutes, prayers = self.day_prayers[day_index(date_obj.month, date_obj.day)]
+        i = bisect_right(minutes, minute_of_day)
+        current_prayer = prayers[i - 1] if i > 0 else None
+        if i < len(prayers):
+            return current_prayer, prayers[i], minutes[i]
+        return current_prayer, None, None
+
+
+def city_display_name(city):
+    return CITY_NAMES.get(city, city.replace('_', ' ').title())
+
+def city_coordinates(city):
+    """(широта, долгота) города или None, если они неизвестны"""
+    return CALC_CITIES.get(city) or CITY_COORDINATES.get(city)
+
+class CityTimetable:
+    """Загруженное расписание одного города вместе с кэшем готовых ответов"""
+
+    def __init__(self, city, timetable, digest, mtime):
+        self.city = city
+        self.name = city_display_name(city)
+        self.timetable = timetable
+        self.digest = digest
+        self.mtime = mtime
+        self.render_cache = {}
+
+
+class TimetableRegistry:
+    """Расписания всех городов из CITIES_DIR и CALC_CITIES.
+
+    Расписание города разбирается (или рассчитывается) при первом обращении к
+    нему. Города с одинаковым содержимым CSV делят один экземпляр Timetable.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.paths = {}  # city -> путь к CSV
+        self.loaded = {}  # city -> CityTimetable
+        self._shared = {}  # sha1 содержимого CSV -> Timetable
+
+    def discover(self):
+        for city in CALC_CITIES:
+            self.paths[city] = None  # расписание рассчитывается, файла нет
+        for name in sorted(os.listdir(self.directory)):
+            match = CITY_FILE_RE.fullmatch(name)
+            if match:
+                self.paths[match.group(1)] = os.path.join(self.directory, name)
+        return len(self.paths)
+
+    def __contains__(self, city):
+        return city in self.paths
+
+    def cities(self):
+        return list(self.paths)
+
+    def read(self, city):
+        """Разбирает и проверяет CSV города; можно вызывать из пула потоков"""
+        path = self.paths[city]
+        if path is None:
+            return self.calculate(city)
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, 'rb') as file:
+            data = file.read()
+        digest = hashlib.sha1(data).hexdigest()
+        source = self._shared.get(digest) or self.load_snapshot(digest)
+        if source is None:
+            source = Timetable.parse(data.decode('utf-8').splitlines())
+            if source.days_loaded < 365:
+                raise ValueError(f"{city}: в расписании только {source.days_loaded} дней")
+            self.save_snapshot(digest, source)
+        self._shared[digest] = source
+        return CityTimetable(city, source, digest, mtime)
+
+    def calculate(self, city):
+        latitude, longitude = CALC_CITIES[city]
+        year = datetime.now(TIMEZONE).year
+        adjustments = ','.join(f"{prayer}={minutes}" for prayer, minutes in sorted(CALC_ADJUSTMENTS.items()))
+        key = hashlib.sha1(f"calc2:{latitude},{longitude}:{CALC_METHOD}:{CALC_HIGH_LATS}:{adjustments}:{year}"
+                           .encode()).hexdigest()
+        timetable = self.load_snapshot(key)
+        if timetable is None:
+            import prayer_calc
+            location = prayer_calc.Location(latitude, longitude, TIMEZONE.utcoffset(datetime(2000, 1, 1)).total_seconds() / 3600)
+            # Год города считается один раз и хранится в Timetable, кэш prayer_calc ему не нужен
+            data = prayer_calc.calculate_year([location], year, CALC_METHOD, cache=False,
+                                              adjustments=CALC_ADJUSTMENTS, high_lats=CALC_HIGH_LATS)[location]
+            if not calendar.isleap(year):
+                # Строка 29.02 нужна только в високосный год, но пусть таблица будет полной
+                leap = prayer_calc.calculate_year([location], 2024, CALC_METHOD, cache=False,
+                                                  adjustments=CALC_ADJUSTMENTS, high_lats=CALC_HIGH_LATS)[location]
+                data['29.02'] = leap['29.02']
+            timetable = Timetable.from_prayer_data(data)
+            self.save_snapshot(key, timetable)
+        return CityTimetable(city, timetable, f"calc:{city}:{year}", None)
+
+    @staticmethod
+    def load_snapshot(key):
+        if not TIMETABLE_CACHE_DIR:
+            return None
+        return Timetable.from_snapshot(os.path.join(TIMETABLE_CACHE_DIR, f"{key}.bin"))
+
+    @staticmethod
+    def save_snapshot(key, timetable):
+        if not TIMETABLE_CACHE_DIR:
+            return
+        try:
+            timetable.write_snapshot(os.path.join(TIMETABLE_CACHE_DIR, f"{key}.bin"))
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить снимок расписания: {e}")
+
+    def get(self, city):
+        entry = self.loaded.get(city)
+        if entry is None:
+            entry = self.loaded[city] = self.read(city)
+            logger.info(f"Загружено расписание {entry.name}: {entry.timetable.days_loaded} дней")
+        return entry
+
+    def swap(self, entries):
+        """Подменяет расписания городов одним присваиванием"""
+        self.loaded = {**self.loaded, **entries}
+        self._shared = {entry.digest: entry.timetable for entry in self.loaded.values()}
+
+
+registry = TimetableRegistry(CITIES_DIR)
+
 def load_prayer_data():
-    global prayer_data
     try:
-        with open(CSV_FILE, 'r', encoding='utf-8') as file:
-            csv_reader = csv.DictReader(file)
-            for row in csv_reader:
-                date_str = row['Date'].strip()
-                prayer_data[date_str] = {k: v.strip() for k, v in row.items() if k != 'Date'}
-        logger.info(f"Загружено {len(prayer_data)} записей о намазах")
+        registry.discover()
+        entry = registry.get(DEFAULT_CITY)
+        entry.render_cache = build_render_cache(entry)
+        logger.info(f"Найдено городов: {len(registry.paths)}")
         return True
     except Exception as e:
         logger.error(f"Ошибка загрузки CSV: {e}")
         return False
 
+reload_lock = asyncio.Lock()
+csv_watch_task = None
+
+async def preload_cities(cities):
+    """Загружает ещё не загруженные расписания в пуле потоков, а не в цикле событий.
+
+    Расчёт города из CALC_CITIES занимает заметное время, поэтому планировщик
+    вызывает это перед notification_plan(), который берёт расписания всех городов.
+    """
+    loop = asyncio.get_running_loop()
+    entries = {}
+    for city in cities:
+        if city not in registry.loaded:
+            entries[city] = await loop.run_in_executor(None, registry.read, city)
+            logger.info(f"Загружено расписание {entries[city].name}: {entries[city].timetable.days_loaded} дней")
+    if entries:
+        registry.swap(entries)
+
+async def reload_prayer_data(cities=None):
+    """Перечитывает CSV городов (по умолчанию всех загруженных) без перезапуска бота.
+
+    Разбор идёт в пуле потоков; новые расписания подменяются одним
+    присваиванием без await, поэтому обработчики видят либо старую, либо
+    новую версию целиком. Затем перепланируются ещё не сработавшие уведомления.
+    """
+    async with reload_lock:
+        loop = asyncio.get_running_loop()
+        cities = list(registry.loaded) if cities is None else cities
+        entries = {}
+        for city in cities:
+            entries[city] = await loop.run_in_executor(None, registry.read, city)
+        registry.swap(entries)
+        changed = await plan_notifications() if SCHEDULER_ENABLED else 0
+        logger.info(f"Расписание перезагружено: городов {len(entries)}, перепланировано заданий: {changed}")
+        return changed
+
+async def watch_csv_file():
+    while True:
+        await asyncio.sleep(CSV_WATCH_INTERVAL)
+        try:
+            changed = [city for city, entry in registry.loaded.items()
+                       if entry.mtime is not None and os.stat(registry.paths[city]).st_mtime_ns != entry.mtime]
+            if changed:
+                await reload_prayer_data(changed)
+        except Exception as e:
+            logger.error(f"Ошибка перезагрузки CSV: {e}")
+
 # ==================== КЛАВИАТУРЫ И ИНТЕРФЕЙС ====================
+# Статические клавиатуры собираются один раз и переиспользуются
+@functools.cache
 def get_main_menu_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="🕐 Сегодня"), KeyboardButton(text="⏩ Завтра"), KeyboardButton(text="🗓️ Месяц")],
             [KeyboardButton(text="🔔 Уведомления"), KeyboardButton(text="🔕 Выкл уведомления")],
-            [KeyboardButton(text="ℹ️ Информация"), KeyboardButton(text="🔄 Обновить")],
+            [KeyboardButton(text="ℹ️ Информация"), KeyboardButton(text="🏙️ Город"), KeyboardButton(text="🔄 Обновить")],
         ],
         resize_keyboard=True,
         input_field_placeholder="Выберите действие"
     )
     return keyboard
 
+@functools.cache
 def get_months_keyboard():
     keyboard = InlineKeyboardMarkup(inline_keyboard=[])
     months_row = []
@@ -162,29 +1107,44 @@ def get_months_keyboard():
     keyboard.inline_keyboard.append([InlineKeyboardButton(text="⬅️ Назад в меню", callback_data="back_to_menu")])
     return keyboard
 
+@functools.cache
+def get_cities_keyboard():
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[])
+    cities_row = []
+    for city in registry.cities():
+        cities_row.append(InlineKeyboardButton(text=city_display_name(city), callback_data=f"city_{city}"))
+        if len(cities_row) == 2:
+            keyboard.inline_keyboard.append(cities_row)
+            cities_row = []
+    if cities_row:
+        keyboard.inline_keyboard.append(cities_row)
+    keyboard.inline_keyboard.append([InlineKeyboardButton(text="⬅️ Назад в меню", callback_data="back_to_menu")])
+    return keyboard
+
 def get_prayer_selection_keyboard(user_id):
-    selected = subscriptions.get(user_id, set())
+    selected = subscriptions.get(user_id, 0)
     keyboard = InlineKeyboardMarkup(inline_keyboard=[])
     for prayer in TIME_PRAYER_ORDER:
-        text = f"{PRAYER_NAMES[prayer]} {'✅' if prayer in selected else '❌'}"
+        text = f"{PRAYER_NAMES[prayer]} {'✅' if selected & PRAYER_BITS[prayer] else '❌'}"
         keyboard.inline_keyboard.append([InlineKeyboardButton(text=text, callback_data=f"toggle_{prayer}")])
     keyboard.inline_keyboard.append([InlineKeyboardButton(text="Сохранить", callback_data="save_prayers")])
     return keyboard
 
 # ==================== УТИЛИТЫ ДЛЯ ФОРМАТИРОВАНИЯ ====================
-def get_prayer_times(date_obj=None):
+def get_prayer_times(city, date_obj=None):
     if date_obj is None:
         date_obj = datetime.now(TIMEZONE)
-    date_str = date_obj.strftime("%d.%m")
-    return prayer_data.get(date_str, {})
+    return registry.get(city).timetable.times(date_obj)
 
-def format_prayer_times(times, date_obj=None):
+def format_prayer_times(times, date_obj=None, city_name=None):
     if not times:
         return "📭 Данные для этой даты не найдены"
     if date_obj is None:
         date_obj = datetime.now(TIMEZONE)
+    if city_name is None:
+        city_name = city_display_name(DEFAULT_CITY)
     month_name_ru = MONTHS_RU.get(date_obj.month, date_obj.strftime("%B"))
-    text = f"📅 {date_obj.day:02d} {month_name_ru}\n📍 Черкесск (КЧР)\n\n"
+    text = f"📅 {date_obj.day:02d} {month_name_ru}\n📍 {city_name}\n\n"
     text += f"🌄 Фаджр:         {times.get('Fajr', '--:--')}\n"
     text += f"Восход:          {times.get('Sunrise', '--:--')}\n"
     text += f"☀️ Зухр:          {times.get('Duhr', '--:--')}\n"
@@ -211,86 +1171,685 @@ def format_month_table(times_dict, month_num):
         lines.append(row)
     return "\n".join(lines)
 
-def get_current_prayer_status(times):
-    now = datetime.now(TIMEZONE).time()
-    current_prayer = "Ночь"
-    next_prayer = TIME_PRAYER_ORDER[0]
-    time_to_next = None
-    for i, prayer in enumerate(TIME_PRAYER_ORDER):
-        prayer_time_str = times.get(prayer)
-        if not prayer_time_str:
-            continue
-        prayer_time = datetime.strptime(prayer_time_str, "%H:%M").time()
-        if now < prayer_time:
-            next_prayer = prayer
-            time_to_next = datetime.combine(datetime.today(), prayer_time) - datetime.combine(datetime.today(), now)
-            break
-        current_prayer = prayer
-    if time_to_next:
-        hours, remainder = divmod(time_to_next.seconds, 3600)
+# ==================== КЭШ ГОТОВЫХ ОТВЕТОВ ====================
+# Расписание статично, поэтому тексты дней и месяцев рендерятся один раз.
+# Кэш свой у каждого города (CityTimetable.render_cache) и уходит вместе с ним
+# при перезагрузке. Ключи: ('day', day_index) и ('month', month_num); None — данных нет.
+def build_render_cache(entry):
+    cache = {}
+    for month_num in range(1, 13):
+        month_data = entry.timetable.month_times(month_num)
+        cache[('month', month_num)] = format_month_table(month_data, month_num) if month_data else None
+        for day in range(1, calendar.monthrange(2000, month_num)[1] + 1):
+            date_obj = datetime(2000, month_num, day)
+            times = entry.timetable.times(date_obj)
+            cache[('day', day_index(month_num, day))] = format_prayer_times(times, date_obj, entry.name) if times else None
+    return cache
+
+def render_day(city, date_obj):
+    entry = registry.get(city)
+    key = ('day', day_index(date_obj.month, date_obj.day))
+    if key not in entry.render_cache:
+        times = entry.timetable.times(date_obj)
+        entry.render_cache[key] = format_prayer_times(times, date_obj, entry.name) if times else None
+    return entry.render_cache[key]
+
+def render_month(city, month_num):
+    if month_num not in MONTHS_RU:
+        return None
+    entry = registry.get(city)
+    key = ('month', month_num)
+    if key not in entry.render_cache:
+        month_data = entry.timetable.month_times(month_num)
+        entry.render_cache[key] = format_month_table(month_data, month_num) if month_data else None
+    return entry.render_cache[key]
+
+def get_current_prayer_status(city, now=None):
+    if now is None:
+        now = datetime.now(TIMEZONE)
+    seconds_now = now.hour * 3600 + now.minute * 60 + now.second
+    current_prayer, next_prayer, next_minute = registry.get(city).timetable.prayer_status(now, seconds_now // 60)
+    current_name = PRAYER_NAMES[current_prayer] if current_prayer else "Ночь"
+    if next_prayer:
+        hours, remainder = divmod(next_minute * 60 - seconds_now, 3600)
         minutes = remainder // 60
-        status = f"🕌 *Текущий намаз:* {PRAYER_NAMES[current_prayer]}\n⏳ *До следующего ({PRAYER_NAMES[next_prayer]}):* {hours} ч. {minutes} мин."
+        status = f"🕌 *Текущий намаз:* {current_name}\n⏳ *До следующего ({PRAYER_NAMES[next_prayer]}):* {hours} ч. {minutes} мин."
     else:
-        status = f"🕌 *Текущий намаз:* {PRAYER_NAMES[current_prayer]}\n🌙 Следующий день"
+        status = f"🕌 *Текущий намаз:* {current_name}\n🌙 Следующий день"
     return status
 
+# ==================== РАССЫЛКА ====================
+class TokenBucket:
+    """Глобальный ограничитель скорости отправки (token bucket)"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Ожидающие выстраиваются в очередь на замке, поэтому токены раздаются по порядку
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BroadcastStats:
+    """Итоги одной рассылки: счётчики, пропускная способность и задержки доставки"""
+
+    def __init__(self, total):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.blocked = 0
+        self.delays = []  # секунды от начала рассылки до доставки каждому пользователю
+        self.started = time.monotonic()
+        self.finished = self.started
+
+    def percentile(self, p):
+        if not self.delays:
+            return 0.0
+        ordered = sorted(self.delays)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def summary(self):
+        elapsed = self.finished - self.started
+        rate = self.sent / elapsed if elapsed > 0 else 0.0
+        return (f"отправлено {self.sent}/{self.total}, ошибок {self.failed}, заблокировали {self.blocked}, "
+                f"повторов {self.retried}; {elapsed:.1f} с, {rate:.1f} сообщ./с, "
+                f"p50 {self.percentile(50):.1f} с, p95 {self.percentile(95):.1f} с, "
+                f"последняя доставка {max(self.delays, default=0.0):.1f} с")
+
+
+def share_limiter(share):
+    """Лимитер на долю share глобального лимита; доли процессов в сумме не превышают BROADCAST_RATE"""
+    return TokenBucket(BROADCAST_RATE * share, max(1, int(BROADCAST_BURST * share)))
+
+# Общий лимитер для всех рассылок (основное уведомление и напоминание могут идти одновременно).
+# При BROADCAST_WORKERS > 0 заменяется долей: см. start_broadcast_workers() и run_broadcast_worker()
+broadcast_limiter = TokenBucket(BROADCAST_RATE, BROADCAST_BURST)
+
+# Когда в чат снова можно писать (time.monotonic()): после отправки — через CHAT_MIN_INTERVAL,
+# после RetryAfter — через указанное Telegram время. Порядок вставки совпадает с порядком
+# отправок, поэтому истёкшие записи вычищаются с начала словаря
+chat_not_before = {}
+
+def chat_wait(user_id):
+    """Секунд до того, как в чат user_id можно будет отправить следующее сообщение"""
+    return max(0.0, chat_not_before.get(user_id, 0.0) - time.monotonic())
+
+def hold_chat(user_id, seconds):
+    now = time.monotonic()
+    while chat_not_before:
+        oldest = next(iter(chat_not_before))
+        if chat_not_before[oldest] > now:
+            break
+        del chat_not_before[oldest]
+    not_before = max(chat_not_before.pop(user_id, 0.0), now + seconds)
+    chat_not_before[user_id] = not_before
+
+# Исходы доставки одного сообщения
+OUTCOME_OK = 'ok'
+OUTCOME_BLOCKED = 'blocked'  # бот заблокирован или чат не найден
+OUTCOME_RATE_LIMITED = 'rate_limited'  # RetryAfter сверх BROADCAST_MAX_RETRIES
+OUTCOME_TRANSIENT = 'transient'  # сеть, 5xx и прочие временные ошибки
+OUTCOME_FAILED = 'failed'  # постоянная ошибка запроса, повтор не поможет
+
+DeliveryEvent = namedtuple('DeliveryEvent', ['user_id', 'outcome', 'text', 'kwargs', 'attempt', 'retry_after'])
+
+async def deliver(user_id, text, kwargs):
+    """Отправляет одно сообщение и возвращает (исход, retry_after)"""
+    try:
+        await bot.send_message(user_id, text, **kwargs)
+        return OUTCOME_OK, 0
+    except TelegramRetryAfter as e:
+        return OUTCOME_RATE_LIMITED, e.retry_after
+    except TelegramForbiddenError:
+        return OUTCOME_BLOCKED, 0
+    except TelegramBadRequest as e:
+        if "chat not found" in e.message.lower():
+            return OUTCOME_BLOCKED, 0
+        logger.error(f"Не удалось отправить пользователю {user_id}: {e}")
+        return OUTCOME_FAILED, 0
+    except Exception as e:
+        logger.warning(f"Временная ошибка отправки пользователю {user_id}: {e}")
+        return OUTCOME_TRANSIENT, 0
+
+async def broadcast(user_ids, text, **kwargs):
+    """Рассылает text пользователям пулом из BROADCAST_CONCURRENCY отправителей.
+
+    Скорость ограничивается глобальным broadcast_limiter, а в один чат пишется
+    не чаще раза в CHAT_MIN_INTERVAL (уведомление и напоминание одной минуты
+    идут в одни и те же чаты). Чат, в который писать пока нельзя, и чат с
+    RetryAfter откладываются на нужное время и возвращаются в очередь, не занимая
+    отправителя и токен лимита; остальные отправители продолжают работу. Итог каждой доставки уходит событием в
+    delivery_events; отписка и повторы выполняются в фоне, без БД в этом цикле.
+    """
+    stats = BroadcastStats(len(user_ids))
+    if not user_ids:
+        return stats
+    queue = asyncio.Queue()
+    for user_id in user_ids:
+        queue.put_nowait((user_id, 0))
+    remaining = len(user_ids)
+    done = asyncio.Event()
+    retry_tasks = set()
+
+    async def requeue_later(user_id, attempt, delay):
+        await asyncio.sleep(delay)
+        queue.put_nowait((user_id, attempt))
+
+    async def worker():
+        nonlocal remaining
+        while True:
+            user_id, attempt = await queue.get()
+            wait = chat_wait(user_id)
+            if wait > 0:
+                task = asyncio.create_task(requeue_later(user_id, attempt, wait))
+                retry_tasks.add(task)
+                task.add_done_callback(retry_tasks.discard)
+                continue
+            await broadcast_limiter.acquire()
+            hold_chat(user_id, CHAT_MIN_INTERVAL)
+            outcome, retry_after = await deliver(user_id, text, kwargs)
+            if outcome == OUTCOME_RATE_LIMITED:
+                hold_chat(user_id, retry_after)
+                if attempt < BROADCAST_MAX_RETRIES:
+                    stats.retried += 1
+                    task = asyncio.create_task(requeue_later(user_id, attempt + 1, retry_after))
+                    retry_tasks.add(task)
+                    task.add_done_callback(retry_tasks.discard)
+                    continue
+            if outcome == OUTCOME_OK:
+                stats.sent += 1
+                stats.delays.append(time.monotonic() - stats.started)
+            elif outcome == OUTCOME_BLOCKED:
+                stats.blocked += 1
+            else:
+                stats.failed += 1
+            delivery_events.put_nowait(DeliveryEvent(user_id, outcome, text, kwargs, 0, retry_after))
+            remaining -= 1
+            if remaining == 0:
+                done.set()
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(BROADCAST_CONCURRENCY, len(user_ids)))]
+    try:
+        await done.wait()
+    finally:
+        for task in workers + list(retry_tasks):
+            task.cancel()
+        stats.finished = time.monotonic()
+    return stats
+
+# ==================== ИСХОДЫ ДОСТАВКИ ====================
+# Фоновый обработчик событий доставки: сбрасывает счётчик неудач при успехе,
+# повторяет временные ошибки с экспоненциальной задержкой и отписывает чаты,
+# которые DELIVERY_PRUNE_AFTER раз подряд оказались заблокированы.
+delivery_events = asyncio.Queue()
+delivery_failures = {}  # user_id -> подряд неудач с исходом OUTCOME_BLOCKED
+delivery_retry_tasks = set()
+delivery_task = None
+
+async def retry_delivery(event, delay):
+    await asyncio.sleep(delay)
+    if event.user_id not in subscriptions:
+        return  # успел отписаться
+    await asyncio.sleep(chat_wait(event.user_id))
+    await broadcast_limiter.acquire()
+    hold_chat(event.user_id, CHAT_MIN_INTERVAL)
+    outcome, retry_after = await deliver(event.user_id, event.text, event.kwargs)
+    if outcome == OUTCOME_RATE_LIMITED:
+        hold_chat(event.user_id, retry_after)
+    delivery_events.put_nowait(event._replace(outcome=outcome, attempt=event.attempt + 1, retry_after=retry_after))
+
+def handle_delivery_events(events):
+    pruned = []
+    for event in events:
+        user_id = event.user_id
+        deliveries_total.inc((event.outcome,))
+        if event.outcome == OUTCOME_OK:
+            delivery_failures.pop(user_id, None)
+        elif event.outcome in (OUTCOME_TRANSIENT, OUTCOME_RATE_LIMITED):
+            if event.attempt < DELIVERY_MAX_RETRIES:
+                delay = max(event.retry_after, DELIVERY_RETRY_BASE * 2 ** event.attempt)
+                task = asyncio.create_task(retry_delivery(event, delay))
+                delivery_retry_tasks.add(task)
+                task.add_done_callback(delivery_retry_tasks.discard)
+            else:
+                logger.error(f"Пользователь {user_id}: сообщение не доставлено после {event.attempt} повторов")
+        elif event.outcome == OUTCOME_BLOCKED:
+            delivery_failures[user_id] = delivery_failures.get(user_id, 0) + 1
+            if delivery_failures[user_id] >= DELIVERY_PRUNE_AFTER:
+                del delivery_failures[user_id]
+                pruned.append(user_id)
+    for user_id in pruned:
+        remove_user(user_id)
+        save_user(user_id)  # все отписки пачки уйдут в БД одной транзакцией
+    if pruned:
+        logger.info(f"Отписано недоступных чатов: {len(pruned)}")
+
+async def process_delivery_events():
+    while True:
+        events = [await delivery_events.get()]
+        while not delivery_events.empty() and len(events) < DELIVERY_BATCH:
+            events.append(delivery_events.get_nowait())
+        try:
+            handle_delivery_events(events)
+        except Exception as e:
+            logger.error(f"Ошибка обработки событий доставки: {e}")
+
+def stop_delivery_processing():
+    if delivery_task is not None:
+        delivery_task.cancel()
+    for task in list(delivery_retry_tasks):
+        task.cancel()
+    # Отписки из оставшихся событий ещё успеют попасть в финальный сброс БД
+    events = []
+    while not delivery_events.empty():
+        events.append(delivery_events.get_nowait())
+    handle_delivery_events([e for e in events if e.outcome in (OUTCOME_OK, OUTCOME_BLOCKED)])
+
+# ==================== ВОРКЕРЫ РАССЫЛКИ ====================
+# При BROADCAST_WORKERS > 0 основной процесс сам не рассылает: получатели делятся
+# на шарды по user_id % BROADCAST_WORKERS, шарды кладутся в очередь SQLite, а
+# дочерние процессы (main.py --broadcast-worker N) отправляют свою часть с долей
+# глобального лимита скорости и записывают итоги. Исходы доставки возвращаются
+# в delivery_events основного процесса, поэтому отписка работает как раньше.
+# Основной процесс оставляет себе BROADCAST_RETRY_SHARE лимита на фоновые
+# повторы, воркеры делят остальное поровну.
+queue_conn = None
+worker_tasks = []
+worker_processes = {}  # номер воркера -> asyncio.subprocess.Process
+workers_stopping = False
+
+def open_broadcast_queue(reset=False):
+    global queue_conn
+    queue_conn = sqlite3.connect(BROADCAST_QUEUE_DB, check_same_thread=False, timeout=30)
+    queue_conn.execute('PRAGMA journal_mode=WAL')
+    queue_conn.execute('PRAGMA synchronous=NORMAL')
+    queue_conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_shards (
+            shard_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            worker INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            kwargs TEXT NOT NULL,  -- JSON: параметры send_message, reply_markup в виде словаря
+            user_ids TEXT NOT NULL,  -- JSON: [user_id, ...]
+            status TEXT NOT NULL DEFAULT 'pending',  -- pending / running / done / abandoned
+            result TEXT  -- JSON: счётчики, задержки и исходы доставки
+        )
+    ''')
+    if reset:
+        # Шарды прошлого запуска не досылаем: как и задания, лучше недослать, чем задвоить
+        queue_conn.execute('DELETE FROM broadcast_shards')
+    queue_conn.commit()
+
+def close_broadcast_queue():
+    global queue_conn
+    if queue_conn is not None:
+        queue_conn.close()
+        queue_conn = None
+
+def encode_send_kwargs(kwargs):
+    markup = kwargs.get('reply_markup')
+    return json.dumps({**kwargs, 'reply_markup': markup.model_dump(exclude_none=True) if markup else None})
+
+def decode_send_kwargs(data):
+    kwargs = json.loads(data)
+    if kwargs.get('reply_markup'):
+        kwargs['reply_markup'] = InlineKeyboardMarkup.model_validate(kwargs['reply_markup'])
+    return kwargs
+
+def enqueue_shards(text, kwargs, shards):
+    encoded = encode_send_kwargs(kwargs)
+    with queue_conn:
+        return [queue_conn.execute('INSERT INTO broadcast_shards (worker, text, kwargs, user_ids) VALUES (?, ?, ?, ?)',
+                                   (worker, text, encoded, json.dumps(user_ids))).lastrowid
+                for worker, user_ids in shards.items()]
+
+def collect_shards(shard_ids):
+    """Итоги завершённых шардов; завершённые строки удаляются из очереди"""
+    placeholders = ','.join('?' * len(shard_ids))
+    with queue_conn:
+        rows = queue_conn.execute(f'SELECT shard_id, status, result FROM broadcast_shards WHERE shard_id IN ({placeholders}) '
+                                  f"AND status IN ('done', 'abandoned')", shard_ids).fetchall()
+        queue_conn.executemany('DELETE FROM broadcast_shards WHERE shard_id = ?', [(row[0],) for row in rows])
+    return rows
+
+def claim_shard(worker):
+    with queue_conn:
+        row = queue_conn.execute("SELECT shard_id, text, kwargs, user_ids FROM broadcast_shards "
+                                 "WHERE worker = ? AND status = 'pending' ORDER BY shard_id LIMIT 1", (worker,)).fetchone()
+        if row:
+            queue_conn.execute("UPDATE broadcast_shards SET status = 'running' WHERE shard_id = ?", (row[0],))
+    return row
+
+def finish_shard(shard_id, result):
+    with queue_conn:
+        queue_conn.execute("UPDATE broadcast_shards SET status = 'done', result = ? WHERE shard_id = ?",
+                           (json.dumps(result), shard_id))
+
+def worker_backlog():
+    """{воркер: получателей в его незавершённых шардах}; начатый шард считается целиком"""
+    return dict(queue_conn.execute("SELECT worker, SUM(json_array_length(user_ids)) FROM broadcast_shards "
+                                   "WHERE status IN ('pending', 'running') GROUP BY worker"))
+
+def worker_share():
+    """Доля глобального лимита одного воркера: остаток после BROADCAST_RETRY_SHARE поровну"""
+    return (1 - BROADCAST_RETRY_SHARE) / max(BROADCAST_WORKERS, 1)
+
+def shard_timeout(queued):
+    """Секунд на рассылку, если у самого загруженного из её воркеров queued получателей в очереди"""
+    return queued / (BROADCAST_RATE * worker_share()) * BROADCAST_SHARD_SLACK + CHAT_MIN_INTERVAL + BROADCAST_SHARD_GRACE
+
+def expire_shards(shard_ids):
+    """Бросает шарды рассылки, не завершившиеся к сроку; начатый воркер может дослать свой, но итог уже не учтётся"""
+    placeholders = ','.join('?' * len(shard_ids))
+    with queue_conn:
+        return queue_conn.execute(f"UPDATE broadcast_shards SET status = 'abandoned' WHERE shard_id IN ({placeholders}) "
+                                  f"AND status IN ('pending', 'running')", shard_ids).rowcount
+
+def abandon_shards(worker):
+    """Шарды упавшего воркера: начатые не повторяем, ещё не начатые остаются ему после перезапуска"""
+    with queue_conn:
+        return queue_conn.execute("UPDATE broadcast_shards SET status = 'abandoned' WHERE worker = ? AND status = 'running'",
+                                  (worker,)).rowcount
+
+async def broadcast_sharded(user_ids, text, **kwargs):
+    """Как broadcast(), но отправку выполняют процессы-воркеры"""
+    stats = BroadcastStats(len(user_ids))
+    if not user_ids:
+        return stats
+    shards = {}
+    for user_id in user_ids:
+        shards.setdefault(user_id % BROADCAST_WORKERS, []).append(user_id)
+    pending = await run_db(enqueue_shards, text, kwargs, shards)
+    # Воркер может зависнуть, не упав: супервизор этого не заметит, поэтому у рассылки есть срок.
+    # Воркер отправляет свои шарды по очереди, так что считается и то, что стоит в его очереди перед нашим
+    backlog = await run_db(worker_backlog)
+    deadline = stats.started + shard_timeout(max(backlog.get(worker, 0) for worker in shards))
+    overdue = False
+    while pending:
+        await asyncio.sleep(BROADCAST_POLL_INTERVAL)
+        if not overdue and time.monotonic() > deadline:
+            overdue = True
+            expired = await run_db(expire_shards, pending)
+            logger.error(f"Рассылка не завершилась к сроку, брошено шардов: {expired}")
+        for shard_id, status, result in await run_db(collect_shards, pending):
+            pending.remove(shard_id)
+            if status == 'abandoned':
+                if not overdue:
+                    logger.error(f"Шард {shard_id} рассылки не завершён: воркер остановился")
+                continue
+            result = json.loads(result)
+            stats.sent += result['sent']
+            stats.failed += result['failed']
+            stats.blocked += result['blocked']
+            stats.retried += result['retried']
+            # Задержки воркера отсчитаны от начала его шарда; сдвигаем к началу всей рассылки
+            shift = result['started'] - (time.time() - (time.monotonic() - stats.started))
+            stats.delays.extend(delay + shift for delay in result['delays'])
+            for outcome, users in result['outcomes'].items():
+                for user_id in users:
+                    delivery_events.put_nowait(DeliveryEvent(user_id, outcome, text, kwargs, 0, 0))
+    stats.finished = time.monotonic()
+    return stats
+
+async def supervise_worker(index):
+    """Держит воркер запущенным; после падения помечает его начатый шард и перезапускает"""
+    while not workers_stopping:
+        process = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__),
+                                                       '--broadcast-worker', str(index))
+        worker_processes[index] = process
+        code = await process.wait()
+        if workers_stopping:
+            return
+        abandoned = await run_db(abandon_shards, index)
+        logger.error(f"Воркер рассылки {index} завершился с кодом {code}, брошено шардов: {abandoned}; перезапуск")
+        await asyncio.sleep(1)
+
+def start_broadcast_workers():
+    global broadcast_limiter
+    broadcast_limiter = share_limiter(BROADCAST_RETRY_SHARE)  # остальное расходуют воркеры
+    open_broadcast_queue(reset=True)
+    worker_tasks.extend(asyncio.create_task(supervise_worker(i)) for i in range(BROADCAST_WORKERS))
+    logger.info(f"Запущено воркеров рассылки: {BROADCAST_WORKERS}")
+
+async def stop_broadcast_workers():
+    global workers_stopping
+    workers_stopping = True
+    for process in worker_processes.values():
+        if process.returncode is None:
+            process.terminate()
+    for process in worker_processes.values():
+        await process.wait()
+    for task in worker_tasks:
+        task.cancel()
+
+async def run_broadcast_worker(index):
+    """Точка входа процесса-воркера: забирает свои шарды из очереди и рассылает их"""
+    global broadcast_limiter
+    broadcast_limiter = share_limiter(worker_share())
+    open_broadcast_queue()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    logger.info(f"Воркер рассылки {index} запущен")
+    try:
+        while not stop.is_set():
+            shard = await run_db(claim_shard, index)
+            if shard is None:
+                try:
+                    await asyncio.wait_for(stop.wait(), BROADCAST_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            shard_id, text, kwargs, user_ids = shard
+            started = time.time()
+            sending = asyncio.create_task(broadcast(json.loads(user_ids), text, **decode_send_kwargs(kwargs)))
+            await asyncio.wait([sending, asyncio.create_task(stop.wait())], return_when=asyncio.FIRST_COMPLETED)
+            if not sending.done():
+                sending.cancel()
+                break  # начатый шард основной процесс пометит брошенным
+            stats = sending.result()
+            outcomes = {}
+            while not delivery_events.empty():
+                event = delivery_events.get_nowait()
+                outcomes.setdefault(event.outcome, []).append(event.user_id)
+            await run_db(finish_shard, shard_id, {
+                'sent': stats.sent, 'failed': stats.failed, 'blocked': stats.blocked, 'retried': stats.retried,
+                'started': started, 'delays': [round(delay, 3) for delay in stats.delays], 'outcomes': outcomes,
+            })
+    finally:
+        await bot.session.close()
+        db_executor.shutdown(wait=True)
+        close_broadcast_queue()
+
 # ==================== УВЕДОМЛЕНИЯ ====================
-async def send_prayer_notification(prayer_name: str, prayer_time: str, times: dict, is_reminder=False):
-    if not subscriptions:
-        logger.info(f"Нет подписчиков для уведомления о {prayer_name}")
+async def send_prayer_notification(city: str, prayer: str, prayer_time: str, is_reminder=False):
+    prayer_name = PRAYER_NAMES[prayer]
+    recipients = list(city_subscribers(city)[prayer])
+    if not recipients:
         return
     prefix = "Напоминание: " if is_reminder else ""
-    message = f"🕌 {prefix}Время намаза: *{prayer_name}*\n⏰ {prayer_time}\n📍 Черкесск (КЧР)\nАссаламу алейкум! Пора на намаз 🌙"
+    hour, minute = map(int, prayer_time.split(':'))
+    message = f"🕌 {prefix}Время намаза: *{prayer_name}*\n⏰ {format_minutes(hour * 60 + minute)}\n📍 {city_display_name(city)}\nАссаламу алейкум! Пора на намаз 🌙"
     keyboard = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Отметить прочитанным", callback_data="read_notification")]])
-    success, failed = 0, 0
-    for user_id, user_prayers in list(subscriptions.items()):
-        if PRAYER_NAMES.inverse.get(prayer_name, prayer_name) not in user_prayers:  # Проверка на выбранные намазы
-            continue
-        try:
-            await bot.send_message(user_id, message, parse_mode="Markdown", reply_markup=keyboard if not is_reminder else None)
-            success += 1
-            await asyncio.sleep(0.04)  # Лимит: ~25 сообщений/сек
-        except Exception as e:
-            logger.error(f"Не удалось отправить {prayer_name} пользователю {user_id}: {e}")
-            failed += 1
-            if "blocked" in str(e).lower() or "chat not found" in str(e).lower():
-                del subscriptions[user_id]
-                save_subscriptions()
-    logger.info(f"Уведомление {prayer_name} ({'reminder' if is_reminder else 'main'}): отправлено {success}, ошибок {failed}")
-
-def schedule_prayer_notifications():
-    scheduler.remove_all_jobs()
-    today = datetime.now(TIMEZONE)
-    today_str = today.strftime("%d.%m")
-    times = prayer_data.get(today_str, {})
-    if not times:
+    send = broadcast_sharded if BROADCAST_WORKERS > 0 else broadcast
+    stats = await send(recipients, message, parse_mode="Markdown", reply_markup=keyboard if not is_reminder else None)
+    kind = 'reminder' if is_reminder else 'main'
+    broadcast_seconds.observe((prayer, kind), stats.finished - stats.started)
+    broadcast_last_delivery_seconds.observe((prayer, kind), max(stats.delays, default=0.0))
+    logger.info(f"Уведомление {prayer_name}, {city} ({kind}): {stats.summary()}")
+
+async def send_notifications(targets, is_reminder=False):
+    """Задание одной минуты: параллельно рассылает все (город, намаз), выпавшие на неё"""
+    await subscriptions_loaded.wait()
+    await asyncio.gather(*(send_prayer_notification(city, prayer, prayer_time, is_reminder)
+                           for city, prayer, prayer_time in targets))
+
+def notification_plan(now, days=NOTIFY_DAYS_AHEAD):
+    """{job_id: (время срабатывания, is_reminder, targets)} на days дней начиная с сегодня.
+
+    Задания одноразовые, job_id включает дату и минуту срабатывания, поэтому
+    одно и то же уведомление всегда получает один и тот же id. Одинаковые
+    минуты разных городов сливаются в одно задание, targets — кортеж
+    (город, намаз, 'HH:MM') для всех совпавших городов. Намаз после полуночи
+    срабатывает на следующие сутки, но в цели остаётся временем своего дня (24:14).
+    """
+    plan = {}
+    for offset in range(days):
+        day = now.date() + timedelta(days=offset)
+        midnight = TIMEZONE.localize(datetime.combine(day, dt_time()))
+        for city in registry.cities():
+            source = registry.get(city).timetable
+            for prayer in TIME_PRAYER_ORDER:
+                prayer_minute = source.minute_of(day, prayer)
+                if prayer_minute is None:
+                    continue
+                prayer_dt = midnight + timedelta(minutes=prayer_minute)
+                target = (city, prayer, f"{prayer_minute // 60:02d}:{prayer_minute % 60:02d}")
+                # Основное уведомление и напоминание (может прийтись на предыдущий день)
+                for is_reminder, fire_dt in ((False, prayer_dt), (True, prayer_dt - REMINDER_LEAD)):
+                    job_id = f"{'reminder' if is_reminder else 'prayer'}_{fire_dt:%Y-%m-%d_%H:%M}"
+                    plan.setdefault(job_id, (fire_dt, is_reminder, []))[2].append(target)
+    return {job_id: (fire_dt, is_reminder, tuple(targets)) for job_id, (fire_dt, is_reminder, targets) in plan.items()}
+
+# Состояние планировщика: ещё не сработавшие задания и уже отправленные цели.
+# Повторы отсекаются по цели, а не по job_id: после правки CSV тот же намаз
+# может переехать на другую минуту и получить другой id.
+planned_jobs = {}  # job_id -> (fire_dt, is_reminder, targets)
+fired_targets = set()  # (дата намаза 'YYYY-MM-DD', город, намаз, is_reminder)
+
+def should_run(fire_dt, is_reminder, now):
+    """Правила догоняния для опоздавших заданий"""
+    if now - fire_dt > timedelta(seconds=NOTIFY_MISFIRE_GRACE):
+        return False
+    if is_reminder and now >= fire_dt + REMINDER_LEAD:
+        return False  # намаз уже наступил — напоминание бессмысленно
+    return True
+
+def target_key(fire_dt, is_reminder, target):
+    """Ключ цели в fired_targets: дата — день расписания самого намаза.
+
+    У напоминания перед полуночью это следующий день, у намаза после полуночи
+    (24:14) — предыдущий: иначе Иша 08.05 в 00:14 совпала бы с Ишой 09.05.
+    """
+    city, prayer, prayer_time = target
+    prayer_dt = fire_dt + REMINDER_LEAD if is_reminder else fire_dt
+    day = prayer_dt.date() - timedelta(days=1) if prayer_time >= '24:00' else prayer_dt.date()
+    return day.isoformat(), city, prayer, is_reminder
+
+def unfired_targets(fire_dt, is_reminder, targets):
+    return tuple(t for t in targets if target_key(fire_dt, is_reminder, t) not in fired_targets)
+
+def mark_targets_fired(fire_dt, is_reminder, targets):
+    fired_targets.update(target_key(fire_dt, is_reminder, t) for t in targets)
+
+def add_notification_job(job_id, fire_dt, is_reminder, targets):
+    from apscheduler.triggers.date import DateTrigger
+    scheduler.add_job(run_notification_job, DateTrigger(run_date=fire_dt, timezone=TIMEZONE),
+                      args=[job_id, fire_dt, is_reminder, targets], id=job_id, replace_existing=True,
+                      misfire_grace_time=NOTIFY_MISFIRE_GRACE)
+
+async def run_notification_job(job_id, fire_dt, is_reminder, targets, now=None):
+    now = now or datetime.now(TIMEZONE)
+    planned_jobs.pop(job_id, None)
+    targets = unfired_targets(fire_dt, is_reminder, targets)
+    mark_targets_fired(fire_dt, is_reminder, targets)
+    # Отмечаем до отправки: после падения посреди рассылки лучше недослать, чем задвоить
+    await run_db(mark_notification_jobs_done, [job_id])
+    scheduler_lag_seconds.observe(('reminder' if is_reminder else 'main',), max(0.0, (now - fire_dt).total_seconds()))
+    if not should_run(fire_dt, is_reminder, now):
+        logger.warning(f"Задание {job_id} пропущено: опоздание {now - fire_dt}")
         return
-    prayers = [(PRAYER_NAMES[p], times[p]) for p in TIME_PRAYER_ORDER if times.get(p)]
-    for prayer_name, prayer_time_str in prayers:
-        try:
-            hour, minute = map(int, prayer_time_str.split(':'))
-            prayer_dt = today.replace(hour=hour, minute=minute, second=0, microsecond=0)
-            # Основное уведомление
-            scheduler.add_job(send_prayer_notification, CronTrigger(hour=hour, minute=minute, timezone=TIMEZONE),
-                              args=[prayer_name, prayer_time_str, times, False], id=f"{prayer_name}_{today_str}")
-            # Напоминание за 10 мин
-            reminder_dt = prayer_dt - timedelta(minutes=10)
-            scheduler.add_job(send_prayer_notification, CronTrigger(hour=reminder_dt.hour, minute=reminder_dt.minute, timezone=TIMEZONE),
-                              args=[prayer_name, prayer_time_str, times, True], id=f"reminder_{prayer_name}_{today_str}")
-            logger.info(f"Запланировано уведомление для {prayer_name} на {prayer_time_str} (и напоминание за 10 мин)")
-        except Exception as e:
-            logger.error(f"Ошибка планирования {prayer_name}: {e}")
+    if targets:
+        await send_notifications(targets, is_reminder)
+
+def restore_notification_jobs(now=None):
+    """Поднимает задания из БД после перезапуска и применяет правила догоняния"""
+    now = now or datetime.now(TIMEZONE)
+    planned_jobs.clear()
+    fired_targets.clear()
+    jobs = load_notification_jobs()
+    # Сначала все сработавшие цели, чтобы не поднять их повторно под другим id
+    for fire_dt, is_reminder, targets, done in jobs.values():
+        if done:
+            mark_targets_fired(fire_dt, is_reminder, targets)
+    missed = []
+    for job_id, (fire_dt, is_reminder, targets, done) in jobs.items():
+        if done:
+            continue
+        targets = unfired_targets(fire_dt, is_reminder, targets)
+        if targets and (fire_dt > now or should_run(fire_dt, is_reminder, now)):
+            planned_jobs[job_id] = (fire_dt, is_reminder, targets)
+            add_notification_job(job_id, fire_dt, is_reminder, targets)
+        else:
+            mark_targets_fired(fire_dt, is_reminder, targets)
+            missed.append(job_id)
+    if missed:
+        mark_notification_jobs_done(missed)
+        logger.warning(f"Пропущено заданий за время простоя: {len(missed)}")
+    logger.info(f"Восстановлено заданий уведомлений: {len(planned_jobs)}")
+
+async def plan_notifications(now=None):
+    """Сверяет запланированные задания с расписанием на NOTIFY_DAYS_AHEAD дней.
+
+    Уже отправленные цели из плана выбрасываются, прошедшие задания не
+    добавляются, изменённые заменяются по тому же id. Возвращает число
+    изменённых заданий.
+    """
+    now = now or datetime.now(TIMEZONE)
+    await preload_cities(registry.cities())
+    plan = {}
+    for job_id, (fire_dt, is_reminder, targets) in notification_plan(now).items():
+        targets = unfired_targets(fire_dt, is_reminder, targets)
+        if targets:
+            plan[job_id] = (fire_dt, is_reminder, targets)
+    stale = [job_id for job_id in planned_jobs if job_id not in plan]
+    for job_id in stale:
+        del planned_jobs[job_id]
+        if scheduler.get_job(job_id):
+            scheduler.remove_job(job_id)
+    changed = {}
+    for job_id, job in plan.items():
+        if planned_jobs.get(job_id) == job:
+            continue
+        if job[0] <= now and job_id not in planned_jobs:
+            continue
+        planned_jobs[job_id] = job
+        add_notification_job(job_id, *job)
+        changed[job_id] = job
+    upserts = [(job_id, fire_dt.isoformat(), int(is_reminder), json.dumps(targets))
+               for job_id, (fire_dt, is_reminder, targets) in changed.items()]
+    # Старше этого срока цели уже не попадут в план: забываем их и в БД, и в памяти
+    prune_before = now - timedelta(days=2)
+    fired_targets.difference_update([key for key in fired_targets if key[0] < prune_before.date().isoformat()])
+    await run_db(write_notification_jobs, upserts, [(job_id,) for job_id in stale], prune_before.isoformat())
+    logger.info(f"Запланировано заданий уведомлений: {len(planned_jobs)}, изменено {len(changed) + len(stale)}")
+    return len(changed) + len(stale)
 
 # ==================== КОМАНДЫ И ОБРАБОТЧИКИ БОТА ====================
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
+    await subscriptions_loaded.wait()
     user_id = message.from_user.id
     if user_id not in subscriptions:
-        subscriptions[user_id] = set(TIME_PRAYER_ORDER)  # Подписка на все по умолчанию
-        save_subscriptions()
+        set_user_prayers(user_id, ALL_PRAYERS_MASK)  # Подписка на все по умолчанию
+        save_user(user_id)
     welcome_text = (
         "🕌 *Ассаламу алейкум!*\n\n"
-        "Я бот с расписанием намазов для Черкесска.\n\n"
+        "Я бот с расписанием намазов.\n"
+        f"📍 Ваш город: *{city_display_name(get_user_city(user_id))}* (сменить — кнопка «🏙️ Город»)\n\n"
         "✅ *Вы автоматически подписаны на все уведомления!*\n"
         "⏰ Уведомления приходят за 10 мин и в точное время\n\n"
         "*Используйте меню внизу: 👇*"
@@ -311,26 +1870,53 @@ async def cmd_help(message: types.Message):
         "🔔 Уведомления - Выбор намазов\n"
         "🔕 Выкл уведомления - Отписка\n"
         "ℹ️ Информация - О боте\n"
+        "🏙️ Город - Выбор города\n"
         "🔄 Обновить - Перезапуск"
     )
     await message.answer(help_text, parse_mode="Markdown", reply_markup=get_main_menu_keyboard())
 
+@dp.message(Command("reload"))
+async def cmd_reload(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    try:
+        changed = await reload_prayer_data()
+        await message.answer(f"✅ Расписание перезагружено, перепланировано заданий: {changed}")
+    except Exception as e:
+        logger.error(f"Ошибка перезагрузки CSV: {e}")
+        await message.answer(f"❌ Не удалось перезагрузить расписание: {e}")
+
+@dp.message(Command("profile"))
+async def cmd_profile(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    if not profiler.running:
+        profiler.start()
+        await message.answer("🔬 Профилировщик запущен, повторите /profile для отчёта")
+        return
+    await asyncio.get_running_loop().run_in_executor(None, profiler.stop)
+    await message.answer(profiler.report())
+
 @dp.message(lambda m: m.text == "🕐 Сегодня")
 async def handle_today_button(message: types.Message):
+    city = get_user_city(message.from_user.id)
     today = datetime.now(TIMEZONE)
-    times = get_prayer_times(today)
-    if times:
-        await message.answer(format_prayer_times(times, today), reply_markup=get_main_menu_keyboard())
-        await message.answer(get_current_prayer_status(times), parse_mode="Markdown", reply_markup=get_main_menu_keyboard())
+    # Оба текста готовятся до первого await, чтобы перезагрузка CSV между
+    # ответами не смешала старое и новое расписание
+    text = render_day(city, today)
+    status = get_current_prayer_status(city, today) if text else None
+    if text:
+        await message.answer(text, reply_markup=get_main_menu_keyboard())
+        await message.answer(status, parse_mode="Markdown", reply_markup=get_main_menu_keyboard())
     else:
         await message.answer("❌ Данные на сегодня не найдены", reply_markup=get_main_menu_keyboard())
 
 @dp.message(lambda m: m.text == "⏩ Завтра")
 async def handle_tomorrow_button(message: types.Message):
     tomorrow = datetime.now(TIMEZONE) + timedelta(days=1)
-    times = get_prayer_times(tomorrow)
-    if times:
-        await message.answer(format_prayer_times(times, tomorrow), reply_markup=get_main_menu_keyboard())
+    text = render_day(get_user_city(message.from_user.id), tomorrow)
+    if text:
+        await message.answer(text, reply_markup=get_main_menu_keyboard())
     else:
         await message.answer("❌ Данные на завтра не найдены", reply_markup=get_main_menu_keyboard())
 
@@ -340,32 +1926,41 @@ async def handle_month_button(message: types.Message):
 
 @dp.message(lambda m: m.text == "🔔 Уведомления")
 async def handle_notify_on_button(message: types.Message):
+    await subscriptions_loaded.wait()
     user_id = message.from_user.id
     if user_id not in subscriptions:
-        subscriptions[user_id] = set()
+        set_user_prayers(user_id, 0)
     await message.answer("Выберите намазы для уведомлений:", reply_markup=get_prayer_selection_keyboard(user_id))
 
 @dp.message(lambda m: m.text == "🔕 Выкл уведомления")
 async def handle_notify_off_button(message: types.Message):
+    await subscriptions_loaded.wait()
     user_id = message.from_user.id
     if user_id in subscriptions:
-        del subscriptions[user_id]
-        save_subscriptions()
+        unsubscribe_user(user_id)
+        save_user(user_id)
     await message.answer("🔕 Уведомления выключены.", reply_markup=get_main_menu_keyboard())
 
 @dp.message(lambda m: m.text == "ℹ️ Информация")
 async def handle_info_button(message: types.Message):
+    city = get_user_city(message.from_user.id)
+    coordinates = city_coordinates(city)
     info_text = (
-        "🕌 *Расписание намазов для города Черкесска.*\n\n"
-        "📍 *Местоположение:* \nЧеркесск (КЧР)\n"
-        "🌐 *Координаты:* \n44.22333, 42.05778\n\n"
-        "📝 *Хадис:*\n"
+        "🕌 *Расписание намазов*\n\n"
+        f"📍 *Местоположение:* \n{city_display_name(city)}\n"
+        + (f"🌐 *Координаты:* \n{coordinates[0]}, {coordinates[1]}\n" if coordinates else "")
+        + "\n📝 *Хадис:*\n"
         "«Самое лучшее деяние — это намаз, совершенный в начале отведенного для него времени».\n"
         "Этот хадис передали ат-Тирмизи и аль-Хаким.\n\n"
         "Версия: 1.1 (с напоминаниями и выбором)"
     )
     await message.answer(info_text, parse_mode="Markdown", reply_markup=get_main_menu_keyboard())
 
+@dp.message(lambda m: m.text == "🏙️ Город")
+async def handle_city_button(message: types.Message):
+    city_name = city_display_name(get_user_city(message.from_user.id))
+    await message.answer(f"📍 Текущий город: *{city_name}*\nВыберите город:", parse_mode="Markdown", reply_markup=get_cities_keyboard())
+
 @dp.message(lambda m: m.text == "🔄 Обновить")
 async def handle_refresh_button(message: types.Message):
     await cmd_start(message)
@@ -374,48 +1969,198 @@ async def handle_refresh_button(message: types.Message):
 async def handle_inline_buttons(callback: types.CallbackQuery):
     data = callback.data
     user_id = callback.from_user.id
+    if data.startswith(("city_", "toggle_")) or data == "save_prayers":
+        await subscriptions_loaded.wait()
     if data.startswith("month_"):
         month_num = int(data.split("_")[1])
-        month_data = {d: prayer_data[d] for d in prayer_data if d.endswith(f".{month_num:02d}")}
-        if month_data:
-            await callback.message.edit_text(format_month_table(month_data, month_num))
+        text = render_month(get_user_city(user_id), month_num)
+        if text:
+            await callback.message.edit_text(text)
         else:
             await callback.message.edit_text(f"❌ Данные на {MONTHS_RU.get(month_num)} не найдены")
+    elif data.startswith("city_"):
+        city = data[len("city_"):]
+        if city in registry:
+            set_user_city(user_id, city)
+            save_user(user_id)
+            await callback.message.edit_text(f"📍 Город выбран: {city_display_name(city)}")
     elif data == "back_to_menu":
         await callback.message.delete()
         await callback.message.answer("👇 *Используйте меню внизу:*", parse_mode="Markdown", reply_markup=get_main_menu_keyboard())
     elif data.startswith("toggle_"):
         prayer = data.split("_")[1]
-        if user_id not in subscriptions:
-            subscriptions[user_id] = set()
-        if prayer in subscriptions[user_id]:
-            subscriptions[user_id].remove(prayer)
-        else:
-            subscriptions[user_id].add(prayer)
+        if prayer in PRAYER_BITS:
+            toggle_user_prayer(user_id, prayer)
         await callback.message.edit_reply_markup(reply_markup=get_prayer_selection_keyboard(user_id))
     elif data == "save_prayers":
-        save_subscriptions()
+        save_user(user_id)
         await callback.message.edit_text("✅ Настройки уведомлений сохранены!")
     elif data == "read_notification":
         await callback.answer("Прочитано!")
     await callback.answer()
 
+# ==================== WEBHOOK ====================
+webhook_server = None
+
+class WebhookServer:
+    """Приём обновлений по webhook: ограниченная очередь и пул обработчиков.
+
+    Обработчик HTTP только проверяет секрет и кладёт обновление в очередь,
+    поэтому Telegram получает ответ сразу. Если очередь полна, отвечаем 503
+    и Telegram повторит доставку позже.
+    """
+
+    def __init__(self, queue_size=WEBHOOK_QUEUE_SIZE, workers=WEBHOOK_WORKERS):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.worker_count = workers
+        self.workers = []
+        self.accepting = True
+
+    async def handle(self, request):
+        from aiohttp import web
+        if not self.accepting:
+            return web.Response(status=503)
+        token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        # Байты, а не str: compare_digest падает с TypeError на не-ASCII в заголовке
+        if not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": bot})
+        except Exception as e:
+            logger.warning(f"Некорректное обновление webhook: {e}")
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            return web.Response(status=503)
+        return web.Response()
+
+    async def worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await dp.feed_update(bot, update)
+            except Exception as e:
+                logger.error(f"Ошибка обработки обновления {update.update_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def start(self):
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(self.worker_count)]
+
+    async def drain(self):
+        """Перестаёт принимать обновления и дообрабатывает очередь"""
+        self.accepting = False
+        try:
+            await asyncio.wait_for(self.queue.join(), WEBHOOK_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не обработано обновлений при остановке: {self.queue.qsize()}")
+        for task in self.workers:
+            task.cancel()
+
+async def run_webhook():
+    global webhook_server
+    from aiohttp import web
+    server = webhook_server = WebhookServer()
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, server.handle)
+    runner = web.AppRunner(app, access_log=None)  # строка лога на каждое обновление под нагрузкой не нужна
+    await runner.setup()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    server.start()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=dp.resolve_used_update_types())
+        logger.info(f"Webhook слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        await stop.wait()
+    finally:
+        logger.info("Остановка webhook...")
+        await server.drain()
+        await runner.cleanup()
+        await bot.session.close()
+
+async def run_polling():
+    # Webhook прошлого запуска в режиме webhook сам не снимается, а пока он стоит,
+    # getUpdates отвечает 409 Conflict; start_polling aiogram его не снимает
+    await bot.delete_webhook()
+    await dp.start_polling(bot)
+
 # ==================== ЗАПУСК БОТА ====================
 async def on_startup():
+    """Поднимает состояние бота; False, если без расписания запускаться нельзя"""
+    global csv_watch_task, delivery_task, loop_watch_task, subscriptions_task, scheduler
     logger.info("🚀 Бот запускается...")
     init_db()
     if not load_prayer_data():
         logger.critical("Не удалось загрузить данные CSV!")
-        return
-    load_subscriptions()
-    schedule_prayer_notifications()
-    scheduler.start()
-    scheduler.add_job(schedule_prayer_notifications, CronTrigger(hour=0, minute=1, timezone=TIMEZONE), id="daily_schedule_update")
+        return False
+    load_user_cities()
+    subscriptions_task = asyncio.create_task(load_subscriptions())
+    if SCHEDULER_ENABLED:
+        from apscheduler.schedulers.asyncio import AsyncIOScheduler
+        from apscheduler.triggers.cron import CronTrigger
+        scheduler = AsyncIOScheduler(timezone=TIMEZONE)
+        restore_notification_jobs()
+        scheduler.start()
+        await plan_notifications()
+        scheduler.add_job(plan_notifications, CronTrigger(hour=0, minute=1, timezone=TIMEZONE), id="daily_schedule_update",
+                          replace_existing=True)
+        if BROADCAST_WORKERS > 0:
+            start_broadcast_workers()
+    delivery_task = asyncio.create_task(process_delivery_events())
+    loop_watch_task = asyncio.create_task(watch_event_loop())
+    if METRICS_PORT:
+        await start_metrics_server()
+    if CSV_WATCH_INTERVAL > 0:
+        csv_watch_task = asyncio.create_task(watch_csv_file())
     logger.info("✅ Бот успешно запущен!")
+    return True
 
 async def main():
-    await on_startup()
-    await dp.start_polling(bot)
+    if not acquire_instance_lock():
+        logger.critical(f"База {SUBSCRIPTIONS_DB} занята другим процессом бота: поддерживается только одна реплика")
+        return 1
+    serving = None
+    load_failed = False
+
+    # Без подписок обработчики и рассылки ждали бы subscriptions_loaded вечно, а
+    # открыть их с частичными данными нельзя: /start перезаписал бы сохранённый
+    # выбор. Поэтому ошибка загрузки останавливает бота, как неудачный старт.
+    def check_subscriptions(task):
+        nonlocal load_failed
+        if not task.cancelled() and task.exception() is not None:
+            load_failed = True
+            serving.cancel()
+
+    try:
+        # Без расписания подписки не загружаются вовсе — по той же причине не запускаемся
+        if not await on_startup():
+            return 1
+        serving = asyncio.create_task(run_webhook() if BOT_MODE == 'webhook' else run_polling())
+        if subscriptions_task is not None:
+            subscriptions_task.add_done_callback(check_subscriptions)
+        await serving
+    except asyncio.CancelledError:
+        if not load_failed:
+            raise
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        if profiler.running:
+            profiler.stop()
+        if worker_tasks:
+            await stop_broadcast_workers()
+        stop_delivery_processing()
+        await shutdown_db()
+        close_broadcast_queue()
+        release_instance_lock()
+    return 1 if load_failed else 0
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if len(sys.argv) == 3 and sys.argv[1] == '--broadcast-worker':
+        asyncio.run(run_broadcast_worker(int(sys.argv[2])))
+    else:
+        sys.exit(asyncio.run(main()))
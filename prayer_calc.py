@@ -0,0 +1,216 @@
+"""
+Расчёт времени намазов по координатам — альтернатива статичному CSV.
+
+Алгоритм классический (как в PrayTimes): по дате находятся склонение Солнца
+и уравнение времени, а из них — моменты, когда Солнце проходит нужные углы
+относительно горизонта. Положение Солнца берётся в моменты, отсчитанные от
+долготы самого места, поэтому результат не зависит от состава пакета и
+кэшируется по (место, метод, дата). Места с одинаковой долготой делят
+расчёт положения Солнца.
+
+На высоких широтах летом Солнце не опускается на угол Фаджра или Иши; тогда,
+как в PrayTimes, время берётся долей ночи от восхода или заката (high_lats).
+Намаз после полуночи остаётся в своём дне и пишется как 24:14, а не 00:14.
+
+Сверка с prayer_times_cherkessk.csv и замер скорости — benchmarks/calculation.py.
+"""
+
+import math
+from collections import namedtuple
+from datetime import date, timedelta
+
+# Углы — градусы Солнца под горизонтом; isha_minutes заменяет угол Иши
+# фиксированным интервалом после Магриба; asr_factor: 1 — шафиитский, 2 — ханафитский.
+METHODS = {
+    'MWL': {'fajr_angle': 18.0, 'isha_angle': 17.0},
+    'ISNA': {'fajr_angle': 15.0, 'isha_angle': 15.0},
+    'Egypt': {'fajr_angle': 19.5, 'isha_angle': 17.5},
+    'Makkah': {'fajr_angle': 18.5, 'isha_minutes': 90},
+    'Karachi': {'fajr_angle': 18.0, 'isha_angle': 18.0},
+}
+DEFAULT_SETTINGS = {
+    'fajr_angle': 18.0,
+    'isha_angle': 17.0,
+    'isha_minutes': None,
+    'asr_factor': 1,
+    'maghrib_minutes': 0,
+    'adjustments': {},  # поправки в минутах к отдельным намазам, например {'Duhr': 5}
+    'high_lats': 'AngleBased',  # правило для высоких широт, см. HIGH_LAT_RULES; None — без него
+}
+# Доля ночи (от заката до восхода), дальше которой Фаджр и Иша не отходят от восхода и заката
+HIGH_LAT_RULES = {
+    'AngleBased': lambda angle: angle / 60,
+    'OneSeventh': lambda angle: 1 / 7,
+    'NightMiddle': lambda angle: 1 / 2,
+}
+SUNRISE_ANGLE = 0.833  # рефракция и видимый радиус диска
+OUTPUT_ORDER = ['Fajr', 'Sunrise', 'Duhr', 'Asr', 'Maghrib', 'Isha', 'FirstThird', 'Midnight', 'LastThird']
+
+Location = namedtuple('Location', ['latitude', 'longitude', 'utc_offset'])
+
+_cache = {}  # (location, method, date) -> {'Fajr': 'HH:MM', ...}
+
+# ==================== АСТРОНОМИЯ ====================
+def _sin(d):
+    return math.sin(math.radians(d))
+
+def _cos(d):
+    return math.cos(math.radians(d))
+
+def _tan(d):
+    return math.tan(math.radians(d))
+
+def julian_day(day):
+    year, month = day.year, day.month
+    if month <= 2:
+        year -= 1
+        month += 12
+    a = year // 100
+    b = 2 - a + a // 4
+    return math.floor(365.25 * (year + 4716)) + math.floor(30.6001 * (month + 1)) + day.day + b - 1524.5
+
+def sun_position(jd):
+    """(склонение в градусах, уравнение времени в часах)"""
+    d = jd - 2451545.0
+    g = (357.529 + 0.98560028 * d) % 360
+    q = (280.459 + 0.98564736 * d) % 360
+    ecliptic_longitude = (q + 1.915 * _sin(g) + 0.020 * _sin(2 * g)) % 360
+    obliquity = 23.439 - 0.00000036 * d
+    right_ascension = math.degrees(math.atan2(_cos(obliquity) * _sin(ecliptic_longitude), _cos(ecliptic_longitude))) / 15
+    equation = q / 15 - right_ascension % 24
+    equation = (equation + 12) % 24 - 12
+    declination = math.degrees(math.asin(_sin(obliquity) * _sin(ecliptic_longitude)))
+    return declination, equation
+
+# Доли суток, в которые берётся положение Солнца для каждого события
+SAMPLE_TIMES = {'Fajr': 5 / 24, 'Sunrise': 6 / 24, 'Duhr': 12 / 24, 'Asr': 13 / 24, 'Sunset': 18 / 24}
+
+def solar_day(day, longitude):
+    """Положение Солнца в опорные моменты местного дня; общее для мест с этой долготой"""
+    jd = julian_day(day) - longitude / (15 * 24)
+    return {event: sun_position(jd + t) for event, t in SAMPLE_TIMES.items()}
+
+def _angle_time(sun, latitude, angle, before_noon):
+    declination, equation = sun
+    noon = 12 - equation
+    x = (-_sin(angle) - _sin(declination) * _sin(latitude)) / (_cos(declination) * _cos(latitude))
+    if not -1 <= x <= 1:
+        return None  # Солнце не опускается на этот угол (высокие широты летом)
+    delta = math.degrees(math.acos(x)) / 15
+    return noon - delta if before_noon else noon + delta
+
+def _day_hours(location, settings, sun):
+    """Время событий дня в часах местного поясного времени (float или None)"""
+    latitude = location.latitude
+    shift = location.utc_offset - location.longitude / 15
+    hours = {
+        'Fajr': _angle_time(sun['Fajr'], latitude, settings['fajr_angle'], True),
+        'Sunrise': _angle_time(sun['Sunrise'], latitude, SUNRISE_ANGLE, True),
+        'Duhr': 12 - sun['Duhr'][1],
+        'Maghrib': _angle_time(sun['Sunset'], latitude, SUNRISE_ANGLE, False),
+    }
+    declination = sun['Asr'][0]
+    asr_angle = -math.degrees(math.atan(1 / (settings['asr_factor'] + _tan(abs(latitude - declination)))))
+    hours['Asr'] = _angle_time(sun['Asr'], latitude, asr_angle, False)
+    if settings['isha_minutes'] is not None:
+        hours['Isha'] = hours['Maghrib'] + settings['isha_minutes'] / 60 if hours['Maghrib'] is not None else None
+    else:
+        hours['Isha'] = _angle_time(sun['Sunset'], latitude, settings['isha_angle'], False)
+    if settings['high_lats'] and hours['Sunrise'] is not None and hours['Maghrib'] is not None:
+        portion = HIGH_LAT_RULES[settings['high_lats']]
+        night = hours['Sunrise'] + 24 - hours['Maghrib']
+        limit = portion(settings['fajr_angle']) * night
+        if hours['Fajr'] is None or hours['Sunrise'] - hours['Fajr'] > limit:
+            hours['Fajr'] = hours['Sunrise'] - limit
+        if settings['isha_minutes'] is None:
+            limit = portion(settings['isha_angle']) * night
+            if hours['Isha'] is None or hours['Isha'] - hours['Maghrib'] > limit:
+                hours['Isha'] = hours['Maghrib'] + limit
+    if hours['Maghrib'] is not None:
+        hours['Maghrib'] += settings['maghrib_minutes'] / 60
+    for prayer, value in hours.items():
+        if value is not None:
+            hours[prayer] = value + shift + settings['adjustments'].get(prayer, 0) / 60
+    return hours
+
+def _format_hours(value, carry=False):
+    """'HH:MM'; carry — время после полуночи не заворачивать (24:14), раньше полуночи — не раньше 00:00"""
+    minutes = int(round(value * 60))
+    minutes = max(0, minutes) if carry else minutes % (24 * 60)
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def parse_adjustments(text):
+    """Поправки из строки "Fajr=-2,Duhr=5" в {'Fajr': -2, 'Duhr': 5}"""
+    adjustments = {}
+    for item in text.split(','):
+        if item.strip():
+            prayer, minutes = item.split('=')
+            if prayer.strip() not in OUTPUT_ORDER[:6]:
+                raise ValueError(f"Поправка для неизвестного намаза: {prayer}")
+            adjustments[prayer.strip()] = int(minutes)
+    return adjustments
+
+def resolve_method(method='MWL', **overrides):
+    if method not in METHODS:
+        raise ValueError(f"Неизвестный метод расчёта: {method}")
+    if overrides.get('high_lats') not in (None, *HIGH_LAT_RULES):
+        raise ValueError(f"Неизвестное правило для высоких широт: {overrides['high_lats']}")
+    settings = {**DEFAULT_SETTINGS, **METHODS[method], **overrides}
+    if 'isha_angle' in overrides:
+        settings['isha_minutes'] = overrides.get('isha_minutes')
+    return settings
+
+# ==================== ПАКЕТНЫЙ РАСЧЁТ ====================
+def calculate_year(locations, year, method='MWL', cache=True, **overrides):
+    """Расписание на год для всех locations одним проходом.
+
+    Возвращает {location: {'dd.mm': {'Fajr': 'HH:MM', ...}}} — та же форма,
+    что у данных из CSV, только намаз после полуночи пишется как 24:14. Ночь
+    (треть, полночь, последняя треть) считается от Магриба до Фаджра
+    следующего дня и, как в CSV, заворачивается за полночь. cache=False — не оставлять результат в
+    общем кэше модуля, если вызывающий хранит его сам (около 0,6 МиБ на город-год).
+    """
+    store = _cache if cache else {}
+    settings = resolve_method(method, **overrides)
+    cache_method = (method, tuple(sorted((k, str(sorted(v.items())) if isinstance(v, dict) else str(v))
+                                         for k, v in overrides.items())))
+    days = [date(year, 1, 1) + timedelta(days=i) for i in range((date(year + 1, 1, 1) - date(year, 1, 1)).days + 1)]
+    result = {location: {} for location in locations}
+    pending = [loc for loc in locations if any((loc, cache_method, day) not in store for day in days[:-1])]
+    if pending:
+        # Последний элемент days — 1 января следующего года, нужен только для длины ночи
+        suns = {}  # долгота -> положение Солнца по дням
+        for location in pending:
+            if location.longitude not in suns:
+                suns[location.longitude] = [solar_day(day, location.longitude) for day in days]
+            day_hours = [_day_hours(location, settings, sun) for sun in suns[location.longitude]]
+            for i, day in enumerate(days[:-1]):
+                hours, next_fajr = day_hours[i], day_hours[i + 1]['Fajr']
+                times = {p: _format_hours(hours[p], carry=True) for p in ('Fajr', 'Sunrise', 'Duhr', 'Asr', 'Maghrib', 'Isha')
+                         if hours[p] is not None}
+                if hours['Maghrib'] is not None and next_fajr is not None:
+                    night = next_fajr + 24 - hours['Maghrib']
+                    times['FirstThird'] = _format_hours(hours['Maghrib'] + night / 3)
+                    times['Midnight'] = _format_hours(hours['Maghrib'] + night / 2)
+                    times['LastThird'] = _format_hours(hours['Maghrib'] + night * 2 / 3)
+                store[(location, cache_method, day)] = times
+    for location in locations:
+        for day in days[:-1]:
+            result[location][day.strftime("%d.%m")] = store[(location, cache_method, day)]
+    return result
+
+def compare(calculated, reference):
+    """Максимальное и среднее отклонение в минутах по каждому намазу"""
+    def to_minutes(value):
+        hour, minute = map(int, value.split(':'))
+        return hour * 60 + minute
+    report = {}
+    for prayer in OUTPUT_ORDER:
+        diffs = []
+        for date_str, times in reference.items():
+            if prayer in times and prayer in calculated.get(date_str, {}):
+                diff = abs(to_minutes(calculated[date_str][prayer]) - to_minutes(times[prayer])) % (24 * 60)
+                diffs.append(min(diff, 24 * 60 - diff))
+        if diffs:
+            report[prayer] = (max(diffs), sum(diffs) / len(diffs))
+    return report
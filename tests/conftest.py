@@ -0,0 +1,128 @@
+"""
+Общие фикстуры тестов. main импортируется один раз с тестовым окружением;
+каждый тест получает своё состояние: базу во временной папке, расписание из
+синтетического CSV и непущенный планировщик. Время передаётся явно (now=).
+"""
+
+import asyncio
+import calendar
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ.update({
+    'API_TOKEN': '1:test',
+    'CITIES_DIR': REPO_DIR,
+    'CALC_CITIES': '',
+    'CSV_WATCH_INTERVAL': '0',
+    'TIMETABLE_CACHE_DIR': '',
+})
+sys.path.insert(0, REPO_DIR)
+
+import main  # noqa: E402
+
+# Времена 17.10 из prayer_times_cherkessk.csv; синтетический CSV повторяет их каждый день
+TIMES = {'Fajr': '05:18', 'Sunrise': '06:29', 'Duhr': '12:16', 'Asr': '15:06', 'Maghrib': '17:23',
+         'Isha': '19:08', 'FirstThird': '21:21', 'Midnight': '23:21', 'LastThird': '01:20'}
+
+
+def at(day, hhmm):
+    """Момент в TIMEZONE: at('2026-10-17', '05:18')"""
+    return main.TIMEZONE.localize(datetime.strptime(f"{day} {hhmm}", '%Y-%m-%d %H:%M'))
+
+
+def write_timetable(directory, city='cherkessk', overrides=None, times=None):
+    """CSV на високосный год; times меняет времена всех дней, overrides: {'dd.mm': {'Fajr': 'HH:MM'}}"""
+    overrides = overrides or {}
+    base = {**TIMES, **(times or {})}
+    lines = ['Date,' + ','.join(main.DETAILED_PRAYER_ORDER)]
+    for month in range(1, 13):
+        for day in range(1, calendar.monthrange(2000, month)[1] + 1):
+            date_str = f"{day:02d}.{month:02d}"
+            times = {**base, **overrides.get(date_str, {})}
+            lines.append(date_str + ',' + ','.join(times[p] for p in main.DETAILED_PRAYER_ORDER))
+    path = os.path.join(directory, f"prayer_times_{city}.csv")
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(lines) + '\n')
+    return path
+
+
+def text_message(user_id, text):
+    return {'message': {'message_id': 1, 'date': 0, 'text': text, 'chat': {'id': user_id, 'type': 'private'},
+                        'from': {'id': user_id, 'is_bot': False, 'first_name': 'User'}}}
+
+
+def callback_query(user_id, data):
+    return {'callback_query': {'id': str(user_id), 'chat_instance': str(user_id), 'data': data,
+                               'from': {'id': user_id, 'is_bot': False, 'first_name': 'User'},
+                               'message': {'message_id': 1, 'date': 0, 'text': '…',
+                                           'chat': {'id': user_id, 'type': 'private'}}}}
+
+
+def freeze_time(bot, monkeypatch, now):
+    class FrozenDatetime(bot.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now
+
+    monkeypatch.setattr(bot, 'datetime', FrozenDatetime)
+
+
+def capture_requests(bot, monkeypatch):
+    """Запросы к Bot API не уходят в сеть: тексты копятся по chat_id, каждый ответ чуть задерживается"""
+    replies = {}
+
+    async def make_request(client, method, timeout=None):
+        await asyncio.sleep(0.002)
+        if getattr(method, 'text', None) is not None:
+            replies.setdefault(method.chat_id, []).append(method.text)
+        return True
+
+    monkeypatch.setattr(bot.bot.session, 'make_request', make_request)
+    return replies
+
+
+def reload_city(city='cherkessk'):
+    """Перечитывает CSV города и подменяет расписание, как reload_prayer_data()"""
+    main.registry.swap({city: main.registry.read(city)})
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    """main с чистым состоянием"""
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    monkeypatch.setattr(main, 'SUBSCRIPTIONS_DB', str(tmp_path / 'subscriptions.db'))
+    for name in ('subscriptions', 'user_cities', 'prayer_subscribers', 'planned_jobs', 'fired_targets',
+                 'delivery_failures', 'delivery_retry_tasks', 'dirty_users', 'chat_not_before'):
+        monkeypatch.setattr(main, name, type(getattr(main, name))())
+    monkeypatch.setattr(main, 'flush_task', None)
+    monkeypatch.setattr(main, 'instance_lock', None)
+    monkeypatch.setattr(main, 'delivery_events', asyncio.Queue())
+    monkeypatch.setattr(main, 'reload_lock', asyncio.Lock())
+    monkeypatch.setattr(main, 'subscriptions_loaded', asyncio.Event())
+    main.subscriptions_loaded.set()
+    monkeypatch.setattr(main, 'scheduler', AsyncIOScheduler(timezone=main.TIMEZONE))
+
+    write_timetable(tmp_path)
+    registry = main.TimetableRegistry(str(tmp_path))
+    registry.discover()
+    monkeypatch.setattr(main, 'registry', registry)
+
+    main.init_db()
+    yield main
+    main.close_db()
+
+
+@pytest.fixture
+def sent(bot, monkeypatch):
+    """Вместо рассылки записывает цели сработавших заданий: [(targets, is_reminder)]"""
+    calls = []
+
+    async def send_notifications(targets, is_reminder=False):
+        calls.append((tuple(targets), is_reminder))
+
+    monkeypatch.setattr(bot, 'send_notifications', send_notifications)
+    return calls
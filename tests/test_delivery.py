@@ -0,0 +1,230 @@
+"""Исходы доставки: классификация ошибок Bot API, повторы с задержкой и отписка недоступных чатов"""
+
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+METHOD = SendMessage(chat_id=1, text='…')
+ERRORS = {
+    'forbidden': lambda: TelegramForbiddenError(METHOD, "Forbidden: bot was blocked by the user"),
+    'chat_not_found': lambda: TelegramBadRequest(METHOD, "Bad Request: chat not found"),
+    'bad_request': lambda: TelegramBadRequest(METHOD, "Bad Request: can't parse entities"),
+    'retry_after': lambda: TelegramRetryAfter(METHOD, "Too Many Requests: retry after 7", retry_after=7),
+    'short_retry_after': lambda: TelegramRetryAfter(METHOD, "Too Many Requests: retry after 0", retry_after=0),
+    'network': lambda: TelegramNetworkError(METHOD, "Connection reset by peer"),
+}
+
+
+@pytest.fixture
+def fake_send(bot, monkeypatch):
+    """Заглушка bot.send_message: ошибки по chat_id из errors[chat_id] (список, по одной на вызов)"""
+
+    class FakeSend:
+        def __init__(self):
+            self.errors = {}
+            self.calls = []  # (chat_id, time.monotonic())
+
+        async def __call__(self, chat_id, text, **kwargs):
+            self.calls.append((chat_id, time.monotonic()))
+            pending = self.errors.get(chat_id)
+            if pending:
+                raise ERRORS[pending.pop(0) if isinstance(pending, list) else pending]()
+            return True
+
+        def times(self, chat_id):
+            return [t for c, t in self.calls if c == chat_id]
+
+    send = FakeSend()
+    monkeypatch.setattr(bot.bot, 'send_message', send)
+    monkeypatch.setattr(bot, 'broadcast_limiter', bot.TokenBucket(10000, 10000))
+    monkeypatch.setattr(bot, 'DB_FLUSH_DELAY', 0.01)
+    monkeypatch.setattr(bot, 'CHAT_MIN_INTERVAL', 0.01)
+    return send
+
+
+async def settle(bot, timeout=5):
+    """Ждёт, пока обработаются все события доставки, повторы и сброс в БД"""
+    deadline = time.monotonic() + timeout
+    while bot.delivery_retry_tasks or not bot.delivery_events.empty() or (bot.flush_task and not bot.flush_task.done()):
+        assert time.monotonic() < deadline, "события доставки не обработались"
+        await asyncio.sleep(0.01)
+
+
+async def with_delivery_processing(bot, coro):
+    bot.delivery_task = asyncio.create_task(bot.process_delivery_events())
+    try:
+        result = await coro
+        await settle(bot)
+        return result
+    finally:
+        bot.delivery_task.cancel()
+
+
+@pytest.mark.parametrize('error, outcome', [
+    (None, 'ok'),
+    ('forbidden', 'blocked'),
+    ('chat_not_found', 'blocked'),
+    ('bad_request', 'failed'),
+    ('retry_after', 'rate_limited'),
+    ('network', 'transient'),
+])
+def test_deliver_classifies_errors(bot, fake_send, error, outcome):
+    if error:
+        fake_send.errors[1] = error
+    result = asyncio.run(bot.deliver(1, '…', {}))
+    assert result == (outcome, 7 if error == 'retry_after' else 0)
+
+
+def test_retry_backoff_schedule(bot, monkeypatch):
+    delays = []
+
+    async def retry_delivery(event, delay):
+        delays.append((event.attempt, delay))
+
+    monkeypatch.setattr(bot, 'retry_delivery', retry_delivery)
+
+    async def scenario():
+        events = [bot.DeliveryEvent(1, bot.OUTCOME_TRANSIENT, '…', {}, attempt, 0)
+                  for attempt in range(bot.DELIVERY_MAX_RETRIES + 1)]
+        events.append(bot.DeliveryEvent(2, bot.OUTCOME_RATE_LIMITED, '…', {}, 0, 30))
+        bot.handle_delivery_events(events)
+        await asyncio.gather(*bot.delivery_retry_tasks)
+
+    asyncio.run(scenario())
+    base = bot.DELIVERY_RETRY_BASE
+    # Экспоненциальная задержка, последняя попытка не повторяется, RetryAfter задаёт нижнюю границу
+    assert sorted(delays) == [(0, base), (0, 30), (1, base * 2), (2, base * 4)]
+
+
+def test_transient_errors_are_retried_until_delivered(bot, fake_send, monkeypatch):
+    monkeypatch.setattr(bot, 'DELIVERY_RETRY_BASE', 0.05)
+    bot.set_user_prayers(1, bot.ALL_PRAYERS_MASK)
+    fake_send.errors[1] = ['network', 'network']
+    stats = asyncio.run(with_delivery_processing(bot, bot.broadcast([1], '…')))
+    assert stats.failed == 1
+    times = fake_send.times(1)
+    assert len(times) == 3
+    assert times[1] - times[0] >= 0.05 and times[2] - times[1] >= 0.1
+    assert bot.deliveries_total.values[('ok',)] >= 1
+    assert 1 in bot.subscriptions
+
+
+def test_retries_give_up_after_max_attempts(bot, fake_send, monkeypatch):
+    monkeypatch.setattr(bot, 'DELIVERY_RETRY_BASE', 0.01)
+    bot.set_user_prayers(1, bot.ALL_PRAYERS_MASK)
+    fake_send.errors[1] = 'network'
+    asyncio.run(with_delivery_processing(bot, bot.broadcast([1], '…')))
+    assert len(fake_send.times(1)) == 1 + bot.DELIVERY_MAX_RETRIES
+    assert 1 in bot.subscriptions  # временные ошибки не отписывают
+
+
+def test_rate_limited_chat_is_requeued_within_broadcast(bot, fake_send, monkeypatch):
+    monkeypatch.setattr(bot, 'DELIVERY_RETRY_BASE', 0.01)
+    bot.set_user_prayers(1, bot.ALL_PRAYERS_MASK)
+    fake_send.errors[1] = ['short_retry_after']
+    stats = asyncio.run(with_delivery_processing(bot, bot.broadcast([1], '…')))
+    assert (stats.sent, stats.retried) == (1, 1)
+
+
+def test_same_chat_is_spaced_across_concurrent_broadcasts(bot, fake_send, monkeypatch):
+    monkeypatch.setattr(bot, 'CHAT_MIN_INTERVAL', 0.2)
+    users = [1, 2, 3]
+
+    async def scenario():
+        # Уведомление и напоминание одной минуты идут в одни и те же чаты
+        return await asyncio.gather(bot.broadcast(users, 'намаз'), bot.broadcast(users, 'напоминание'))
+
+    results = asyncio.run(with_delivery_processing(bot, scenario()))
+    assert [stats.sent for stats in results] == [3, 3]
+    for user_id in users:
+        first, second = fake_send.times(user_id)
+        assert second - first >= 0.2
+
+
+def test_held_chat_does_not_stall_others(bot, fake_send):
+    bot.hold_chat(1, 0.3)
+    started = time.monotonic()
+    stats = asyncio.run(with_delivery_processing(bot, bot.broadcast([1, 2, 3, 4], '…')))
+    assert stats.sent == 4
+    assert all(fake_send.times(user_id)[0] - started < 0.1 for user_id in (2, 3, 4))
+    assert fake_send.times(1)[0] - started >= 0.3
+
+
+def test_retry_after_holds_chat_for_background_retries(bot, fake_send, monkeypatch):
+    monkeypatch.setattr(bot, 'BROADCAST_MAX_RETRIES', 0)  # RetryAfter уходит в фоновые повторы
+    monkeypatch.setattr(bot, 'DELIVERY_RETRY_BASE', 0.01)
+    bot.set_user_prayers(1, bot.ALL_PRAYERS_MASK)
+    fake_send.errors[1] = ['retry_after']
+
+    async def scenario():
+        bot.delivery_task = asyncio.create_task(bot.process_delivery_events())
+        try:
+            await bot.broadcast([1], '…')
+            wait = bot.chat_wait(1)
+            await asyncio.sleep(0.1)
+            return wait
+        finally:
+            bot.delivery_task.cancel()
+            for task in list(bot.delivery_retry_tasks):
+                task.cancel()
+
+    wait = asyncio.run(scenario())
+    assert 6 < wait <= 7  # чат отложен на retry_after из ответа Telegram
+    assert len(fake_send.times(1)) == 1  # фоновый повтор ждёт вместе с ним
+
+
+def test_chat_holds_expire(bot):
+    for user_id in range(100):
+        bot.hold_chat(user_id, 0)
+    bot.hold_chat(100, 60)
+    assert list(bot.chat_not_before) == [100]
+    assert bot.chat_wait(1) == 0 and bot.chat_wait(100) > 59
+
+
+def test_blocked_chat_pruned_only_after_consecutive_failures(bot, fake_send):
+    for user_id in (1, 2):
+        bot.set_user_prayers(user_id, bot.ALL_PRAYERS_MASK)
+    fake_send.errors[1] = 'forbidden'
+    fake_send.errors[2] = ['chat_not_found', 'chat_not_found']  # третья рассылка дойдёт
+
+    async def scenario():
+        for _ in range(bot.DELIVERY_PRUNE_AFTER - 1):
+            await bot.broadcast([1, 2], '…')
+            await settle(bot)
+            assert {1, 2} <= set(bot.subscriptions)
+        await bot.broadcast([1, 2], '…')
+        await settle(bot)
+
+    asyncio.run(with_delivery_processing(bot, scenario()))
+    assert 1 not in bot.subscriptions
+    assert 2 in bot.subscriptions and 2 not in bot.delivery_failures  # успех сбрасывает счётчик
+    assert bot.db_conn.execute('SELECT COUNT(*) FROM subscriptions WHERE user_id = 1').fetchone()[0] == 0
+
+
+def test_prunes_are_written_in_one_transaction(bot, fake_send, monkeypatch):
+    blocked = list(range(1, 51))
+    for user_id in blocked + [100, 101]:
+        bot.set_user_prayers(user_id, bot.ALL_PRAYERS_MASK)
+    for user_id in blocked:
+        fake_send.errors[user_id] = 'forbidden'
+    writes = []
+    original = bot.write_subscription_changes
+
+    def write_subscription_changes(upserts, deletes):
+        writes.append((list(upserts), list(deletes)))
+        original(upserts, deletes)
+
+    monkeypatch.setattr(bot, 'write_subscription_changes', write_subscription_changes)
+
+    async def scenario():
+        for _ in range(bot.DELIVERY_PRUNE_AFTER):
+            await bot.broadcast(blocked + [100, 101], '…')
+
+    asyncio.run(with_delivery_processing(bot, scenario()))
+    assert len(writes) == 1
+    upserts, deletes = writes[0]
+    assert upserts == [] and sorted(deletes) == [(user_id,) for user_id in blocked]
+    assert set(bot.subscriptions) == {100, 101}
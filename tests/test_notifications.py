@@ -0,0 +1,120 @@
+"""Планирование уведомлений: догоняние после перезапуска, напоминания и защита от повторов"""
+
+import asyncio
+
+from conftest import at, reload_city, write_timetable
+
+DAY = '2026-10-17'
+FAJR = ('cherkessk', 'Fajr', '05:18')
+
+
+def restart(bot, monkeypatch, now):
+    """Перезапуск процесса: новый планировщик, задания поднимаются из БД"""
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    monkeypatch.setattr(bot, 'scheduler', AsyncIOScheduler(timezone=bot.TIMEZONE))
+    bot.restore_notification_jobs(now)
+
+
+def run_job(bot, job_id, now):
+    fire_dt, is_reminder, targets = bot.planned_jobs[job_id]
+    asyncio.run(bot.run_notification_job(job_id, fire_dt, is_reminder, targets, now=now))
+
+
+def planned_targets(bot):
+    return {(fire_dt, is_reminder, target)
+            for fire_dt, is_reminder, targets in bot.planned_jobs.values() for target in targets}
+
+
+def test_restart_before_fire_time_keeps_job(bot, sent, monkeypatch, tmp_path):
+    write_timetable(tmp_path, overrides={'17.10': {'Fajr': '06:00'}})
+    reload_city()
+    asyncio.run(bot.plan_notifications(at(DAY, '05:00')))
+    restart(bot, monkeypatch, at(DAY, '05:59'))
+    assert f'prayer_{DAY}_06:00' in bot.planned_jobs
+    run_job(bot, f'prayer_{DAY}_06:00', at(DAY, '06:00'))
+    assert sent == [((('cherkessk', 'Fajr', '06:00'),), False)]
+
+
+def test_late_job_runs_inside_grace_window(bot, sent):
+    asyncio.run(bot.plan_notifications(at(DAY, '05:00')))
+    late = at(DAY, '05:18') + bot.timedelta(seconds=bot.NOTIFY_MISFIRE_GRACE - 60)
+    run_job(bot, f'prayer_{DAY}_05:18', late)
+    assert sent == [((FAJR,), False)]
+
+
+def test_job_after_grace_window_is_skipped(bot, sent):
+    asyncio.run(bot.plan_notifications(at(DAY, '05:00')))
+    late = at(DAY, '05:18') + bot.timedelta(seconds=bot.NOTIFY_MISFIRE_GRACE + 60)
+    run_job(bot, f'prayer_{DAY}_05:18', late)
+    assert sent == []
+
+
+def test_reminder_after_prayer_started_is_skipped(bot, sent, monkeypatch):
+    monkeypatch.setattr(bot, 'NOTIFY_MISFIRE_GRACE', 3600)  # опоздание в пределах окна, решает только правило напоминаний
+    asyncio.run(bot.plan_notifications(at(DAY, '05:00')))
+    run_job(bot, f'reminder_{DAY}_05:08', at(DAY, '05:19'))
+    assert sent == []
+
+
+def test_reminder_before_midnight_for_fajr_after_midnight(bot, sent, tmp_path):
+    write_timetable(tmp_path, overrides={'18.10': {'Fajr': '00:05'}})
+    reload_city()
+    asyncio.run(bot.plan_notifications(at(DAY, '12:00')))
+    job_id = f'reminder_{DAY}_23:55'
+    assert bot.planned_jobs[job_id][2] == (('cherkessk', 'Fajr', '00:05'),)
+    run_job(bot, job_id, at(DAY, '23:55'))
+    assert sent == [((('cherkessk', 'Fajr', '00:05'),), True)]
+    # Напоминание относится к намазу 18.10, а сам намаз остаётся в плане
+    assert ('2026-10-18', 'cherkessk', 'Fajr', True) in bot.fired_targets
+    asyncio.run(bot.plan_notifications(at(DAY, '23:56')))
+    assert job_id not in bot.planned_jobs
+    assert 'prayer_2026-10-18_00:05' in bot.planned_jobs
+
+
+def test_replanning_is_idempotent(bot):
+    now = at(DAY, '05:00')
+    assert asyncio.run(bot.plan_notifications(now)) > 0
+    planned = dict(bot.planned_jobs)
+    assert asyncio.run(bot.plan_notifications(now)) == 0
+    reload_city()  # то же содержимое CSV
+    assert asyncio.run(bot.plan_notifications(now)) == 0
+    assert bot.planned_jobs == planned
+    assert {job.id for job in bot.scheduler.get_jobs()} == set(planned)
+
+
+def test_fired_prayer_moved_by_reload_is_not_sent_twice(bot, sent, monkeypatch, tmp_path):
+    asyncio.run(bot.plan_notifications(at(DAY, '05:00')))
+    run_job(bot, f'prayer_{DAY}_05:18', at(DAY, '05:18'))
+    # Правка CSV после срабатывания: Фаджр перенесён на 05:23
+    write_timetable(tmp_path, overrides={'17.10': {'Fajr': '05:23'}})
+    reload_city()
+    asyncio.run(bot.plan_notifications(at(DAY, '05:20')))
+    assert not any(target[1] == 'Fajr' and fire_dt.date().isoformat() == DAY
+                   for fire_dt, _, target in planned_targets(bot))
+    # И после перезапуска сработавшая цель восстанавливается из БД
+    restart(bot, monkeypatch, at(DAY, '05:20'))
+    asyncio.run(bot.plan_notifications(at(DAY, '05:20')))
+    assert f'prayer_{DAY}_05:23' not in bot.planned_jobs
+    assert sent == [((FAJR,), False)]
+
+
+def test_isha_after_midnight_fires_next_day_once(bot, sent, tmp_path):
+    # Иша 08.05 в 00:14 уже 09.05, а Иша 09.05 — в 23:58 того же 09.05
+    write_timetable(tmp_path, overrides={'08.05': {'Isha': '24:14'}, '09.05': {'Isha': '23:58'}})
+    reload_city()
+    assert bot.get_prayer_times('cherkessk', at('2026-05-08', '12:00'))['Isha'] == '00:14'
+    asyncio.run(bot.plan_notifications(at('2026-05-08', '12:00')))
+    assert bot.planned_jobs['prayer_2026-05-09_00:14'][2] == (('cherkessk', 'Isha', '24:14'),)
+    assert 'prayer_2026-05-08_00:14' not in bot.planned_jobs
+    run_job(bot, 'prayer_2026-05-09_00:14', at('2026-05-09', '00:14'))
+    run_job(bot, 'prayer_2026-05-09_23:58', at('2026-05-09', '23:58'))
+    assert sent == [((('cherkessk', 'Isha', '24:14'),), False), ((('cherkessk', 'Isha', '23:58'),), False)]
+
+
+def test_fired_targets_are_forgotten_after_planning_window(bot, sent):
+    asyncio.run(bot.plan_notifications(at(DAY, '05:00')))
+    run_job(bot, f'prayer_{DAY}_05:18', at(DAY, '05:18'))
+    asyncio.run(bot.plan_notifications(at('2026-10-18', '05:00')))
+    assert (DAY, *FAJR[:2], False) in bot.fired_targets  # вчерашняя цель ещё нужна для сверки
+    asyncio.run(bot.plan_notifications(at('2026-10-20', '05:00')))
+    assert not any(key[0] <= DAY for key in bot.fired_targets)
@@ -0,0 +1,91 @@
+"""Расчёт расписания по координатам против prayer_times_cherkessk.csv"""
+
+import csv
+import os
+
+import pytest
+
+import prayer_calc
+from conftest import REPO_DIR
+
+CHERKESSK = prayer_calc.Location(44.22333, 42.05778, 3)
+MOSCOW = prayer_calc.Location(55.75, 37.62, 3)
+# Восход и закат зависят только от астрономии, поэтому должны совпасть с CSV.
+# Допуск в минутах: округление до минуты в обоих источниках плюс рефракция.
+SUNRISE_TOLERANCE = 3
+# Магриб в CSV в среднем на 3 мин раньше заката по расчёту; с этой поправкой
+# отклонение укладывается в 6 мин (без неё доходит до 9)
+MAGHRIB_ADJUSTMENT = -3
+MAGHRIB_TOLERANCE = 6
+
+
+@pytest.fixture(scope='module')
+def reference():
+    with open(os.path.join(REPO_DIR, 'prayer_times_cherkessk.csv'), encoding='utf-8') as file:
+        return {row['Date'].strip(): {k: v.strip() for k, v in row.items() if k != 'Date'} for row in csv.DictReader(file)}
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    prayer_calc._cache.clear()
+    yield
+    prayer_calc._cache.clear()
+
+
+def test_sunrise_and_maghrib_match_csv(reference):
+    calculated = prayer_calc.calculate_year([CHERKESSK], 2024, 'MWL', adjustments={'Maghrib': MAGHRIB_ADJUSTMENT})
+    report = prayer_calc.compare(calculated[CHERKESSK], reference)
+    assert report['Sunrise'][0] <= SUNRISE_TOLERANCE
+    assert report['Maghrib'][0] <= MAGHRIB_TOLERANCE
+
+
+def test_adjustments_shift_times(reference):
+    plain = prayer_calc.calculate_year([CHERKESSK], 2024, 'MWL')[CHERKESSK]
+    adjusted = prayer_calc.calculate_year([CHERKESSK], 2024, 'MWL', adjustments={'Duhr': 15})[CHERKESSK]
+    assert plain['17.10']['Duhr'] != adjusted['17.10']['Duhr']
+    hour, minute = map(int, plain['17.10']['Duhr'].split(':'))
+    assert adjusted['17.10']['Duhr'] == f"{(hour * 60 + minute + 15) // 60:02d}:{(minute + 15) % 60:02d}"
+    assert plain['17.10']['Fajr'] == adjusted['17.10']['Fajr']
+
+
+def test_result_does_not_depend_on_batch():
+    alone = prayer_calc.calculate_year([CHERKESSK], 2025)[CHERKESSK]
+    prayer_calc._cache.clear()
+    far_east = prayer_calc.Location(43.12, 131.89, 10)
+    batched = prayer_calc.calculate_year([far_east, CHERKESSK], 2025)[CHERKESSK]
+    assert batched == alone
+
+
+def test_parse_adjustments():
+    assert prayer_calc.parse_adjustments("Fajr=-2, Duhr=5") == {'Fajr': -2, 'Duhr': 5}
+    with pytest.raises(ValueError):
+        prayer_calc.parse_adjustments("Tahajjud=5")
+
+
+def test_uncached_calculation_leaves_module_cache_empty():
+    uncached = prayer_calc.calculate_year([CHERKESSK], 2025, cache=False)[CHERKESSK]
+    assert prayer_calc._cache == {}
+    assert uncached == prayer_calc.calculate_year([CHERKESSK], 2025)[CHERKESSK]
+
+
+def to_minutes(value):
+    hour, minute = map(int, value.split(':'))
+    return hour * 60 + minute
+
+
+def test_high_latitude_summer_keeps_fajr_and_isha():
+    year = prayer_calc.calculate_year([MOSCOW], 2026, 'MWL')[MOSCOW]
+    for date_str, times in year.items():
+        assert to_minutes(times['Fajr']) < to_minutes(times['Sunrise']), date_str
+        assert to_minutes(times['Maghrib']) < to_minutes(times['Isha']), date_str
+    # 08.05: Солнце не уходит на 18° для Фаджра, а угол Иши достигается только в 00:14
+    assert year['08.05']['Fajr'] < year['08.05']['Sunrise']
+    assert year['08.05']['Isha'] < '24:00'
+
+
+def test_isha_past_midnight_is_carried_not_wrapped():
+    year = prayer_calc.calculate_year([MOSCOW], 2026, 'MWL', high_lats=None)[MOSCOW]
+    assert 'Fajr' not in year['21.06'] and 'Isha' not in year['21.06']
+    assert year['08.05']['Isha'] == '24:14'
+    with pytest.raises(ValueError):
+        prayer_calc.calculate_year([MOSCOW], 2026, 'MWL', high_lats='Polar')
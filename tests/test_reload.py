@@ -0,0 +1,64 @@
+"""Перезагрузка расписания под нагрузкой: обработчики видят одну версию целиком"""
+
+import asyncio
+
+from aiogram.types import Update
+
+from conftest import at, callback_query, capture_requests, freeze_time, text_message, write_timetable
+
+DAY = '2026-10-17'
+NOW = at(DAY, '05:20')
+USERS = 300
+
+
+def versions(bot):
+    """Ответы обработчиков для текущего расписания: сегодня (два сообщения) и месяц"""
+    return {
+        'today': [bot.render_day(bot.DEFAULT_CITY, NOW), bot.get_current_prayer_status(bot.DEFAULT_CITY, NOW)],
+        'month': [bot.render_month(bot.DEFAULT_CITY, NOW.month)],
+    }
+
+
+def test_reload_under_concurrent_updates(bot, sent, monkeypatch, tmp_path):
+    freeze_time(bot, monkeypatch, NOW)
+    replies = capture_requests(bot, monkeypatch)
+    assert bot.load_prayer_data()
+    old = versions(bot)
+
+    async def scenario():
+        # Фаджр 17.10 уже разослан, затем правка CSV переносит все намазы
+        await bot.plan_notifications(at(DAY, '05:00'))
+        fire_dt, is_reminder, targets = bot.planned_jobs[f'prayer_{DAY}_05:18']
+        await bot.run_notification_job(f'prayer_{DAY}_05:18', fire_dt, is_reminder, targets, now=fire_dt)
+        fired = set(bot.fired_targets)
+        write_timetable(tmp_path, times={'Fajr': '05:30', 'Isha': '19:20'})
+
+        tasks, reload = [], None
+        for user_id in range(1, USERS + 1):
+            update = text_message(user_id, "🕐 Сегодня") if user_id % 3 else callback_query(user_id, f"month_{NOW.month}")
+            update = Update.model_validate({**update, 'update_id': user_id}, context={"bot": bot.bot})
+            tasks.append(asyncio.create_task(bot.dp.feed_update(bot.bot, update)))
+            if user_id == USERS // 3:
+                reload = asyncio.create_task(bot.reload_prayer_data())
+            await asyncio.sleep(0.0005)
+        results = await asyncio.gather(*tasks, reload, return_exceptions=True)
+        return fired, results
+
+    fired, results = asyncio.run(scenario())
+    assert not [r for r in results if isinstance(r, BaseException)]
+    new = versions(bot)
+    assert new['today'] != old['today']
+
+    seen = set()
+    for user_id in range(1, USERS + 1):
+        kind = 'today' if user_id % 3 else 'month'
+        texts = replies[user_id]
+        assert texts in (old[kind], new[kind]), f"пользователь {user_id}: смешанный ответ {texts}"
+        seen.add(texts == new[kind])
+    assert seen == {False, True}, "перезагрузка не пришлась на обработку обновлений"
+
+    # Сработавшие цели не потеряны, а перенесённый Фаджр не запланирован заново
+    assert fired <= bot.fired_targets
+    assert f'prayer_{DAY}_05:30' not in bot.planned_jobs
+    assert bot.load_notification_jobs()[f'prayer_{DAY}_05:18'][3]
+    assert sent == [((('cherkessk', 'Fajr', '05:18'),), False)]
@@ -0,0 +1,194 @@
+"""Подписки и город пользователя: отписка, тексты с городом, загрузка расписаний вне цикла событий"""
+
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+
+from aiogram.types import Update
+
+from conftest import at, capture_requests, text_message, write_timetable
+
+
+def feed(bot, *updates):
+    async def run():
+        for update_id, update in enumerate(updates, 1):
+            update = Update.model_validate({**update, 'update_id': update_id}, context={"bot": bot.bot})
+            await bot.dp.feed_update(bot.bot, update)
+        await bot.flush_subscriptions()
+    asyncio.run(run())
+
+
+def add_city(bot, tmp_path, city):
+    write_timetable(tmp_path, city)
+    bot.registry.discover()
+
+
+def stored(bot, user_id):
+    return bot.db_conn.execute('SELECT mask, city FROM subscriptions WHERE user_id = ?', (user_id,)).fetchone()
+
+
+def test_unsubscribe_keeps_city(bot, tmp_path, monkeypatch):
+    capture_requests(bot, monkeypatch)
+    add_city(bot, tmp_path, 'kazan')
+    bot.set_user_prayers(1, bot.ALL_PRAYERS_MASK)
+    bot.set_user_city(1, 'kazan')
+    feed(bot, text_message(1, "🔕 Выкл уведомления"))
+    assert 1 not in bot.subscriptions
+    assert bot.get_user_city(1) == 'kazan'
+    assert not any(1 in users for users in bot.prayer_subscribers['kazan'].values())
+    assert stored(bot, 1) == (0, 'kazan')
+
+
+def test_unsubscribe_without_city_deletes_row(bot, monkeypatch):
+    capture_requests(bot, monkeypatch)
+    feed(bot, text_message(1, "/start"))
+    assert stored(bot, 1) == (bot.ALL_PRAYERS_MASK, None)
+    feed(bot, text_message(1, "🔕 Выкл уведомления"))
+    assert stored(bot, 1) is None
+
+
+def test_pruned_user_loses_city(bot, tmp_path):
+    add_city(bot, tmp_path, 'kazan')
+    bot.set_user_prayers(1, bot.ALL_PRAYERS_MASK)
+    bot.set_user_city(1, 'kazan')
+    bot.remove_user(1)
+    assert bot.get_user_city(1) == bot.DEFAULT_CITY
+
+
+def test_start_and_info_show_user_city(bot, tmp_path, monkeypatch):
+    replies = capture_requests(bot, monkeypatch)
+    add_city(bot, tmp_path, 'kazan')
+    monkeypatch.setitem(bot.CALC_CITIES, 'kazan', (55.79, 49.12))
+    bot.set_user_city(1, 'kazan')
+    feed(bot, text_message(1, "/start"), text_message(1, "ℹ️ Информация"),
+         text_message(2, "/start"), text_message(2, "ℹ️ Информация"))
+    start, info = replies[1]
+    assert 'Kazan' in start and 'Черкесск' not in start
+    assert 'Kazan' in info and '55.79, 49.12' in info and '44.22333' not in info
+    start, info = replies[2]
+    assert 'Черкесск (КЧР)' in start and '44.22333, 42.05778' in info
+
+
+def test_planning_loads_timetables_off_the_event_loop(bot, tmp_path, monkeypatch):
+    for city in ('kazan', 'moscow'):
+        add_city(bot, tmp_path, city)
+    threads = []
+    read = bot.registry.read
+
+    def recording_read(city):
+        threads.append(threading.current_thread())
+        return read(city)
+
+    monkeypatch.setattr(bot.registry, 'read', recording_read)
+    asyncio.run(bot.plan_notifications(at('2026-10-17', '05:00')))
+    assert len(threads) == 3 and threading.main_thread() not in threads
+    assert set(bot.registry.loaded) == {'cherkessk', 'kazan', 'moscow'}
+
+
+def test_failed_subscription_load_stops_the_bot(bot, monkeypatch):
+    def broken_cursor():
+        raise bot.sqlite3.DatabaseError("database disk image is malformed")
+
+    async def on_startup():
+        bot.subscriptions_task = asyncio.create_task(bot.load_subscriptions())
+        return True
+
+    async def serve_forever(*args, **kwargs):
+        await asyncio.Event().wait()
+
+    async def shutdown_db():
+        pass  # общий пул потоков БД нужен следующим тестам
+
+    bot.subscriptions_loaded.clear()
+    monkeypatch.setattr(bot, 'subscriptions_task', None)
+    monkeypatch.setattr(bot, 'open_subscriptions_cursor', broken_cursor)
+    monkeypatch.setattr(bot, 'on_startup', on_startup)
+    monkeypatch.setattr(bot, 'run_polling', serve_forever)
+    monkeypatch.setattr(bot, 'shutdown_db', shutdown_db)
+    assert asyncio.run(asyncio.wait_for(bot.main(), 5)) == 1
+    assert not bot.subscriptions_loaded.is_set()
+
+
+def test_failed_timetable_load_stops_the_bot(bot, monkeypatch):
+    async def serve_forever(*args, **kwargs):
+        raise AssertionError("без расписания бот не должен принимать обновления")
+
+    async def shutdown_db():
+        bot.close_db()  # общий пул потоков БД нужен следующим тестам
+
+    bot.subscriptions_loaded.clear()
+    monkeypatch.setattr(bot, 'subscriptions_task', None)
+    monkeypatch.setattr(bot, 'SCHEDULER_ENABLED', False)
+    monkeypatch.setattr(bot, 'load_prayer_data', lambda: False)
+    monkeypatch.setattr(bot, 'run_polling', serve_forever)
+    monkeypatch.setattr(bot, 'shutdown_db', shutdown_db)
+    assert asyncio.run(asyncio.wait_for(bot.main(), 5)) == 1
+    assert bot.subscriptions_task is None
+
+
+def test_second_replica_on_same_db_does_not_start(bot, monkeypatch):
+    import fcntl
+
+    async def on_startup():
+        raise AssertionError("вторая реплика не должна стартовать")
+
+    monkeypatch.setattr(bot, 'on_startup', on_startup)
+    # Первая реплика — другой процесс: её блокировка на своём открытом файле
+    with open(f"{bot.SUBSCRIPTIONS_DB}.lock", 'w') as other:
+        fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        assert asyncio.run(bot.main()) == 1
+    assert bot.acquire_instance_lock()
+    bot.release_instance_lock()
+
+
+def test_user_id_set_matches_set(bot):
+    rng = random.Random(5)
+    compact, reference = bot.UserIdSet(), set()
+    for _ in range(5000):
+        user_id = rng.randrange(300)
+        if rng.random() < 0.6:
+            compact.add(user_id)
+            reference.add(user_id)
+        else:
+            compact.discard(user_id)
+            reference.discard(user_id)
+        assert (user_id in compact) == (user_id in reference)
+    assert list(compact) == sorted(reference) and len(compact) == len(reference)
+
+
+def test_user_masks_match_dict(bot):
+    rng = random.Random(6)
+    compact, reference = bot.UserMasks(), {}
+    for _ in range(5000):
+        user_id = rng.randrange(300)
+        if rng.random() < 0.6:
+            mask = rng.randrange(bot.ALL_PRAYERS_MASK + 1)
+            compact[user_id] = mask
+            reference[user_id] = mask
+        else:
+            assert compact.pop(user_id, None) == reference.pop(user_id, None)
+        assert compact.get(user_id) == reference.get(user_id)
+    assert dict(compact.items()) == reference and list(compact) == sorted(reference)
+
+
+def test_legacy_json_subscriptions_are_migrated(bot):
+    bot.close_db()
+    os.remove(bot.SUBSCRIPTIONS_DB)
+    legacy = sqlite3.connect(bot.SUBSCRIPTIONS_DB)
+    legacy.execute('CREATE TABLE subscriptions (user_id INTEGER PRIMARY KEY, prayers TEXT)')
+    legacy.executemany('INSERT INTO subscriptions VALUES (?, ?)',
+                       [(1, '["Fajr","Isha"]'), (2, ''), (3, None), (4, '[]')])
+    legacy.commit()
+    legacy.close()
+
+    bot.init_db()
+    bot.load_user_cities()
+    asyncio.run(bot.load_subscriptions())
+    bits = bot.PRAYER_BITS
+    # Пустое значение, как и в исходной версии, — подписка на все намазы, а пустой список — ни на один
+    assert dict(bot.subscriptions.items()) == {1: bits['Fajr'] | bits['Isha'], 2: bot.ALL_PRAYERS_MASK,
+                                                3: bot.ALL_PRAYERS_MASK, 4: 0}
+    assert stored(bot, 1) == (bits['Fajr'] | bits['Isha'], None)
+    assert set(bot.city_subscribers(bot.DEFAULT_CITY)['Isha']) == {1, 2, 3}
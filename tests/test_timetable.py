@@ -0,0 +1,27 @@
+"""Расписание в Timetable: текущий намаз и намазы после полуночи"""
+
+from conftest import at, reload_city, write_timetable
+
+
+def status(bot, day, hhmm):
+    return bot.get_current_prayer_status('cherkessk', at(day, hhmm))
+
+
+def test_status_before_isha_after_midnight(bot, tmp_path):
+    write_timetable(tmp_path, overrides={'08.05': {'Isha': '24:14'}})
+    reload_city()
+    text = status(bot, '2026-05-08', '21:00')
+    assert f"Текущий намаз:* {bot.PRAYER_NAMES['Maghrib']}" in text
+    assert f"До следующего ({bot.PRAYER_NAMES['Isha']}):* 3 ч. 14 мин." in text
+    # После полуночи Иша прошлого дня ещё впереди, а Фаджр 09.05 идёт за ней
+    assert f"До следующего ({bot.PRAYER_NAMES['Isha']}):* 0 ч. 9 мин." in status(bot, '2026-05-09', '00:05')
+    assert f"До следующего ({bot.PRAYER_NAMES['Fajr']}):*" in status(bot, '2026-05-09', '00:20')
+
+
+def test_wrapped_isha_in_csv_is_read_as_past_midnight(bot, tmp_path):
+    write_timetable(tmp_path, overrides={'08.05': {'Isha': '00:14'}})
+    reload_city()
+    timetable = bot.registry.get('cherkessk').timetable
+    assert timetable.minute_of(at('2026-05-08', '12:00'), 'Isha') == 24 * 60 + 14
+    assert bot.get_prayer_times('cherkessk', at('2026-05-08', '12:00'))['Isha'] == '00:14'
+    assert f"До следующего ({bot.PRAYER_NAMES['Isha']}):*" in status(bot, '2026-05-08', '21:00')
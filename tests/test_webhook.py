@@ -0,0 +1,33 @@
+"""Режимы приёма обновлений: webhook и переход обратно на polling"""
+
+import asyncio
+
+
+def test_polling_removes_webhook_first(bot, monkeypatch):
+    calls = []
+
+    async def delete_webhook(**kwargs):
+        calls.append('delete_webhook')
+        return True
+
+    async def start_polling(*args, **kwargs):
+        calls.append('start_polling')
+
+    monkeypatch.setattr(bot.bot, 'delete_webhook', delete_webhook)
+    monkeypatch.setattr(bot.dp, 'start_polling', start_polling)
+    asyncio.run(bot.run_polling())
+    assert calls == ['delete_webhook', 'start_polling']
+
+
+def test_webhook_rejects_wrong_secret_without_error(bot, monkeypatch):
+    from aiohttp.test_utils import make_mocked_request
+
+    monkeypatch.setattr(bot, 'WEBHOOK_SECRET', 'secret')
+    server = bot.WebhookServer()
+
+    async def status(token):
+        request = make_mocked_request('POST', bot.WEBHOOK_PATH, headers={'X-Telegram-Bot-Api-Secret-Token': token})
+        return (await server.handle(request)).status
+
+    assert asyncio.run(status('wrong')) == 401
+    assert asyncio.run(status('секрет')) == 401
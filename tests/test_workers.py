@@ -0,0 +1,104 @@
+"""Рассылка через процессы-воркеры: срок рассылки и деление лимита скорости"""
+
+import asyncio
+import time
+
+import pytest
+
+
+@pytest.fixture
+def queue(bot, tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, 'BROADCAST_QUEUE_DB', str(tmp_path / 'broadcast_queue.db'))
+    monkeypatch.setattr(bot, 'BROADCAST_WORKERS', 2)
+    monkeypatch.setattr(bot, 'BROADCAST_POLL_INTERVAL', 0.02)
+    bot.open_broadcast_queue(reset=True)
+    yield bot
+    bot.close_broadcast_queue()
+
+
+def test_sharded_broadcast_gives_up_after_deadline(queue, monkeypatch):
+    bot = queue
+    monkeypatch.setattr(bot, 'BROADCAST_SHARD_GRACE', 0.2)
+    monkeypatch.setattr(bot, 'BROADCAST_RATE', 1000)
+    monkeypatch.setattr(bot, 'CHAT_MIN_INTERVAL', 0)
+
+    async def scenario():
+        # Воркер 1 взял свой шард и завис, воркер 0 не запущен вовсе
+        sending = asyncio.create_task(bot.broadcast_sharded([10, 11, 12, 13], '…'))
+        while await bot.run_db(bot.claim_shard, 1) is None:
+            await asyncio.sleep(0.01)
+        started = time.monotonic()
+        stats = await asyncio.wait_for(sending, 5)
+        return stats, time.monotonic() - started
+
+    stats, waited = asyncio.run(scenario())
+    assert waited < 1
+    assert (stats.sent, stats.failed) == (0, 0)
+    assert bot.queue_conn.execute('SELECT COUNT(*) FROM broadcast_shards').fetchone()[0] == 0
+    assert bot.claim_shard(0) is None  # брошенный шард не достанется запоздавшему воркеру
+
+
+def test_finished_shards_are_collected_before_deadline(queue):
+    bot = queue
+
+    async def worker(index):
+        while (shard := await bot.run_db(bot.claim_shard, index)) is None:
+            await asyncio.sleep(0.01)
+        await bot.run_db(bot.finish_shard, shard[0], {
+            'sent': 2, 'failed': 0, 'blocked': 0, 'retried': 0, 'started': time.time(), 'delays': [0.1, 0.2],
+            'outcomes': {'ok': bot.json.loads(shard[3])}})
+
+    async def scenario():
+        sending = asyncio.create_task(bot.broadcast_sharded([10, 11, 12, 13], '…'))
+        await asyncio.gather(worker(0), worker(1))
+        return await asyncio.wait_for(sending, 5)
+
+    stats = asyncio.run(scenario())
+    assert stats.sent == 4 and len(stats.delays) == 4
+    assert bot.delivery_events.qsize() == 4
+
+
+def test_worker_rate_shares_stay_within_global_limit(queue, monkeypatch):
+    bot = queue
+
+    async def supervise_worker(index):
+        pass
+
+    monkeypatch.setattr(bot, 'supervise_worker', supervise_worker)
+    monkeypatch.setattr(bot, 'broadcast_limiter', bot.broadcast_limiter)
+    monkeypatch.setattr(bot, 'worker_tasks', [])
+
+    async def scenario():
+        bot.start_broadcast_workers()
+        await asyncio.gather(*bot.worker_tasks)
+
+    asyncio.run(scenario())
+    # Повторы основного процесса идут через его долю, а не через полный лимит
+    retries_rate = bot.broadcast_limiter.rate
+    worker_rate = bot.share_limiter((1 - bot.BROADCAST_RETRY_SHARE) / bot.BROADCAST_WORKERS).rate
+    assert retries_rate == pytest.approx(bot.BROADCAST_RATE * bot.BROADCAST_RETRY_SHARE)
+    assert retries_rate + bot.BROADCAST_WORKERS * worker_rate == pytest.approx(bot.BROADCAST_RATE)
+
+
+@pytest.mark.parametrize('workers', [1, 2, 4])
+def test_deadline_covers_healthy_workers_at_default_rates(queue, monkeypatch, workers):
+    bot = queue
+    monkeypatch.setattr(bot, 'BROADCAST_WORKERS', workers)
+    user_ids = list(range(100000))
+    bot.enqueue_shards('…', {}, {w: [u for u in user_ids if u % workers == w] for w in range(workers)})
+    queued = max(bot.worker_backlog().values())
+    # Здоровые воркеры на своей доле лимита (25/с за вычетом доли повторов) успевают к сроку с запасом
+    sending_s = queued / (bot.BROADCAST_RATE * (1 - bot.BROADCAST_RETRY_SHARE) / workers)
+    assert (bot.BROADCAST_RATE, bot.BROADCAST_RETRY_SHARE) == (25, 0.1)
+    assert bot.shard_timeout(queued) > sending_s * 1.1 + bot.CHAT_MIN_INTERVAL
+
+
+def test_deadline_counts_shards_queued_ahead(queue):
+    bot = queue
+    bot.enqueue_shards('первая', {}, {0: [10, 12, 14], 1: [11]})
+    bot.claim_shard(0)
+    bot.enqueue_shards('вторая', {}, {0: [16], 1: [13, 15]})
+    assert bot.worker_backlog() == {0: 4, 1: 3}
+    [(shard_id,)] = bot.queue_conn.execute("SELECT shard_id FROM broadcast_shards WHERE status = 'running'").fetchall()
+    bot.finish_shard(shard_id, {})
+    assert bot.worker_backlog() == {0: 1, 1: 3}